@@ -0,0 +1,58 @@
+from collections import Counter
+from typing import Iterable, Tuple
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Attendance, AttendanceCounter
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def increment_attendance_counters(db: Session, marks: Iterable[Tuple[int, int]]):
+    """Add newly written attendances, given as (user_id, unit_id) pairs, to the counters.
+
+    Runs in the caller's transaction: call it after adding the Attendance
+    rows and before committing, so the rows and the counts land together.
+    """
+    totals = Counter(marks)
+    if not totals:
+        return
+    rows = [
+        {"user_id": user_id, "unit_id": unit_id, "attended": count}
+        for (user_id, unit_id), count in totals.items()
+    ]
+    upsert_insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert_insert is not None:
+        stmt = upsert_insert(AttendanceCounter)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[AttendanceCounter.user_id, AttendanceCounter.unit_id],
+            set_={"attended": AttendanceCounter.attended + stmt.excluded.attended}
+        ), rows)
+        return
+
+    # Other backends: update the pairs that exist, insert the rest
+    existing = set(db.execute(select(AttendanceCounter.user_id, AttendanceCounter.unit_id).where(
+        AttendanceCounter.user_id.in_({row["user_id"] for row in rows}),
+        AttendanceCounter.unit_id.in_({row["unit_id"] for row in rows})
+    )).all())
+    for row in rows:
+        if (row["user_id"], row["unit_id"]) in existing:
+            db.execute(update(AttendanceCounter).where(
+                AttendanceCounter.user_id == row["user_id"],
+                AttendanceCounter.unit_id == row["unit_id"]
+            ).values(attended=AttendanceCounter.attended + row["attended"]))
+    new_rows = [row for row in rows if (row["user_id"], row["unit_id"]) not in existing]
+    if new_rows:
+        db.execute(insert(AttendanceCounter), new_rows)
+
+def rebuild_attendance_counters(db: Session) -> int:
+    """Recompute every counter from the raw attendance rows; returns how many counters were written"""
+    db.execute(delete(AttendanceCounter))
+    result = db.execute(insert(AttendanceCounter).from_select(
+        ["user_id", "unit_id", "attended"],
+        select(Attendance.user_id, Attendance.unit_id, func.count(Attendance.id)).group_by(
+            Attendance.user_id, Attendance.unit_id
+        )
+    ))
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,188 @@
+"""Live "student marked present" events for open class sessions.
+
+Every write path publishes the attendance rows it committed, and each
+open lecturer dashboard holds one subscription to its session and gets
+them pushed as Server-Sent Events. Nothing polls the database while a
+class is running, however many dashboards are open.
+"""
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per dashboard; a dashboard that falls further behind is
+# disconnected and catches up from the database when it reconnects
+EVENT_QUEUE_SIZE = 1000
+# Comment lines keep proxies from closing an idle stream
+KEEPALIVE_SECONDS = 15.0
+# How long EventSource waits before reconnecting
+RETRY_MS = 3000
+
+_CLOSED = object()
+_OVERFLOWED = object()
+
+def attendance_event(
+    attendance_id: int,
+    session_id: Optional[int],
+    unit_id: int,
+    user_id: int,
+    attendance_type,
+    username: Optional[str] = None,
+    full_name: Optional[str] = None,
+    admission_number: Optional[str] = None,
+    marked_at: Optional[datetime] = None
+) -> dict:
+    return {
+        "attendance_id": attendance_id,
+        "session_id": session_id,
+        "unit_id": unit_id,
+        "user_id": user_id,
+        "username": username,
+        "full_name": full_name,
+        "admission_number": admission_number,
+        "attendance_type": getattr(attendance_type, "value", attendance_type),
+        "marked_at": (marked_at or datetime.utcnow()).isoformat()
+    }
+
+def format_sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+class Subscription:
+    """One dashboard's queue of events for a session; lives on its event loop"""
+
+    def __init__(self, session_id: int, max_queue: int):
+        self.session_id = session_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.max_queue = max_queue
+        self.overflowed = False
+
+    def offer(self, item):
+        """Queue an item; runs on the subscriber's loop"""
+        if self.overflowed:
+            return
+        if item is not _CLOSED and self.queue.qsize() >= self.max_queue:
+            self.overflowed = True
+            item = _OVERFLOWED
+        self.queue.put_nowait(item)
+
+class AttendanceEventBus:
+    """Fans attendance events out to the dashboards watching each class session.
+
+    publish() and close_session() may be called from any thread (database
+    work runs on the worker pool); delivery is handed to each subscriber's
+    event loop.
+    """
+
+    def __init__(self, max_queue: int = EVENT_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, session_id: int) -> Subscription:
+        subscription = Subscription(session_id, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.session_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.session_id]
+            if subscription.overflowed:
+                self.overflows += 1
+
+    def _deliver(self, session_id: int, items: List):
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for subscription in subscribers:
+            for item in items:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, item)
+                except RuntimeError:
+                    # The subscriber's loop has gone away
+                    self.unsubscribe(subscription)
+                    break
+            else:
+                self.delivered += len(items)
+
+    def publish(self, events: Iterable[dict]):
+        """Push committed attendance events to the dashboards of their sessions"""
+        by_session: Dict[int, List[dict]] = {}
+        for event in events:
+            self.published += 1
+            if event.get("session_id") is not None:
+                by_session.setdefault(event["session_id"], []).append(event)
+        if not self._subscribers:
+            return
+        for session_id, session_events in by_session.items():
+            self._deliver(session_id, session_events)
+
+    def close_session(self, session_id: int):
+        """Tell the session's dashboards the broadcast has ended"""
+        self._deliver(session_id, [_CLOSED])
+
+    async def stream(
+        self,
+        subscription: Subscription,
+        backlog: List[dict],
+        ended: bool = False,
+        keepalive: float = KEEPALIVE_SECONDS
+    ) -> AsyncIterator[str]:
+        """The SSE body: the backlog, then live events until the session ends.
+
+        Subscribe before loading the backlog so nothing committed in between
+        is missed; events already sent as backlog are skipped by id.
+        """
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            last_id = 0
+            for event in backlog:
+                last_id = event["attendance_id"]
+                yield format_sse("marked", event, last_id)
+            while not ended:
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is _OVERFLOWED:
+                    # Drop the connection; EventSource reconnects with Last-Event-ID
+                    logger.warning(f"Dashboard for session {subscription.session_id} fell behind; disconnecting")
+                    return
+                if item is _CLOSED:
+                    ended = True
+                    break
+                if item["attendance_id"] <= last_id:
+                    continue
+                last_id = item["attendance_id"]
+                yield format_sse("marked", item, last_id)
+            yield format_sse("end", {"session_id": subscription.session_id})
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "published": self.published,
+                "delivered": self.delivered,
+                "overflows": self.overflows
+            }
+
+attendance_events = AttendanceEventBus()
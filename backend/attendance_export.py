@@ -0,0 +1,153 @@
+"""Stream attendance records out as CSV or Parquet without buffering them.
+
+Rows come off a server-side cursor in partitions of EXPORT_CHUNK_ROWS
+and each partition is encoded and handed on before the next is fetched,
+so memory use depends on the chunk size, not on how many rows match.
+Parquet output needs the optional pyarrow package.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Sequence
+from sqlalchemy import select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import aliased
+from models import Attendance, Unit, User
+
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_FORMATS = ("csv", "parquet")
+
+COLUMNS = [
+    "attendance_id", "marked_at", "unit_code", "unit_name", "student_id", "username",
+    "admission_number", "full_name", "attendance_type", "marked_by"
+]
+
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+class ExportFormatUnavailable(Exception):
+    """Raised when the requested format needs a package that isn't installed"""
+
+def export_query(
+    unit_ids: Optional[Sequence[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Attendance rows with unit and student details, oldest first"""
+    marker = aliased(User)
+    query = (
+        select(
+            Attendance.id, Attendance.marked_at, Unit.code, Unit.name, User.id, User.username,
+            User.admission_number, User.full_name, Attendance.attendance_type, marker.username
+        )
+        .join(Unit, Unit.id == Attendance.unit_id)
+        .join(User, User.id == Attendance.user_id)
+        .outerjoin(marker, marker.id == Attendance.marked_by)
+        .order_by(Attendance.marked_at, Attendance.id)
+    )
+    if unit_ids is not None:
+        query = query.where(Attendance.unit_id.in_(list(unit_ids)))
+    if start is not None:
+        query = query.where(Attendance.marked_at >= start)
+    if end is not None:
+        query = query.where(Attendance.marked_at < end)
+    return query
+
+def iter_partitions(connection: Connection, query, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[List[tuple]]:
+    """Fetch the query in chunks from a server-side cursor"""
+    result = connection.execution_options(stream_results=True, yield_per=chunk_rows).execute(query)
+    try:
+        for partition in result.partitions(chunk_rows):
+            yield [tuple(row) for row in partition]
+    finally:
+        result.close()
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "value"):  # enums
+        return value.value
+    return value
+
+def iter_csv(partitions: Iterable[List[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for partition in partitions:
+        writer.writerows([_cell(value) for value in row] for row in partition)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def iter_parquet(partitions: Iterable[List[tuple]]) -> Iterator[bytes]:
+    """One Parquet row group per partition, flushed as soon as it is written"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportFormatUnavailable("Parquet export needs the pyarrow package")
+
+    schema = pa.schema([
+        ("attendance_id", pa.int64()), ("marked_at", pa.timestamp("us")), ("unit_code", pa.string()),
+        ("unit_name", pa.string()), ("student_id", pa.int64()), ("username", pa.string()),
+        ("admission_number", pa.string()), ("full_name", pa.string()), ("attendance_type", pa.string()),
+        ("marked_by", pa.string()),
+    ])
+    sink = io.BytesIO()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for partition in partitions:
+            columns = list(zip(*partition)) if partition else [[] for _ in COLUMNS]
+            columns[8] = [_cell(value) for value in columns[8]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    # The footer is written when the writer closes
+    yield sink.getvalue()
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def iter_export(
+    connection: Connection,
+    export_format: str = "csv",
+    unit_ids: Optional[Sequence[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    gzip: bool = False,
+    chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> Iterator[bytes]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+    partitions = iter_partitions(connection, export_query(unit_ids, start, end), chunk_rows)
+    chunks = iter_csv(partitions) if export_format == "csv" else iter_parquet(partitions)
+    return iter_gzip(chunks) if gzip else chunks
+
+def iter_export_on(engine: Engine, *args, **kwargs) -> Iterator[bytes]:
+    """iter_export on a connection of its own, open only while the export is read.
+
+    For streaming responses, which outlive the request's session.
+    """
+    connection = engine.connect()
+    try:
+        yield from iter_export(connection, *args, **kwargs)
+    finally:
+        connection.close()
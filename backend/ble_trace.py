@@ -0,0 +1,151 @@
+"""Record and replay BLE advertisement streams.
+
+A trace file starts with MAGIC and holds one fixed-size record per
+advertisement followed by the device's local name:
+
+    <d  seconds since the start of the trace
+    b   RSSI in dBm
+    6s  device address, as raw bytes
+    B   length of the UTF-8 local name that follows (0 = none)
+
+Files ending in ".gz" are gzip-compressed transparently.
+"""
+import asyncio
+import gzip
+import inspect
+import random
+import struct
+import time
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+MAGIC = b"BLETRACE\x01\n"
+RECORD = struct.Struct("<db6sB")
+
+class Advertisement(NamedTuple):
+    timestamp: float
+    address: str
+    local_name: Optional[str]
+    rssi: int
+
+class ReplayDevice(NamedTuple):
+    """Stand-in for bleak's BLEDevice"""
+    address: str
+    name: Optional[str]
+    rssi: int
+
+class ReplayAdvertisementData(NamedTuple):
+    """Stand-in for bleak's AdvertisementData"""
+    local_name: Optional[str]
+    rssi: int
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+def _pack_address(address: str) -> bytes:
+    return bytes.fromhex(address.replace(":", "").replace("-", ""))
+
+def _unpack_address(raw: bytes) -> str:
+    return ":".join(f"{byte:02X}" for byte in raw)
+
+def write_trace(path: str, advertisements: Iterable[Advertisement]) -> int:
+    """Write advertisements to a trace file; returns the number written"""
+    count = 0
+    with _open(path, "wb") as f:
+        f.write(MAGIC)
+        for adv in advertisements:
+            name = (adv.local_name or "").encode("utf-8")[:255]
+            f.write(RECORD.pack(adv.timestamp, adv.rssi, _pack_address(adv.address), len(name)))
+            f.write(name)
+            count += 1
+    return count
+
+def read_trace(path: str) -> Iterator[Advertisement]:
+    """Stream advertisements back out of a trace file"""
+    with _open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a BLE trace file")
+        while True:
+            header = f.read(RECORD.size)
+            if not header:
+                break
+            if len(header) < RECORD.size:
+                raise ValueError(f"Truncated record in {path}")
+            timestamp, rssi, raw_address, name_length = RECORD.unpack(header)
+            name = f.read(name_length).decode("utf-8") if name_length else None
+            yield Advertisement(timestamp, _unpack_address(raw_address), name, rssi)
+
+def random_address(rng: random.Random) -> str:
+    return ":".join(f"{rng.randrange(256):02X}" for _ in range(6))
+
+def generate_trace(
+    addresses: List[str],
+    duration: float = 30.0,
+    interval: float = 1.0,
+    seed: int = 0
+) -> List[Advertisement]:
+    """Synthetic trace: every address advertises about once per interval"""
+    rng = random.Random(seed)
+    advertisements = []
+    for address in addresses:
+        timestamp = rng.uniform(0, interval)
+        rssi = rng.randint(-95, -40)
+        while timestamp < duration:
+            advertisements.append(Advertisement(timestamp, address, None, rssi + rng.randint(-3, 3)))
+            timestamp += interval * rng.uniform(0.8, 1.2)
+    advertisements.sort(key=lambda adv: adv.timestamp)
+    return advertisements
+
+class ReplayScanner:
+    """Drop-in replacement for BleakScanner that replays a recorded trace.
+
+    speed=1.0 replays in real time, 10.0 ten times faster and 0 as fast as
+    the callback allows. Callback latencies are recorded in `latencies`.
+    """
+
+    def __init__(
+        self,
+        detection_callback: Optional[Callable] = None,
+        trace: Iterable[Advertisement] = (),
+        speed: float = 1.0
+    ):
+        self.detection_callback = detection_callback
+        self.trace = trace
+        self.speed = speed
+        self.latencies: List[float] = []
+        self.replayed = 0
+        self.finished = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._replay())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.finished.set()
+
+    async def _replay(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            for adv in self.trace:
+                if self.speed > 0:
+                    delay = started + adv.timestamp / self.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.replayed % 256 == 0:
+                    await asyncio.sleep(0)  # let the batch worker run
+                device = ReplayDevice(adv.address, adv.local_name, adv.rssi)
+                data = ReplayAdvertisementData(adv.local_name, adv.rssi)
+                callback_started = time.perf_counter()
+                result = self.detection_callback(device, data)
+                if inspect.isawaitable(result):
+                    await result
+                self.latencies.append(time.perf_counter() - callback_started)
+                self.replayed += 1
+        finally:
+            self.finished.set()
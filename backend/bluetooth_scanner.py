@@ -1,11 +1,20 @@
 import asyncio
 from bleak import BleakScanner
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from datetime import datetime
-from typing import Dict, Set, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, FrozenSet, NamedTuple, Set, Optional, List, Tuple
 import logging
-from models import User, Enrollment, Attendance, UserRole, AttendanceType
-from database import SessionLocal
+import time
+from models import Attendance, AttendanceType
+from database import SessionLocal, run_on_executor
+from attendance_counters import increment_attendance_counters
+from attendance_events import attendance_event, attendance_events
+from class_sessions import day_sessions, end_class_sessions, open_class_session
+from student_index import StudentIndex, StudentEntry, normalize_mac
+from device_tracker import DeviceTracker, DEVICE_TTL_SECONDS, MAX_TRACKED_DEVICES
+from metrics import scanner_batch_duration
 import traceback
 
 # Configure logging
@@ -15,35 +24,240 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Detections are drained from the queue in batches of at most BATCH_SIZE
+# addresses, waiting up to BATCH_WINDOW_SECONDS for a batch to fill up.
+BATCH_SIZE = 200
+BATCH_WINDOW_SECONDS = 0.05
+
+# Broadcast sessions that are never stopped are closed after this long
+SESSION_TTL_SECONDS = 3 * 60 * 60
+# How often the cleanup task expires stale devices and sessions
+EXPIRY_CHECK_SECONDS = 5
+
+class SessionSnapshot(NamedTuple):
+    """What the database thread needs of a broadcast session, copied on the event loop"""
+    beacon_id: str
+    unit_id: int
+    lecturer_id: Optional[int]
+    session_id: Optional[int]
+    marked: FrozenSet[int]
+
+class BatchResult(NamedTuple):
+    """Outcome of a batch, applied to the sessions back on the event loop"""
+    written: int
+    session_ids: Dict[str, int]  # beacon_id -> ClassSession opened for it during the batch
+    marks: List[Tuple[str, int]]  # (beacon_id, user_id) now marked
+
+class BroadcastSession:
+    """A single lecturer's broadcast: its unit scope, expiry and detected students"""
+
+    def __init__(
+        self,
+        broadcast_info: dict,
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+        device_ttl: float = DEVICE_TTL_SECONDS,
+        max_devices: int = MAX_TRACKED_DEVICES
+    ):
+        self.info = broadcast_info
+        self.beacon_id: str = broadcast_info["beacon_id"]
+        self.unit_id: int = broadcast_info["unit_id"]
+        self.unit_code: Optional[str] = broadcast_info.get("unit_code")
+        self.lecturer_id: Optional[int] = broadcast_info.get("lecturer_id")
+        self.session_id: Optional[int] = broadcast_info.get("session_id")  # ClassSession row
+        self.started_at = datetime.utcnow()
+        self.expires_at = self.started_at + timedelta(seconds=ttl_seconds)
+        self.detected_devices = DeviceTracker(device_ttl, max_devices)
+        self.marked: Set[int] = set()  # Students already marked in this session
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        return (now or datetime.utcnow()) >= self.expires_at
+
+    def needs_marking(self, entry: StudentEntry) -> bool:
+        """Whether a known student still has to be marked in this session"""
+        return self.unit_id in entry.unit_ids and entry.user_id not in self.marked
+
+    def snapshot(self) -> SessionSnapshot:
+        return SessionSnapshot(self.beacon_id, self.unit_id, self.lecturer_id, self.session_id, frozenset(self.marked))
+
+    def to_dict(self) -> dict:
+        return {
+            "beacon_id": self.beacon_id,
+            "unit_id": self.unit_id,
+            "unit_code": self.unit_code,
+            "lecturer_id": self.lecturer_id,
+            "session_id": self.session_id,
+            "started_at": self.started_at.isoformat(),
+            "expires_at": self.expires_at.isoformat(),
+            "detected_devices": len(self.detected_devices),
+            "marked": len(self.marked)
+        }
+
 class BluetoothScanner:
-    def __init__(self, db: Optional[Session] = None):
-        self.detected_devices: Dict[str, datetime] = {}
+    def __init__(
+        self,
+        db: Optional[Session] = None,
+        batch_size: int = BATCH_SIZE,
+        batch_window: float = BATCH_WINDOW_SECONDS,
+        device_ttl: float = DEVICE_TTL_SECONDS,
+        max_devices: int = MAX_TRACKED_DEVICES,
+        scanner_factory: Optional[Callable] = None
+    ):
+        self.scanner_factory = scanner_factory  # Defaults to BleakScanner
+        self.device_ttl = device_ttl
+        self.max_devices = max_devices
+        self.detected_devices = DeviceTracker(device_ttl, max_devices)
         self.scanning = False
         self.db = db or SessionLocal()
+        # self.db is only ever used from this one thread: Sessions are not thread-safe
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scanner-db")
         self.cleanup_task: Optional[asyncio.Task] = None
+        # Stops of expired sessions, keyed by beacon id; the loop only holds weak references
+        self.expiry_stops: Dict[str, asyncio.Task] = {}
         self.scanner: Optional[BleakScanner] = None
         self.last_error: Optional[str] = None
-        self.active_broadcast = None  # Store active broadcast info
+        # Concurrent broadcast sessions fed from the one BLE scanner
+        self.sessions: Dict[str, BroadcastSession] = {}
+        self._sessions_by_unit: Dict[int, List[BroadcastSession]] = {}
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.detection_queue: Optional[asyncio.Queue] = None
+        self.worker_task: Optional[asyncio.Task] = None
+        self.student_index = StudentIndex()
+        self.pipeline_stats = {
+            "detections": 0,
+            "new_devices": 0,
+            "enqueued": 0,
+            "rejected_unknown": 0,
+            "not_enrolled": 0,
+            "dedup_hits": 0,
+            "batches": 0,
+            "devices_processed": 0,
+            "attendance_written": 0,
+            "last_batch_latency_ms": 0.0,
+            "max_batch_latency_ms": 0.0,
+            "total_batch_latency_ms": 0.0
+        }
         logger.info("BluetoothScanner initialized")
 
+    async def run_db(self, func, *args):
+        """Run blocking work that uses self.db on the scanner's database thread"""
+        return await run_on_executor(self.db_executor, func, *args)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of detected addresses waiting to be processed"""
+        return self.detection_queue.qsize() if self.detection_queue else 0
+
+    def get_pipeline_stats(self) -> dict:
+        """Snapshot of the detection pipeline counters"""
+        stats = dict(self.pipeline_stats)
+        stats["queue_depth"] = self.queue_depth
+        stats["tracked_devices"] = len(self.detected_devices)
+        stats["evicted_devices"] = self.detected_devices.evictions
+        stats["avg_batch_latency_ms"] = (
+            stats["total_batch_latency_ms"] / stats["batches"] if stats["batches"] else 0.0
+        )
+        # Share of newly seen devices that needed no database work
+        stats["dedup_hit_ratio"] = (
+            stats["dedup_hits"] / stats["new_devices"] if stats["new_devices"] else 0.0
+        )
+        return stats
+
+    @property
+    def active_broadcast(self) -> Optional[dict]:
+        """Broadcast info of the most recently started session, if any"""
+        if not self.sessions:
+            return None
+        return next(reversed(self.sessions.values())).info
+
+    def add_session(self, broadcast_info: dict, ttl_seconds: float = SESSION_TTL_SECONDS) -> BroadcastSession:
+        """Register a broadcast session without touching the BLE scanner"""
+        session = BroadcastSession(broadcast_info, ttl_seconds, self.device_ttl, self.max_devices)
+        self.remove_session(session.beacon_id)
+        self.sessions[session.beacon_id] = session
+        self._sessions_by_unit.setdefault(session.unit_id, []).append(session)
+        return session
+
+    def remove_session(self, beacon_id: str) -> Optional[BroadcastSession]:
+        """Forget a broadcast session; returns it if it existed"""
+        session = self.sessions.pop(beacon_id, None)
+        if session:
+            unit_sessions = self._sessions_by_unit.get(session.unit_id, [])
+            if session in unit_sessions:
+                unit_sessions.remove(session)
+            if not unit_sessions:
+                self._sessions_by_unit.pop(session.unit_id, None)
+        return session
+
+    def _matching_sessions(self, entry: StudentEntry) -> List[BroadcastSession]:
+        """Sessions for any unit the student is enrolled in"""
+        if not self._sessions_by_unit:
+            return []
+        return [
+            session
+            for unit_id in entry.unit_ids
+            for session in self._sessions_by_unit.get(unit_id, ())
+        ]
+
     async def device_detection_callback(self, device, advertisement_data):
         """Callback function for when a device is detected"""
         try:
-            if not hasattr(device, 'address'):
+            if not getattr(device, 'address', None):
                 logger.warning(f"Invalid device detected: {device}")
                 return
                 
-            address = device.address
+            address = normalize_mac(device.address)
             logger.debug(f"Device detected: {address}")
+            self.pipeline_stats["detections"] += 1
             
-            if address in self.detected_devices:
-                # Update last seen time
-                self.detected_devices[address] = datetime.utcnow()
+            index_ready = not self.student_index.is_stale()
+            entry = self.student_index.lookup(address) if index_ready else None
+            new_device = self.detected_devices.touch(address)
+            if new_device:
+                logger.info(f"New device detected: {address}")
+                self.pipeline_stats["new_devices"] += 1
+            else:
                 logger.debug(f"Updated last seen time for device: {address}")
+
+            if entry is None:
+                if not new_device:
+                    return
+                if index_ready:
+                    # Phones and earbuds that belong to no student never reach the database
+                    self.pipeline_stats["rejected_unknown"] += 1
+                    logger.debug(f"Ignoring device not registered to a student: {address}")
+                    return
+                needs_marking = True
+            elif self.sessions:
+                matching_sessions = self._matching_sessions(entry)
+                if not matching_sessions:
+                    # A student, but in none of the open sessions' units
+                    if new_device:
+                        self.pipeline_stats["not_enrolled"] += 1
+                    return
+                # Newness is decided per session: a device the scanner already
+                # tracks is still new to a session that opened after it was seen
+                fresh_sessions = [
+                    session for session in matching_sessions
+                    if session.detected_devices.touch(address)
+                ]
+                needs_marking = any(session.needs_marking(entry) for session in fresh_sessions)
+                if not needs_marking and not (new_device or fresh_sessions):
+                    return
+            else:
+                if not new_device:
+                    return
+                needs_marking = True
+
+            if not needs_marking:
+                # Already marked in every open session of the student's units
+                self.pipeline_stats["dedup_hits"] += 1
+                logger.debug(f"Student {entry.username} needs no marking in the open sessions")
+            elif self.worker_task is not None:
+                # Hand off to the batch worker so the callback never blocks
+                self.detection_queue.put_nowait(address)
+                self.pipeline_stats["enqueued"] += 1
             else:
-                # New device detected
-                self.detected_devices[address] = datetime.utcnow()
-                logger.info(f"New device detected: {address}")
                 await self.process_device(address)
         except Exception as e:
             self.last_error = str(e)
@@ -52,108 +266,355 @@ class BluetoothScanner:
 
     async def process_device(self, address: str):
         """Process a detected device and update attendance if it matches a student"""
-        try:
-            logger.info(f"Processing device: {address}")
-            
-            # Query database for student with matching Bluetooth address
-            student = self.db.query(User).filter(
-                User.bluetooth_address == address,
-                User.role == UserRole.STUDENT
-            ).first()
-
-            if student:
-                logger.info(f"Found matching student: {student.username}")
-                
-                # Get current active units for the student
-                enrollments = self.db.query(Enrollment).filter(
-                    Enrollment.user_id == student.id
-                ).all()
-                
-                if not enrollments:
-                    logger.warning(f"Student {student.username} has no active enrollments")
-                    return
+        logger.info(f"Processing device: {address}")
+        await self.process_batch([address])
 
-                # Create attendance records for each enrolled unit
-                for enrollment in enrollments:
-                    # Check if attendance already marked for today
-                    existing_attendance = self.db.query(Attendance).filter(
-                        Attendance.user_id == student.id,
-                        Attendance.unit_id == enrollment.unit_id,
-                        Attendance.marked_at >= datetime.utcnow().date()
-                    ).first()
-                    
-                    if existing_attendance:
-                        logger.info(f"Attendance already marked for student {student.username} in unit {enrollment.unit_id}")
-                        continue
-                    
-                    attendance = Attendance(
-                        user_id=student.id,
-                        unit_id=enrollment.unit_id,
-                        attendance_type=AttendanceType.BLUETOOTH,
-                        bluetooth_address=address
-                    )
-                    self.db.add(attendance)
-                    logger.info(f"Created attendance record for student {student.username} in unit {enrollment.unit_id}")
-                
-                self.db.commit()
-                logger.info(f"Successfully processed attendance for student {student.username}")
-            else:
-                logger.debug(f"No matching student found for device: {address}")
-                
+    async def process_batch(self, addresses: List[str]):
+        """Resolve a batch of detected addresses and mark attendance in one transaction"""
+        started = time.perf_counter()
+        # The database thread works from a copy; sessions are only changed here
+        snapshots = [session.snapshot() for session in self.sessions.values()]
+        try:
+            result = await self.run_db(self._write_batch, addresses, snapshots)
+            self._apply_batch(result)
+            self.pipeline_stats["attendance_written"] += result.written
         except Exception as e:
-            logger.error(f"Error processing device {address}: {str(e)}")
+            logger.error(f"Error processing batch of {len(addresses)} devices: {str(e)}")
             logger.error(traceback.format_exc())
+        finally:
+            elapsed = time.perf_counter() - started
+            scanner_batch_duration.observe(elapsed)
+            latency_ms = elapsed * 1000
+            self.pipeline_stats["batches"] += 1
+            self.pipeline_stats["devices_processed"] += len(addresses)
+            self.pipeline_stats["last_batch_latency_ms"] = latency_ms
+            self.pipeline_stats["total_batch_latency_ms"] += latency_ms
+            if latency_ms > self.pipeline_stats["max_batch_latency_ms"]:
+                self.pipeline_stats["max_batch_latency_ms"] = latency_ms
+
+    def _apply_batch(self, result: BatchResult):
+        """Record a batch's new class sessions and marks on the sessions still open"""
+        for beacon_id, session_id in result.session_ids.items():
+            session = self.sessions.get(beacon_id)
+            if session is not None and session.session_id is None:
+                session.session_id = session_id
+        for beacon_id, user_id in result.marks:
+            session = self.sessions.get(beacon_id)
+            if session is not None:
+                session.marked.add(user_id)
+
+    def _write_batch(self, addresses: List[str], snapshots: List[SessionSnapshot]) -> BatchResult:
+        """Blocking part of process_batch; runs on the scanner's database thread"""
+        try:
+            return self._write_batch_records(addresses, snapshots)
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _write_batch_records(self, addresses: List[str], snapshots: List[SessionSnapshot]) -> BatchResult:
+        self.student_index.ensure_loaded(self.db)
+        students = {}
+        for address in addresses:
+            entry = self.student_index.lookup(address)
+            if entry:
+                students[entry.user_id] = entry
+        session_ids: Dict[str, int] = {}
+        marks: List[Tuple[str, int]] = []
+        if not students:
+            logger.debug(f"No matching students found for {len(addresses)} devices")
+            return BatchResult(0, session_ids, marks)
+
+        if snapshots:
+            new_records = self._session_records(students, snapshots, session_ids, marks)
+        else:
+            new_records = self._daily_records(students)
+
+        if not new_records:
+            return BatchResult(0, session_ids, marks)
+        beacons = {
+            session_ids.get(snapshot.beacon_id, snapshot.session_id): snapshot.beacon_id
+            for snapshot in snapshots
+        }
+        marks.extend(
+            (beacons[record.session_id], record.user_id)
+            for record in new_records if record.session_id in beacons
+        )
+        written = self._commit_records(new_records)
+        logger.info(f"Marked {len(written)} attendance records for {len(students)} students")
+        # Push the new marks to the dashboards watching these sessions
+        attendance_events.publish(
+            attendance_event(
+                row["id"], row["session_id"], row["unit_id"], row["user_id"], row["attendance_type"],
+                students[row["user_id"]].username, students[row["user_id"]].full_name,
+                students[row["user_id"]].admission_number
+            )
+            for row in written
+        )
+        return BatchResult(len(written), session_ids, marks)
+
+    def _commit_records(self, records: List[Attendance]) -> List[dict]:
+        """Insert records in one transaction; on a uniqueness race, fall back to one savepoint each.
+
+        Returns the rows actually written, with their new ids.
+        """
+        rows = [
+            dict(user_id=r.user_id, unit_id=r.unit_id, session_id=r.session_id,
+                 attendance_type=r.attendance_type, bluetooth_address=r.bluetooth_address)
+            for r in records
+        ]
+        try:
+            self.db.add_all(records)
+            self.db.flush()
+            written = [dict(row, id=record.id) for row, record in zip(rows, records)]
+            increment_attendance_counters(self.db, [(row["user_id"], row["unit_id"]) for row in rows])
+            self.db.commit()
+            return written
+        except IntegrityError:
+            # Someone (usually a manual mark) got there first for at least one student
+            self.db.rollback()
+        written = []
+        for row in rows:
+            record = Attendance(**row)
+            try:
+                with self.db.begin_nested():
+                    self.db.add(record)
+                written.append(dict(row, id=record.id))
+            except IntegrityError:
+                logger.info(f"Attendance already marked for user {row['user_id']} in session {row['session_id']}")
+        increment_attendance_counters(self.db, [(row["user_id"], row["unit_id"]) for row in written])
+        self.db.commit()
+        return written
+
+    def _session_records(
+        self,
+        students: Dict[int, StudentEntry],
+        snapshots: List[SessionSnapshot],
+        session_ids: Dict[str, int],
+        marks: List[Tuple[str, int]]
+    ) -> List[Attendance]:
+        """Attendance for the open sessions only: one check and one write per student"""
+        snapshots_by_unit: Dict[int, List[SessionSnapshot]] = {}
+        for snapshot in snapshots:
+            snapshots_by_unit.setdefault(snapshot.unit_id, []).append(snapshot)
+        candidates = {}  # (user_id, session_id) -> (entry, snapshot)
+        for user_id, entry in students.items():
+            for unit_id in entry.unit_ids:
+                for snapshot in snapshots_by_unit.get(unit_id, ()):
+                    if user_id not in snapshot.marked:
+                        session_id = self._ensure_class_session(snapshot, session_ids)
+                        candidates[(user_id, session_id)] = (entry, snapshot)
+        if not candidates:
+            return []
+
+        # Served by the (session_id, user_id) unique index
+        already_marked = set(self.db.query(Attendance.user_id, Attendance.session_id).filter(
+            Attendance.session_id.in_({session_id for _, session_id in candidates}),
+            Attendance.user_id.in_({user_id for user_id, _ in candidates})
+        ).all())
+
+        new_records = []
+        for (user_id, session_id), (entry, snapshot) in candidates.items():
+            if (user_id, session_id) in already_marked:
+                logger.info(f"Attendance already marked for student {entry.username} in session {session_id}")
+                marks.append((snapshot.beacon_id, user_id))
+                continue
+            new_records.append(Attendance(
+                user_id=user_id,
+                unit_id=snapshot.unit_id,
+                session_id=session_id,
+                attendance_type=AttendanceType.BLUETOOTH,
+                bluetooth_address=entry.bluetooth_address
+            ))
+            logger.info(f"Created attendance record for student {entry.username} in unit {snapshot.unit_id}")
+        return new_records
+
+    def _daily_records(self, students: Dict[int, StudentEntry]) -> List[Attendance]:
+        """Attendance for the students' units that have already held a class today.
+
+        Outside a broadcast the scanner cannot tell which class a student is
+        in, so it only joins sessions a lecturer opened; creating one per
+        enrolled unit would add classes that were never held.
+        """
+        student_ids = list(students)
+        enrollments = [
+            (entry.user_id, unit_id)
+            for entry in students.values()
+            for unit_id in sorted(entry.unit_ids)
+        ]
+        for entry in students.values():
+            if not entry.unit_ids:
+                logger.warning(f"Student {entry.username} has no active enrollments")
+        if not enrollments:
+            return []
+
+        session_ids = day_sessions(self.db, {unit_id for _, unit_id in enrollments}, create=False)
+        enrollments = [(user_id, unit_id) for user_id, unit_id in enrollments if unit_id in session_ids]
+        if not enrollments:
+            return []
+
+        # One query for attendance already marked in those sessions
+        already_marked = set(self.db.query(Attendance.user_id, Attendance.unit_id).filter(
+            Attendance.session_id.in_(list(session_ids.values())),
+            Attendance.user_id.in_(student_ids)
+        ).all())
+
+        new_records = []
+        for user_id, unit_id in enrollments:
+            student = students[user_id]
+            if (user_id, unit_id) in already_marked:
+                logger.info(f"Attendance already marked for student {student.username} in unit {unit_id}")
+                continue
+            already_marked.add((user_id, unit_id))
+            new_records.append(Attendance(
+                user_id=user_id,
+                unit_id=unit_id,
+                session_id=session_ids[unit_id],
+                attendance_type=AttendanceType.BLUETOOTH,
+                bluetooth_address=student.bluetooth_address
+            ))
+            logger.info(f"Created attendance record for student {student.username} in unit {unit_id}")
+        return new_records
+
+    def _ensure_class_session(self, snapshot: SessionSnapshot, session_ids: Dict[str, int]) -> int:
+        """Give a broadcast opened without a ClassSession row (scripts, tests) one of its own"""
+        if snapshot.session_id is not None:
+            return snapshot.session_id
+        if snapshot.beacon_id not in session_ids:
+            session_ids[snapshot.beacon_id] = open_class_session(
+                self.db, snapshot.unit_id, snapshot.lecturer_id, snapshot.beacon_id
+            ).id
+            self.db.commit()
+        return session_ids[snapshot.beacon_id]
+
+    def _read_session_marks(self, snapshot: SessionSnapshot) -> Tuple[int, Set[int]]:
+        """The session's ClassSession id and the students already marked in it"""
+        session_id = self._ensure_class_session(snapshot, {})
+        marked = {user_id for (user_id,) in self.db.query(Attendance.user_id).filter(
+            Attendance.session_id == session_id
+        )}
+        return session_id, marked
+
+    async def load_session_marks(self, session: BroadcastSession):
+        """Seed a session's dedup set with students already marked in its class session"""
+        session_id, marked = await self.run_db(self._read_session_marks, session.snapshot())
+        if session.session_id is None:
+            session.session_id = session_id
+        session.marked.update(marked)
+
+    def _end_class_sessions(self, beacon_ids: List[str]):
+        try:
+            end_class_sessions(self.db, beacon_ids)
+            self.db.commit()
+        except Exception as e:
             self.db.rollback()
+            logger.error(f"Could not record the end of sessions {beacon_ids}: {str(e)}")
+
+    async def detection_worker(self):
+        """Drain the detection queue in batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.detection_queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.detection_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.process_batch(batch)
+            finally:
+                for _ in batch:
+                    self.detection_queue.task_done()
 
     async def cleanup_old_devices(self):
-        """Remove devices that haven't been seen for more than 5 minutes"""
+        """Expire devices past their TTL and close expired sessions"""
         while self.scanning:
             try:
-                current_time = datetime.utcnow()
-                old_devices = [
-                    address for address, last_seen in self.detected_devices.items()
-                    if (current_time - last_seen).total_seconds() > 300  # 5 minutes
-                ]
-                for address in old_devices:
-                    del self.detected_devices[address]
-                    logger.debug(f"Removed old device: {address}")
-                await asyncio.sleep(60)  # Check every minute
+                # Expiry only pops stale entries off the front of each tracker,
+                # so running it often costs nothing when nothing has expired
+                expired = self.detected_devices.expire()
+                for session in list(self.sessions.values()):
+                    session.detected_devices.expire()
+                    if session.is_expired() and session.beacon_id not in self.expiry_stops:
+                        logger.info(f"Broadcast session {session.beacon_id} expired")
+                        self._stop_expired(session.beacon_id)
+                if expired:
+                    logger.debug(f"Removed {expired} old devices")
+                await asyncio.sleep(EXPIRY_CHECK_SECONDS)
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error in cleanup_old_devices: {str(e)}")
                 logger.error(traceback.format_exc())
-                await asyncio.sleep(60)  # Continue checking even if there's an error
+                await asyncio.sleep(EXPIRY_CHECK_SECONDS)  # Continue checking even if there's an error
+
+    def _stop_expired(self, beacon_id: str):
+        # Closing the last session cancels this cleanup loop, so the stop
+        # can't be awaited from here; it runs as a task we keep hold of
+        task = asyncio.create_task(self.stop_scanning(beacon_id))
+        self.expiry_stops[beacon_id] = task
+
+        def stopped(task: asyncio.Task):
+            self.expiry_stops.pop(beacon_id, None)
+            if not task.cancelled() and task.exception() is not None:
+                self.last_error = str(task.exception())
+                logger.error(f"Error closing expired session {beacon_id}: {self.last_error}")
+
+        task.add_done_callback(stopped)
+
+    async def start_scanning(self, broadcast_info: dict) -> BroadcastSession:
+        """Open a broadcast session, starting the shared BLE scanner if it is not running"""
+        session = self.add_session(broadcast_info)
+        logger.info(f"Opened broadcast session {session.beacon_id} for unit {session.unit_code}")
+
+        # Load the address index up front so unknown devices are rejected from the first sighting
+        await self.run_db(self.student_index.load, self.db)
+        await self.load_session_marks(session)
 
-    async def start_scanning(self, broadcast_info: dict):
-        """Start scanning for Bluetooth devices with specific broadcast info"""
         if self.scanning:
-            logger.warning("Scanner is already running")
-            return
+            return session
 
-        self.active_broadcast = broadcast_info
         self.scanning = True
         self.start_time = datetime.utcnow()
-        logger.info(f"Starting Bluetooth scanner for unit {broadcast_info['unit_code']}")
+        logger.info("Starting shared Bluetooth scanner")
 
         try:
-            # Start the cleanup task
+            # Start the cleanup task and the detection batch worker
             self.cleanup_task = asyncio.create_task(self.cleanup_old_devices())
+            self.detection_queue = asyncio.Queue()
+            self.worker_task = asyncio.create_task(self.detection_worker())
             
             # Start scanning
-            self.scanner = BleakScanner(detection_callback=self.device_detection_callback)
+            scanner_factory = self.scanner_factory or BleakScanner
+            self.scanner = scanner_factory(detection_callback=self.device_detection_callback)
             await self.scanner.start()
             logger.info("Bluetooth scanner started successfully")
         except Exception as e:
             logger.error(f"Error in Bluetooth scanner: {str(e)}")
             logger.error(traceback.format_exc())
+            self.remove_session(session.beacon_id)
             self.scanning = False
             raise
+        return session
+
+    async def stop_scanning(self, beacon_id: Optional[str] = None):
+        """Close one broadcast session, or all of them; the BLE scanner stops with the last one"""
+        # The last session stays open until the queue is drained below, so
+        # sightings already queued are still marked against it
+        if beacon_id is not None and (len(self.sessions) > 1 or beacon_id not in self.sessions):
+            session = self.remove_session(beacon_id)
+            if session:
+                logger.info(f"Closed broadcast session {beacon_id}")
+                await self.run_db(self._end_class_sessions, [beacon_id])
+                if session.session_id is not None:
+                    attendance_events.close_session(session.session_id)
+            if self.sessions:
+                return
 
-    async def stop_scanning(self):
-        """Stop scanning for Bluetooth devices"""
         self.scanning = False
-        self.active_broadcast = None
         self.detected_devices.clear()
         logger.info("Stopped Bluetooth scanner")
         
@@ -167,7 +628,9 @@ class BluetoothScanner:
                 self.last_error = str(e)
                 logger.error(f"Error stopping cleanup task: {str(e)}")
             self.cleanup_task = None
-            
+
+        # No new sightings once the radio stops; then let the worker finish
+        # what was queued, including a batch already running, before ending it
         if self.scanner:
             try:
                 await self.scanner.stop()
@@ -176,12 +639,38 @@ class BluetoothScanner:
                 logger.error(f"Error stopping scanner: {str(e)}")
             self.scanner = None
             
+        if self.worker_task:
+            if not self.worker_task.done():
+                await self.detection_queue.join()
+            self.worker_task.cancel()
+            try:
+                await self.worker_task
+            except asyncio.CancelledError:
+                pass
+            self.worker_task = None
+            # A worker that died early leaves its queue behind; flush it here
+            pending = []
+            while not self.detection_queue.empty():
+                pending.append(self.detection_queue.get_nowait())
+            if pending:
+                await self.process_batch(pending)
+            self.detection_queue = None
+
+        open_beacons = list(self.sessions)
+        closed = [self.remove_session(session_id) for session_id in open_beacons]
+        if open_beacons:
+            await self.run_db(self._end_class_sessions, open_beacons)
+        for session in closed:
+            if session.session_id is not None:
+                attendance_events.close_session(session.session_id)
+            
         logger.info("Bluetooth scanner stopped")
 
     def __del__(self):
         """Cleanup when the scanner is destroyed"""
         if self.scanning:
             asyncio.create_task(self.stop_scanning())
+        self.db_executor.shutdown(wait=False)
         if self.db:
             self.db.close()
 
@@ -196,28 +685,25 @@ class BluetoothScanner:
             if device_name and device_name.startswith("STUDENT_"):
                 # Extract student ID from device name
                 student_id = device_name.split("_")[1]
-                self.detected_devices[student_id] = datetime.utcnow()
+                self.detected_devices.touch(student_id)
                 logger.info(f"Detected student device: {device_name}")
         except Exception as e:
             self.last_error = str(e)
             logger.error(f"Error in detection callback: {str(e)}")
 
-    def is_device_detected(self, device_id: str) -> bool:
-        """Check if a device has been detected recently"""
-        if device_id not in self.detected_devices:
-            return False
-        
-        # Consider device as detected if seen within last 5 minutes
-        last_seen = self.detected_devices[device_id]
-        return (datetime.utcnow() - last_seen).total_seconds() < 300
+    def is_device_detected(self, device_id: str, beacon_id: Optional[str] = None) -> bool:
+        """Check if a device has been detected recently, optionally within one session"""
+        session = self.sessions.get(beacon_id) if beacon_id else None
+        detected_devices = session.detected_devices if session else self.detected_devices
+        return detected_devices.seen_within(device_id)
 
 # Create a global scanner instance
 scanner = BluetoothScanner()
 
-async def start_scanner(broadcast_info: dict):
-    """Start the Bluetooth scanner with broadcast info"""
-    await scanner.start_scanning(broadcast_info)
+async def start_scanner(broadcast_info: dict) -> BroadcastSession:
+    """Open a broadcast session on the shared Bluetooth scanner"""
+    return await scanner.start_scanning(broadcast_info)
 
-async def stop_scanner():
-    """Stop the Bluetooth scanner"""
-    await scanner.stop_scanning() 
\ No newline at end of file
+async def stop_scanner(beacon_id: Optional[str] = None):
+    """Close a broadcast session, or every session when no beacon_id is given"""
+    await scanner.stop_scanning(beacon_id) 
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""Shared invalidation versions for per-process caches.
+
+Workers, possibly on different hosts, share one database, so a cache that
+has to notice changes made elsewhere keeps a row in cache_versions. Writers
+bump it after committing a change; readers compare it with the version
+their cache was built at.
+"""
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import CacheVersion
+
+def read_version(db: Session, name: str) -> int:
+    version = db.execute(select(CacheVersion.version).where(CacheVersion.name == name)).scalar()
+    # Don't hold the read transaction open between requests
+    db.rollback()
+    return version or 0
+
+def bump_version(db: Session, name: str) -> int:
+    """Increment the shared version of a cache and return the new value"""
+    for _ in range(2):
+        bumped = db.execute(
+            update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+        )
+        if bumped.rowcount == 0:
+            db.add(CacheVersion(name=name, version=1))
+        try:
+            db.flush()
+        except IntegrityError:
+            # Another worker created the row first; bump theirs instead
+            db.rollback()
+            continue
+        version = db.execute(select(CacheVersion.version).where(CacheVersion.name == name)).scalar()
+        db.commit()
+        return version
+    raise RuntimeError(f"Could not bump the {name} cache version")
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from models import ClassSession, Unit
+
+def open_class_session(
+    db: Session,
+    unit_id: int,
+    lecturer_id: Optional[int] = None,
+    beacon_id: Optional[str] = None,
+    started_at: Optional[datetime] = None
+) -> ClassSession:
+    """The session for a beacon, created if it doesn't exist yet.
+
+    Runs in the caller's transaction; the new row is flushed so its id is
+    available before the caller commits.
+    """
+    if beacon_id is not None:
+        session = db.query(ClassSession).filter(ClassSession.beacon_id == beacon_id).first()
+        if session is not None:
+            return session
+    session = ClassSession(
+        unit_id=unit_id,
+        lecturer_id=lecturer_id,
+        beacon_id=beacon_id,
+        started_at=started_at or datetime.utcnow()
+    )
+    db.add(session)
+    db.flush()
+    return session
+
+def end_class_sessions(db: Session, beacon_ids: Iterable[str]):
+    """Record when broadcasts stopped; sessions that already ended are left alone"""
+    beacon_ids = list(beacon_ids)
+    if beacon_ids:
+        db.execute(update(ClassSession).where(
+            ClassSession.beacon_id.in_(beacon_ids),
+            ClassSession.ended_at.is_(None)
+        ).values(ended_at=datetime.utcnow()))
+
+def day_sessions(
+    db: Session,
+    unit_ids: Iterable[int],
+    at: Optional[datetime] = None,
+    create: bool = True
+) -> Dict[int, int]:
+    """Session id per unit for marks made outside a broadcast, keyed by unit id.
+
+    A mark joins the unit's latest session on the same day, so a student the
+    scanner missed is marked into that broadcast's class. With create, units
+    that held no session that day get a new one without a beacon, started at
+    `at`; every session counts towards the sessions held, so only a lecturer's
+    own mark should create one. Without create those units are left out.
+    """
+    unit_ids = set(unit_ids)
+    if not unit_ids:
+        return {}
+    at = at or datetime.utcnow()
+    day_start = datetime.combine(at.date(), datetime.min.time())
+    sessions = dict(db.execute(
+        select(ClassSession.unit_id, func.max(ClassSession.id)).where(
+            ClassSession.unit_id.in_(unit_ids),
+            ClassSession.started_at >= day_start,
+            ClassSession.started_at < day_start + timedelta(days=1)
+        ).group_by(ClassSession.unit_id)
+    ).all())
+    missing = unit_ids - set(sessions)
+    if missing and create:
+        lecturers = dict(db.execute(select(Unit.id, Unit.lecturer_id).where(Unit.id.in_(missing))).all())
+        new_sessions = [
+            ClassSession(unit_id=unit_id, lecturer_id=lecturers.get(unit_id), started_at=at)
+            for unit_id in sorted(missing)
+        ]
+        db.add_all(new_sessions)
+        db.flush()
+        sessions.update((session.unit_id, session.id) for session in new_sessions)
+    return sessions
+
+def sessions_held(
+    db: Session,
+    unit_ids: Iterable[int],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Dict[int, int]:
+    """Number of sessions held per unit, optionally in [start, end); units with none are left out"""
+    unit_ids = list(unit_ids)
+    if not unit_ids:
+        return {}
+    query = select(ClassSession.unit_id, func.count()).where(ClassSession.unit_id.in_(unit_ids))
+    if start is not None:
+        query = query.where(ClassSession.started_at >= start)
+    if end is not None:
+        query = query.where(ClassSession.started_at < end)
+    return dict(db.execute(query.group_by(ClassSession.unit_id)).all())
+
+def attendance_percentage(attended: int, held: int) -> float:
+    return (attended / held) * 100 if held else 0.0
@@ -1,6 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import contextvars
 import os
 import logging
 
@@ -9,10 +14,8 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def get_base_dir():
-    """Get the absolute path to the AppData directory."""
-    app_data_dir = os.getenv('APPDATA')
-    if not app_data_dir:
-        raise Exception("APPDATA environment variable not found")
+    """Get the absolute path to the AppData directory (the home directory off Windows)."""
+    app_data_dir = os.getenv('APPDATA') or os.path.expanduser('~')
     
     base_dir = os.path.join(app_data_dir, 'attendance_system')
     os.makedirs(base_dir, exist_ok=True)
@@ -25,14 +28,148 @@ os.makedirs(DATA_DIR, exist_ok=True)
 
 # Construct the path to the database file
 DB_PATH = os.path.join(DATA_DIR, 'attendance.db')
-DATABASE_URL = f"sqlite:///{DB_PATH}"
+
+def get_database_url():
+    """DATABASE_URL from the environment, or the local SQLite file."""
+    url = os.getenv("DATABASE_URL") or f"sqlite:///{DB_PATH}"
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+DATABASE_URL = get_database_url()
+
+# SQLite connection profiles, chosen with the SQLITE_PROFILE environment
+# variable. "production" keeps dashboard reads flowing while the scanner
+# writes: WAL lets readers and the single writer run concurrently, and
+# synchronous=NORMAL is still crash-safe in WAL mode (only the last commits
+# before a power loss can be lost). "durable" keeps fsync on every commit.
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,       # 64 MiB page cache per connection
+        "mmap_size": 268435456,     # 256 MiB memory-mapped reads
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,       # ms to wait on a locked database
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+    },
+}
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+
+# Async handlers hand their blocking SQLAlchemy work to this bounded pool so
+# database round trips never stall the event loop (or the Bluetooth callback).
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+# One pooled connection per database worker, plus headroom for the request
+# threads that still use get_db directly
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(DB_EXECUTOR_WORKERS)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(DB_EXECUTOR_WORKERS)))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Server databases only: recycle connections before the server or a proxy drops them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Reported by /health after verify_sqlite_profile() runs at startup
+profile_status = {"backend": DATABASE_URL.split(":", 1)[0].split("+", 1)[0], "verified": False}
+
+def sqlite_pragmas(profile=None):
+    """Pragmas for a profile; SQLITE_<PRAGMA> environment variables override single values."""
+    name = profile or SQLITE_PROFILE
+    if name not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE {name!r}; expected one of {', '.join(SQLITE_PROFILES)}")
+    pragmas = dict(SQLITE_PROFILES[name])
+    for pragma in ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout"):
+        override = os.getenv(f"SQLITE_{pragma.upper()}")
+        if override:
+            pragmas[pragma] = override
+    return pragmas
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run the pragmas on every new connection the engine opens."""
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
+
+def verify_sqlite_profile(engine, pragmas=None):
+    """Read the pragmas back from a live connection and compare with the profile."""
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+    status = {"backend": "sqlite", "profile": SQLITE_PROFILE, "verified": True, "pragmas": {}, "mismatches": []}
+    with engine.connect() as connection:
+        for pragma, expected in pragmas.items():
+            actual = connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+            status["pragmas"][pragma] = actual
+            if _pragma_value(pragma, actual) != _pragma_value(pragma, expected):
+                status["mismatches"].append(pragma)
+    for pragma in status["mismatches"]:
+        logger.warning(f"SQLite pragma {pragma} is {status['pragmas'][pragma]!r}, "
+                       f"profile {SQLITE_PROFILE!r} expects {pragmas[pragma]!r}")
+    profile_status.clear()
+    profile_status.update(status)
+    return status
+
+_PRAGMA_NAMES = {
+    "synchronous": {"OFF": 0, "NORMAL": 1, "FULL": 2, "EXTRA": 3},
+    "temp_store": {"DEFAULT": 0, "FILE": 1, "MEMORY": 2},
+}
+
+def _pragma_value(pragma, value):
+    """Normalise a pragma value so "NORMAL" and 1 (or "wal" and "WAL") compare equal."""
+    text_value = str(value).upper()
+    if text_value in _PRAGMA_NAMES.get(pragma, {}):
+        return _PRAGMA_NAMES[pragma][text_value]
+    try:
+        return int(text_value)
+    except ValueError:
+        return text_value
+
+def is_memory_sqlite(url):
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+def create_database_engine(url=None):
+    """Engine for the configured backend.
+
+    SQLite gets the pragma profile above. Server databases such as
+    PostgreSQL get a QueuePool that pings connections before handing them
+    out and recycles them, so several uvicorn workers can share one store.
+    """
+    url = url or DATABASE_URL
+    if url.startswith("sqlite"):
+        if is_memory_sqlite(url):
+            engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        else:
+            engine = create_engine(
+                url,
+                connect_args={"check_same_thread": False},
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT
+            )
+        apply_sqlite_pragmas(engine, sqlite_pragmas())
+        return engine
+    return create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
 
 def setup_database():
     """Setup the database connection."""
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
+    engine = create_database_engine(DATABASE_URL)
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     Base = declarative_base()
     return engine, SessionLocal, Base
@@ -40,6 +177,22 @@ def setup_database():
 # Initialize database components
 engine, SessionLocal, Base = setup_database()
 
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+async def run_on_executor(executor, func, *args, **kwargs):
+    """Run a blocking call on executor with a copy of the caller's context variables"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, context.run, partial(func, *args, **kwargs))
+
+async def run_in_db(func, *args, **kwargs):
+    """Run a blocking database call on the database thread pool.
+
+    The caller's context variables are copied to the worker, so queries run
+    there are still counted against the request that made them.
+    """
+    return await run_on_executor(db_executor, func, *args, **kwargs)
+
 def get_db():
     """Get a database session."""
     db = SessionLocal()
@@ -48,7 +201,7 @@ def get_db():
     finally:
         db.close()
 
-def init_db():
+def init_db(bind=None):
     """Initialize the database."""
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=bind or engine)
     logger.info("Database initialized successfully") 
\ No newline at end of file
@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional
+
+# Devices not seen for this long are forgotten
+DEVICE_TTL_SECONDS = 300
+# Upper bound on tracked devices; the least recently seen are evicted first
+MAX_TRACKED_DEVICES = 10000
+
+class DeviceTracker(Mapping):
+    """Last-seen times of detected devices with amortised O(1) touch and expiry.
+
+    Entries are kept in an OrderedDict in order of last sighting on a monotonic
+    clock. Touching a device moves it to the end, so the stalest entries are
+    always at the front: expiry and least-recently-seen eviction only ever pop
+    from there and never walk the whole table.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEVICE_TTL_SECONDS,
+        max_devices: int = MAX_TRACKED_DEVICES,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_devices = max_devices
+        self.clock = clock
+        self.evictions = 0
+        self.expirations = 0
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def touch(self, address: str) -> bool:
+        """Record a sighting; returns True if the device was not being tracked"""
+        now = self.clock()
+        self.expire(now)
+        is_new = address not in self._seen
+        if is_new:
+            self._seen[address] = now
+            if len(self._seen) > self.max_devices:
+                self._seen.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._seen[address] = now
+            self._seen.move_to_end(address)
+        return is_new
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Drop devices older than the TTL; returns how many were dropped"""
+        cutoff = (self.clock() if now is None else now) - self.ttl_seconds
+        expired = 0
+        while self._seen:
+            address, last_seen = next(iter(self._seen.items()))
+            if last_seen > cutoff:
+                break
+            del self._seen[address]
+            expired += 1
+        self.expirations += expired
+        return expired
+
+    def seen_within(self, address: str, seconds: Optional[float] = None) -> bool:
+        """Whether the device was seen within `seconds` (default: the TTL)"""
+        last_seen = self._seen.get(address)
+        if last_seen is None:
+            return False
+        return self.clock() - last_seen < (self.ttl_seconds if seconds is None else seconds)
+
+    def discard(self, address: str):
+        self._seen.pop(address, None)
+
+    def clear(self):
+        self._seen.clear()
+
+    def __getitem__(self, address: str) -> datetime:
+        """Wall-clock (UTC) time the device was last seen"""
+        age = self.clock() - self._seen[address]
+        return datetime.utcnow() - timedelta(seconds=age)
+
+    def __contains__(self, address) -> bool:
+        return address in self._seen
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._seen))
+
+    def __len__(self) -> int:
+        return len(self._seen)
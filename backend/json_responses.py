@@ -0,0 +1,25 @@
+"""JSON responses rendered with orjson when it is installed.
+
+orjson encodes datetimes, enums and int dict keys itself, several times
+faster than the standard library. Without it, FastJSONResponse falls back
+to jsonable_encoder and json.dumps, so the optional package only changes speed.
+"""
+from typing import Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def orjson_available() -> bool:
+    return orjson is not None
+
+class FastJSONResponse(JSONResponse):
+    """Use as response_class, or return one with plain dicts to skip response_model validation"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
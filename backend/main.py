@@ -1,31 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request, File, Form, UploadFile
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.orm import Session, contains_eager
 from datetime import datetime, timedelta
 from typing import List, Optional
 import jwt
-from passlib.context import CryptContext
-from models import Base, User, Unit, Enrollment, Attendance, UserRole, AttendanceType
-from database import SessionLocal, engine
+from models import Base, User, Unit, Enrollment, Attendance, AttendanceCounter, ClassSession, UserRole, AttendanceType
+from database import SessionLocal, engine, get_db, init_db, run_in_db, profile_status, verify_sqlite_profile
 from schemas import (
     UserCreate, User as UserSchema, 
     UnitCreate, Unit as UnitSchema, 
     Attendance as AttendanceSchema,
-    AttendanceSummary
+    AttendanceSummary,
+    StudentAttendanceStats,
+    UnitAttendanceReport,
+    AttendanceRecordPage,
+    CompactLecturerAttendance,
+    BulkAttendanceOutcome,
+    BulkAttendanceResult
 )
 import logging
 from pydantic import BaseModel
-from bluetooth_scanner import BluetoothScanner, start_scanner, stop_scanner
+from bluetooth_scanner import scanner, start_scanner, stop_scanner
+from student_index import invalidate_student_index, normalize_mac
+from user_cache import principal_cache
+from password_hashing import password_hasher, PasswordHasherSaturated
+from attendance_counters import increment_attendance_counters
+from attendance_events import attendance_event, attendance_events
+from class_sessions import attendance_percentage, day_sessions, open_class_session, sessions_held
+from attendance_export import MEDIA_TYPES, iter_export_on, parquet_available
+from json_responses import FastJSONResponse
+from query_profiler import QUERY_PROFILING, QueryProfilerMiddleware
+from metrics import (
+    METRICS_TOKEN, CachedHealthCheck, Counter, Gauge, MetricsMiddleware, instrument_sqlalchemy, registry, snapshot
+)
 import asyncio
 import traceback
-from sqlalchemy import text
+from sqlalchemy import and_, exists, insert, select, text
 import re
+import csv
+import secrets
+import io
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import func
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -59,33 +78,30 @@ async def add_cors_headers(request: Request, call_next):
     response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type, Accept"
     return response
 
+# Opt-in statement profiling with N+1 detection (QUERY_PROFILING=1)
+if QUERY_PROFILING:
+    app.add_middleware(QueryProfilerMiddleware)
+
+# Outermost, so request timing covers the other middleware too
+app.add_middleware(MetricsMiddleware)
+instrument_sqlalchemy()
+
 # Security
 SECRET_KEY = "your-secret-key"  # Move to environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# For endpoints that also take the token as a query parameter
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(db: Session, username: str, password: str):
+    # The lookup runs on the database pool and bcrypt on the hashing pool,
+    # so a login spike can't starve the scanner's database work
+    user = await run_in_db(get_user_by_username, db, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
         return None
     return user
 
@@ -99,6 +115,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def get_user_by_username(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+def get_user_by_id(db: Session, user_id: int):
+    return db.get(User, user_id)
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -108,20 +130,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
+        user_id: Optional[int] = payload.get("uid")
         if username is None:
             raise credentials_exception
     except jwt.PyJWTError as e:
         logger.error(f"JWT validation error: {str(e)}")
         raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
+    if user_id is None:
+        # Token issued before the uid claim existed
+        user = await run_in_db(get_user_by_username, db, username)
+    else:
+        if principal_cache.version_check_due():
+            await run_in_db(principal_cache.sync_version, db)
+        user = principal_cache.get(user_id)
+        if user is not None and user.username == username:
+            return user
+        user = await run_in_db(get_user_by_id, db, user_id)
+    if user is None or user.username != username:
         raise credentials_exception
-    return user
+    return principal_cache.put(user)
 
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     try:
-        user = authenticate_user(db, form_data.username, form_data.password)
+        user = await authenticate_user(db, form_data.username, form_data.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -131,7 +163,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.username, "role": user.role},
+            data={"sub": user.username, "uid": user.id, "role": user.role},
             expires_delta=access_token_expires
         )
         
@@ -147,6 +179,15 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
                 "admission_number": user.admission_number
             }
         }
+    except HTTPException:
+        raise
+    except PasswordHasherSaturated as e:
+        logger.warning(f"Login rejected, password hashing saturated: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, please retry shortly",
+            headers={"Retry-After": "2"}
+        )
     except Exception as e:
         print(f"Login error: {str(e)}")  # Debug log
         raise HTTPException(
@@ -158,12 +199,27 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 async def refresh_token(current_user: User = Depends(get_current_user)):
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": current_user.username}, expires_delta=access_token_expires
+        data={"sub": current_user.username, "uid": current_user.id, "role": current_user.role},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/register", response_model=UserSchema)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+    await run_in_db(check_registration, db, user)
+    # bcrypt runs on the bounded hashing pool, like logins
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherSaturated as e:
+        logger.warning(f"Registration rejected, password hashing saturated: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many registrations in progress, please retry shortly",
+            headers={"Retry-After": "2"}
+        )
+    return await run_in_db(create_registered_user, db, user, hashed_password)
+
+def check_registration(db: Session, user: UserCreate):
     db_user = db.query(User).filter(User.email == user.email).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -192,8 +248,8 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     # Validate bluetooth_address for students
     if user.role == UserRole.STUDENT and not user.bluetooth_address:
         raise HTTPException(status_code=400, detail="Bluetooth address is required for students")
-    
-    hashed_password = get_password_hash(user.password)
+
+def create_registered_user(db: Session, user: UserCreate, hashed_password: str):
     db_user = User(
         email=user.email,
         username=user.username,
@@ -206,6 +262,8 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    if db_user.bluetooth_address:
+        invalidate_student_index(db)
     return db_user
 
 @app.get("/users/me", response_model=UserSchema)
@@ -223,6 +281,24 @@ class UserUpdate(BaseModel):
     phone: Optional[str] = None
     department: Optional[str] = None
 
+def apply_user_update(db: Session, user: User, user_update: UserUpdate):
+    # The authenticated user may come from the principal cache, detached from db
+    user = db.merge(user)
+    # Update user fields if provided
+    if user_update.full_name is not None:
+        user.full_name = user_update.full_name
+    if user_update.email is not None:
+        user.email = user_update.email
+    if user_update.phone is not None:
+        user.phone = user_update.phone
+    if user_update.department is not None:
+        user.department = user_update.department
+
+    db.commit()
+    principal_cache.invalidate(user.id, db=db)
+    db.refresh(user)
+    return user
+
 @app.put("/users/me", response_model=UserSchema)
 async def update_user_me(
     user_update: UserUpdate,
@@ -230,22 +306,10 @@ async def update_user_me(
     db: Session = Depends(get_db)
 ):
     try:
-        # Update user fields if provided
-        if user_update.full_name is not None:
-            current_user.full_name = user_update.full_name
-        if user_update.email is not None:
-            current_user.email = user_update.email
-        if user_update.phone is not None:
-            current_user.phone = user_update.phone
-        if user_update.department is not None:
-            current_user.department = user_update.department
-
-        db.commit()
-        db.refresh(current_user)
-        return current_user
+        return await run_in_db(apply_user_update, db, current_user, user_update)
     except Exception as e:
         logger.error(f"Error updating user profile: {str(e)}")
-        db.rollback()
+        await run_in_db(db.rollback)
         raise HTTPException(status_code=500, detail="Failed to update profile")
 
 @app.post("/units", response_model=UnitSchema)
@@ -261,14 +325,22 @@ def create_unit(unit: UnitCreate, current_user: User = Depends(get_current_user)
     db.refresh(db_unit)
     return db_unit
 
+def enrolled_units(db: Session, user_id: int) -> List[Unit]:
+    """A student's units, joined through their enrollments in one statement"""
+    return (
+        db.query(Unit)
+        .join(Enrollment, Enrollment.unit_id == Unit.id)
+        .filter(Enrollment.user_id == user_id)
+        .order_by(Unit.id)
+        .all()
+    )
+
 @app.get("/units", response_model=List[UnitSchema])
 def get_units(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if current_user.role == UserRole.LECTURER:
         return db.query(Unit).filter(Unit.lecturer_id == current_user.id).all()
     else:
-        enrollments = db.query(Enrollment).filter(Enrollment.user_id == current_user.id).all()
-        unit_ids = [enrollment.unit_id for enrollment in enrollments]
-        return db.query(Unit).filter(Unit.id.in_(unit_ids)).all()
+        return enrolled_units(db, current_user.id)
 
 @app.post("/enroll/{unit_id}")
 def enroll_in_unit(unit_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -290,6 +362,7 @@ def enroll_in_unit(unit_id: int, current_user: User = Depends(get_current_user),
     enrollment = Enrollment(user_id=current_user.id, unit_id=unit_id)
     db.add(enrollment)
     db.commit()
+    invalidate_student_index(db)
     return {"message": "Enrolled successfully"}
 
 @app.get("/enrolled-units", response_model=List[UnitSchema])
@@ -297,13 +370,20 @@ def get_enrolled_units(current_user: User = Depends(get_current_user), db: Sessi
     if current_user.role != UserRole.STUDENT:
         raise HTTPException(status_code=403, detail="Only students can view enrolled units")
     
-    enrollments = db.query(Enrollment).filter(Enrollment.user_id == current_user.id).all()
-    unit_ids = [enrollment.unit_id for enrollment in enrollments]
-    return db.query(Unit).filter(Unit.id.in_(unit_ids)).all()
+    return enrolled_units(db, current_user.id)
 
 class BroadcastStart(BaseModel):
     unit_id: int
 
+def create_broadcast_session(db: Session, unit_id: int, lecturer_id: int, beacon_id: str) -> int:
+    session_id = open_class_session(db, unit_id, lecturer_id, beacon_id).id
+    db.commit()
+    return session_id
+
+def discard_broadcast_session(db: Session, session_id: int):
+    db.query(ClassSession).filter(ClassSession.id == session_id).delete()
+    db.commit()
+
 @app.post("/bluetooth/start-broadcast")
 async def start_bluetooth_broadcast(
     broadcast: BroadcastStart,
@@ -313,7 +393,7 @@ async def start_bluetooth_broadcast(
     if current_user.role != UserRole.LECTURER:
         raise HTTPException(status_code=403, detail="Only lecturers can start Bluetooth broadcast")
     
-    unit = db.query(Unit).filter(Unit.id == broadcast.unit_id).first()
+    unit = await run_in_db(db.get, Unit, broadcast.unit_id)
     if not unit:
         raise HTTPException(status_code=404, detail="Unit not found")
     if unit.lecturer_id != current_user.id:
@@ -321,31 +401,104 @@ async def start_bluetooth_broadcast(
     
     # Generate a unique Bluetooth beacon ID for this session
     beacon_id = f"{current_user.id}_{broadcast.unit_id}_{datetime.utcnow().timestamp()}"
+    # Every broadcast is a class held, and attendance is recorded against it
+    session_id = await run_in_db(create_broadcast_session, db, broadcast.unit_id, current_user.id, beacon_id)
     
     # Start the Bluetooth scanner with broadcast info
     broadcast_info = {
         "beacon_id": beacon_id,
+        "session_id": session_id,
         "unit_id": broadcast.unit_id,
         "unit_code": unit.code,
         "lecturer_id": current_user.id
     }
-    await start_scanner(broadcast_info)
+    try:
+        await start_scanner(broadcast_info)
+    except Exception:
+        # A broadcast that never started is not a class held
+        await run_in_db(discard_broadcast_session, db, session_id)
+        raise
     
     return {
         "beacon_id": beacon_id,
+        "session_id": session_id,
         "unit_id": broadcast.unit_id,
         "lecturer_name": current_user.full_name or current_user.username,
         "unit_code": unit.code
     }
 
 @app.post("/bluetooth/stop-broadcast")
-async def stop_bluetooth_broadcast(current_user: User = Depends(get_current_user)):
+async def stop_bluetooth_broadcast(
+    beacon_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     if current_user.role != UserRole.LECTURER:
         raise HTTPException(status_code=403, detail="Only lecturers can stop Bluetooth broadcast")
     
-    await stop_scanner()
+    # Only the lecturer's own sessions are stopped; other rooms keep broadcasting
+    own_sessions = [
+        session.beacon_id for session in scanner.sessions.values()
+        if session.lecturer_id == current_user.id
+    ]
+    if beacon_id is not None:
+        if beacon_id not in scanner.sessions:
+            raise HTTPException(status_code=404, detail="Broadcast session not found")
+        if beacon_id not in own_sessions:
+            raise HTTPException(status_code=403, detail="Not authorized to stop this broadcast")
+        own_sessions = [beacon_id]
+    
+    for session_id in own_sessions:
+        await stop_scanner(session_id)
     return {"message": "Bluetooth broadcast stopped successfully"}
 
+def check_bluetooth_attendance(db: Session, student: User, beacon_id: str) -> ClassSession:
+    """The broadcast's class session, if the student may still mark attendance in it"""
+    class_session = db.query(ClassSession).filter(ClassSession.beacon_id == beacon_id).first()
+    if not class_session:
+        raise HTTPException(status_code=404, detail="Broadcast session not found")
+    if class_session.ended_at is not None:
+        raise HTTPException(status_code=400, detail="Broadcast session has ended")
+    
+    # Check if student is enrolled
+    enrollment = db.query(Enrollment).filter(
+        Enrollment.user_id == student.id,
+        Enrollment.unit_id == class_session.unit_id
+    ).first()
+    if not enrollment:
+        raise HTTPException(status_code=400, detail="Not enrolled in this unit")
+    
+    # Check if attendance already marked in this session (a unique key lookup)
+    existing_attendance = db.query(Attendance.id).filter(
+        Attendance.session_id == class_session.id,
+        Attendance.user_id == student.id
+    ).first()
+    if existing_attendance:
+        raise HTTPException(status_code=400, detail="Already marked attendance for this session")
+    return class_session
+
+def record_bluetooth_attendance(db: Session, student: User, class_session: ClassSession):
+    attendance = Attendance(
+        user_id=student.id,
+        unit_id=class_session.unit_id,
+        session_id=class_session.id,
+        attendance_type=AttendanceType.BLUETOOTH,
+        bluetooth_address=student.bluetooth_address
+    )
+    db.add(attendance)
+    try:
+        db.flush()
+        event = attendance_event(
+            attendance.id, class_session.id, class_session.unit_id, student.id, AttendanceType.BLUETOOTH,
+            student.username, student.full_name, student.admission_number
+        )
+        increment_attendance_counters(db, [(student.id, class_session.unit_id)])
+        db.commit()
+    except IntegrityError:
+        # The scanner marked this student in the meantime
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Already marked attendance for this session")
+    attendance_events.publish([event])
+
 @app.post("/bluetooth/mark-attendance")
 async def mark_bluetooth_attendance(
     beacon_id: str,
@@ -359,46 +512,21 @@ async def mark_bluetooth_attendance(
         raise HTTPException(status_code=400, detail="Student must have a registered Bluetooth MAC address")
     
     try:
-        # Parse beacon_id to get unit_id and timestamp
+        # Parse beacon_id to get the timestamp
         lecturer_id, unit_id, timestamp = beacon_id.split('_')
-        unit_id = int(unit_id)
         timestamp = float(timestamp)
         
         # Check if beacon is still valid (within last 5 minutes)
         if datetime.utcnow().timestamp() - timestamp > 300:  # 5 minutes
             raise HTTPException(status_code=400, detail="Bluetooth beacon has expired")
         
-        # Check if student is enrolled
-        enrollment = db.query(Enrollment).filter(
-            Enrollment.user_id == current_user.id,
-            Enrollment.unit_id == unit_id
-        ).first()
-        if not enrollment:
-            raise HTTPException(status_code=400, detail="Not enrolled in this unit")
-        
-        # Check if attendance already marked for today
-        today = datetime.utcnow().date()
-        existing_attendance = db.query(Attendance).filter(
-            Attendance.user_id == current_user.id,
-            Attendance.unit_id == unit_id,
-            Attendance.marked_at >= today
-        ).first()
-        if existing_attendance:
-            raise HTTPException(status_code=400, detail="Already marked attendance for this unit today")
+        class_session = await run_in_db(check_bluetooth_attendance, db, current_user, beacon_id)
         
-        # Check if the student's device was detected by the scanner
-        if not scanner.is_device_detected(str(current_user.id)):
+        # Check if the student's device was detected by the scanner during this broadcast
+        if not scanner.is_device_detected(normalize_mac(current_user.bluetooth_address), beacon_id):
             raise HTTPException(status_code=400, detail="Your device was not detected in the classroom")
         
-        # Create attendance record
-        attendance = Attendance(
-            user_id=current_user.id,
-            unit_id=unit_id,
-            attendance_type=AttendanceType.BLUETOOTH,
-            bluetooth_address=current_user.bluetooth_address
-        )
-        db.add(attendance)
-        db.commit()
+        await run_in_db(record_bluetooth_attendance, db, current_user, class_session)
         
         return {
             "message": "Attendance marked successfully",
@@ -407,43 +535,144 @@ async def mark_bluetooth_attendance(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid beacon ID")
 
+def lecturer_class_session(db: Session, lecturer: User, beacon_id: str) -> ClassSession:
+    class_session = db.query(ClassSession).filter(ClassSession.beacon_id == beacon_id).first()
+    if not class_session:
+        raise HTTPException(status_code=404, detail="Broadcast session not found")
+    if class_session.lecturer_id != lecturer.id:
+        raise HTTPException(status_code=403, detail="Not authorized to follow this broadcast")
+    return class_session
+
+def session_attendance_events(db: Session, session_id: int, after_id: int = 0) -> List[dict]:
+    """Attendance already recorded in a session, as events, oldest first"""
+    rows = db.query(
+        Attendance.id, Attendance.unit_id, Attendance.user_id, Attendance.attendance_type, Attendance.marked_at,
+        User.username, User.full_name, User.admission_number
+    ).join(User, User.id == Attendance.user_id).filter(
+        Attendance.session_id == session_id,
+        Attendance.id > after_id
+    ).order_by(Attendance.id).all()
+    return [
+        attendance_event(
+            attendance_id, session_id, unit_id, user_id, attendance_type,
+            username, full_name, admission_number, marked_at
+        )
+        for attendance_id, unit_id, user_id, attendance_type, marked_at, username, full_name, admission_number in rows
+    ]
+
+@app.get("/bluetooth/sessions/{beacon_id}/events")
+async def stream_session_attendance(
+    beacon_id: str,
+    request: Request,
+    access_token: Optional[str] = Query(None),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """Server-Sent Events for one broadcast: a `marked` event per student marked present.
+
+    Students already marked are sent first, then new marks as they are
+    committed, and an `end` event when the broadcast stops. EventSource
+    can't send headers, so the token may be passed as ?access_token=.
+    A reconnect sends Last-Event-ID and only gets what it missed.
+    """
+    current_user = await get_current_user(token or access_token or "", db)
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can follow a broadcast")
+    class_session = await run_in_db(lecturer_class_session, db, current_user, beacon_id)
+    session_id, ended = class_session.id, class_session.ended_at is not None
+    try:
+        after_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        after_id = 0
+
+    # Subscribe before reading the backlog so no mark falls in between
+    subscription = attendance_events.subscribe(session_id)
+    try:
+        backlog = await run_in_db(session_attendance_events, db, session_id, after_id)
+    except Exception:
+        attendance_events.unsubscribe(subscription)
+        raise
+    finally:
+        # The stream never touches the database; give the connection back now
+        await run_in_db(db.close)
+    return StreamingResponse(
+        attendance_events.stream(subscription, backlog, ended=ended),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/attendance/student", response_model=List[AttendanceSummary])
 async def get_student_attendance(
     current_user: User = Depends(get_current_user),
     unit_id: Optional[int] = None,
+    records: bool = True,
+    records_limit: Optional[int] = Query(None, ge=1),
     db: Session = Depends(get_db)
 ):
     if current_user.role != UserRole.STUDENT:
         raise HTTPException(status_code=403, detail="Only students can access this endpoint")
     
-    # Get all units the student is enrolled in
-    query = db.query(Enrollment).filter(Enrollment.user_id == current_user.id)
+    return await run_in_db(build_student_attendance, db, current_user, unit_id, records, records_limit)
+
+def build_student_attendance(
+    db: Session,
+    current_user: User,
+    unit_id: Optional[int],
+    records: bool = True,
+    records_limit: Optional[int] = None
+):
+    # One row per enrolled unit, with the maintained attendance counter
+    query = db.query(Unit.id, Unit.code, Unit.name, func.coalesce(AttendanceCounter.attended, 0)).join(
+        Enrollment, Enrollment.unit_id == Unit.id
+    ).outerjoin(
+        AttendanceCounter, and_(AttendanceCounter.unit_id == Unit.id, AttendanceCounter.user_id == current_user.id)
+    ).filter(Enrollment.user_id == current_user.id)
     if unit_id:
-        query = query.filter(Enrollment.unit_id == unit_id)
+        query = query.filter(Unit.id == unit_id)
     
-    enrollments = query.all()
+    unit_counts = query.order_by(Unit.id).all()
+    held = sessions_held(db, [row[0] for row in unit_counts])
     
-    attendance_summaries = []
-    for enrollment in enrollments:
-        # Get attendance records for this unit
-        attendance_records = db.query(Attendance).filter(
+    # Records are only loaded when asked for, in one query across all units
+    records_by_unit = {}
+    if records and unit_counts:
+        record_query = db.query(Attendance).filter(
             Attendance.user_id == current_user.id,
-            Attendance.unit_id == enrollment.unit_id
-        ).all()
-        
-        # Calculate attendance percentage
-        attended_classes = len(attendance_records)
-        percentage = (attended_classes / 12) * 100  # 12 classes per unit
+            Attendance.unit_id.in_([row[0] for row in unit_counts])
+        )
+        if records_limit:
+            # Most recent records_limit records per unit
+            ranked = db.query(
+                Attendance.id.label("id"),
+                func.row_number().over(
+                    partition_by=Attendance.unit_id,
+                    order_by=Attendance.marked_at.desc()
+                ).label("position")
+            ).filter(Attendance.user_id == current_user.id).subquery()
+            record_query = record_query.join(ranked, ranked.c.id == Attendance.id).filter(
+                ranked.c.position <= records_limit
+            )
+        for record in record_query.order_by(Attendance.marked_at.desc()):
+            records_by_unit.setdefault(record.unit_id, []).append(record)
+    
+    attendance_summaries = []
+    for unit_id, unit_code, unit_name, attended_classes in unit_counts:
+        # Percentage of the sessions the unit has actually held
+        total_classes = held.get(unit_id, 0)
+        percentage = attendance_percentage(attended_classes, total_classes)
         
         # Add percentage to each record
+        attendance_records = records_by_unit.get(unit_id, [])
         for record in attendance_records:
             record.percentage = percentage
+            record.total_classes = total_classes
             record.attended_classes = attended_classes
         
         attendance_summaries.append(AttendanceSummary(
-            unit_id=enrollment.unit_id,
-            unit_code=enrollment.unit.code,
-            unit_name=enrollment.unit.name,
+            unit_id=unit_id,
+            unit_code=unit_code,
+            unit_name=unit_name,
+            total_classes=total_classes,
             attended_classes=attended_classes,
             percentage=percentage,
             attendance_records=attendance_records,
@@ -452,7 +681,15 @@ async def get_student_attendance(
     
     return attendance_summaries
 
-@app.get("/attendance/lecturer", response_model=List[AttendanceSummary])
+def day_range(date: str):
+    """[start, end) of a YYYY-MM-DD day, so marked_at filters can use an index"""
+    try:
+        day_start = datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date. Use YYYY-MM-DD")
+    return day_start, day_start + timedelta(days=1)
+
+@app.get("/attendance/lecturer", response_model=List[AttendanceSummary], response_class=FastJSONResponse)
 async def get_lecturer_attendance(
     current_user: User = Depends(get_current_user),
     unit_id: Optional[int] = None,
@@ -462,25 +699,35 @@ async def get_lecturer_attendance(
     if current_user.role != UserRole.LECTURER:
         raise HTTPException(status_code=403, detail="Only lecturers can access this endpoint")
     
-        # Get all units taught by the lecturer
+    return await run_in_db(build_lecturer_attendance, db, current_user, unit_id, date)
+
+def lecturer_units(db: Session, current_user: User, unit_id: Optional[int]) -> List[Unit]:
     query = db.query(Unit).filter(Unit.lecturer_id == current_user.id)
     if unit_id:
         query = query.filter(Unit.id == unit_id)
+    return query.order_by(Unit.id).all()
+
+def build_lecturer_attendance(db: Session, current_user: User, unit_id: Optional[int], date: Optional[str]):
+    units = lecturer_units(db, current_user, unit_id)
+    day_start, day_end = day_range(date) if date else (None, None)
+    held = sessions_held(db, [unit.id for unit in units], day_start, day_end)
     
-    units = query.all()
+    # Records of every unit with their students in one joined query, so
+    # serialising record.user never lazy-loads
+    records_by_unit = {unit.id: [] for unit in units}
+    if units:
+        query = db.query(Attendance).join(Attendance.user).options(contains_eager(Attendance.user)).filter(
+            Attendance.unit_id.in_(list(records_by_unit))
+        )
+        if date:
+            query = query.filter(Attendance.marked_at >= day_start, Attendance.marked_at < day_end)
+        for record in query.order_by(Attendance.unit_id, Attendance.id):
+            records_by_unit[record.unit_id].append(record)
     
     attendance_summaries = []
     for unit in units:
-        # Get attendance records for this unit with user information
-        query = db.query(Attendance).join(
-            User, 
-            Attendance.user_id == User.id  # Explicitly specify the join condition
-        ).filter(Attendance.unit_id == unit.id)
-        
-        if date:
-            query = query.filter(func.date(Attendance.marked_at) == date)
-        
-        attendance_records = query.all()
+        attendance_records = records_by_unit[unit.id]
+        total_classes = held.get(unit.id, 0)
         
         # Group attendance by student
         student_attendance = {}
@@ -492,54 +739,247 @@ async def get_lecturer_attendance(
         # Calculate attendance percentage for each student
         for student_id, records in student_attendance.items():
             attended_classes = len(records)
-            percentage = (attended_classes / 12) * 100  # 12 classes per unit
+            percentage = attendance_percentage(attended_classes, total_classes)
             
             # Add percentage to each record
             for record in records:
                 record.percentage = percentage
+                record.total_classes = total_classes
                 record.attended_classes = attended_classes
         
         attendance_summaries.append(AttendanceSummary(
             unit_id=unit.id,
             unit_code=unit.code,
             unit_name=unit.name,
+            total_classes=total_classes,
             attended_classes=len(attendance_records),
-            percentage=(len(attendance_records) / (12 * len(student_attendance))) * 100 if student_attendance else 0,
+            percentage=attendance_percentage(len(attendance_records), total_classes * len(student_attendance)),
             attendance_records=attendance_records
         ))
     
     return attendance_summaries
 
+# Built as plain dicts and serialised as they are, without response_model
+# validation; CompactLecturerAttendance documents the shape in the OpenAPI schema
+@app.get(
+    "/attendance/lecturer/compact",
+    response_class=FastJSONResponse,
+    responses={200: {"model": CompactLecturerAttendance, "description": "Attendance with students listed once"}}
+)
+async def get_lecturer_attendance_compact(
+    current_user: User = Depends(get_current_user),
+    unit_id: Optional[int] = None,
+    date: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """/attendance/lecturer with students referenced by id and listed once per response"""
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can access this endpoint")
+    
+    return FastJSONResponse(await run_in_db(build_lecturer_attendance_compact, db, current_user, unit_id, date))
+
+def build_lecturer_attendance_compact(db: Session, current_user: User, unit_id: Optional[int], date: Optional[str]):
+    # Plain dicts from column queries: no ORM entities and no per-record validation
+    units = lecturer_units(db, current_user, unit_id)
+    day_start, day_end = day_range(date) if date else (None, None)
+    held = sessions_held(db, [unit.id for unit in units], day_start, day_end)
+    
+    records_by_unit = {unit.id: [] for unit in units}
+    students = {}
+    if units:
+        query = db.query(
+            Attendance.id, Attendance.unit_id, Attendance.user_id, Attendance.attendance_type,
+            Attendance.marked_at, Attendance.marked_by, Attendance.session_id
+        ).filter(Attendance.unit_id.in_(list(records_by_unit)))
+        if date:
+            query = query.filter(Attendance.marked_at >= day_start, Attendance.marked_at < day_end)
+        for record_id, record_unit_id, user_id, attendance_type, marked_at, marked_by, session_id in query.order_by(
+            Attendance.unit_id, Attendance.id
+        ):
+            records_by_unit[record_unit_id].append({
+                "id": record_id,
+                "user_id": user_id,
+                "attendance_type": attendance_type,
+                "marked_at": marked_at,
+                "marked_by": marked_by,
+                "session_id": session_id
+            })
+            students[user_id] = None
+        
+        if students:
+            for user_id, username, full_name, admission_number, bluetooth_address in db.query(
+                User.id, User.username, User.full_name, User.admission_number, User.bluetooth_address
+            ).filter(User.id.in_(list(students))):
+                students[user_id] = {
+                    "id": user_id,
+                    "username": username,
+                    "full_name": full_name,
+                    "admission_number": admission_number,
+                    "bluetooth_address": bluetooth_address
+                }
+    
+    unit_entries = []
+    for unit in units:
+        attendance_records = records_by_unit[unit.id]
+        total_classes = held.get(unit.id, 0)
+        attended_by_student = {}
+        for record in attendance_records:
+            attended_by_student[record["user_id"]] = attended_by_student.get(record["user_id"], 0) + 1
+        unit_entries.append({
+            "unit_id": unit.id,
+            "unit_code": unit.code,
+            "unit_name": unit.name,
+            "total_classes": total_classes,
+            "attended_classes": len(attendance_records),
+            "percentage": attendance_percentage(len(attendance_records), total_classes * len(attended_by_student)),
+            "students": [
+                {
+                    "user_id": user_id,
+                    "attended_classes": attended,
+                    "percentage": attendance_percentage(attended, total_classes)
+                }
+                for user_id, attended in attended_by_student.items()
+            ],
+            "attendance_records": attendance_records
+        })
+    
+    return {"units": unit_entries, "students": students}
+
+@app.get("/attendance/lecturer/report", response_model=List[UnitAttendanceReport])
+async def get_lecturer_attendance_report(
+    current_user: User = Depends(get_current_user),
+    unit_id: Optional[int] = None,
+    date: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Per-student attendance counts and percentages, aggregated in the database"""
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can access this endpoint")
+    
+    return await run_in_db(build_lecturer_report, db, current_user, unit_id, date)
+
+def build_lecturer_report(db: Session, current_user: User, unit_id: Optional[int], date: Optional[str]):
+    query = db.query(Unit).filter(Unit.lecturer_id == current_user.id)
+    if unit_id:
+        query = query.filter(Unit.id == unit_id)
+    units = query.order_by(Unit.id).all()
+    if not units:
+        return []
+    
+    student_columns = (Enrollment.unit_id, User.id, User.username, User.full_name, User.admission_number)
+    day_start, day_end = day_range(date) if date else (None, None)
+    held = sessions_held(db, [unit.id for unit in units], day_start, day_end)
+    if date:
+        # A single day has to be counted from the attendance rows
+        attendance_join = and_(
+            Attendance.user_id == Enrollment.user_id,
+            Attendance.unit_id == Enrollment.unit_id,
+            Attendance.marked_at >= day_start,
+            Attendance.marked_at < day_end
+        )
+        query = db.query(*student_columns, func.count(Attendance.id)).join(
+            User, User.id == Enrollment.user_id
+        ).outerjoin(
+            Attendance, attendance_join
+        ).group_by(*student_columns)
+    else:
+        # All-time totals come straight from the counters: one row per enrollment
+        query = db.query(*student_columns, func.coalesce(AttendanceCounter.attended, 0)).join(
+            User, User.id == Enrollment.user_id
+        ).outerjoin(
+            AttendanceCounter, and_(
+                AttendanceCounter.user_id == Enrollment.user_id,
+                AttendanceCounter.unit_id == Enrollment.unit_id
+            )
+        )
+    
+    # Every enrolled student with their attendance count, zero included
+    rows = query.filter(
+        Enrollment.unit_id.in_([unit.id for unit in units])
+    ).order_by(Enrollment.unit_id, User.username).all()
+    
+    students_by_unit = {}
+    for row_unit_id, user_id, username, full_name, admission_number, attended in rows:
+        students_by_unit.setdefault(row_unit_id, []).append(StudentAttendanceStats(
+            user_id=user_id,
+            username=username,
+            full_name=full_name,
+            admission_number=admission_number,
+            attended_classes=attended,
+            total_classes=held.get(row_unit_id, 0),
+            percentage=attendance_percentage(attended, held.get(row_unit_id, 0))
+        ))
+    
+    reports = []
+    for unit in units:
+        students = students_by_unit.get(unit.id, [])
+        attended = sum(student.attended_classes for student in students)
+        total_classes = held.get(unit.id, 0)
+        reports.append(UnitAttendanceReport(
+            unit_id=unit.id,
+            unit_code=unit.code,
+            unit_name=unit.name,
+            total_classes=total_classes,
+            attended_classes=attended,
+            percentage=attendance_percentage(attended, total_classes * len(students)),
+            students=students
+        ))
+    return reports
+
+@app.get("/attendance/lecturer/records", response_model=AttendanceRecordPage)
+async def get_lecturer_attendance_records(
+    current_user: User = Depends(get_current_user),
+    unit_id: Optional[int] = None,
+    date: Optional[str] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Raw attendance records for the lecturer's units, keyset-paginated by id"""
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can access this endpoint")
+    
+    return await run_in_db(build_lecturer_records_page, db, current_user, unit_id, date, after_id, limit)
+
+def build_lecturer_records_page(
+    db: Session,
+    current_user: User,
+    unit_id: Optional[int],
+    date: Optional[str],
+    after_id: Optional[int],
+    limit: int
+):
+    lecturer_units = select(Unit.id).where(Unit.lecturer_id == current_user.id)
+    if unit_id:
+        lecturer_units = lecturer_units.where(Unit.id == unit_id)
+    
+    query = db.query(Attendance).filter(Attendance.unit_id.in_(lecturer_units))
+    if date:
+        day_start, day_end = day_range(date)
+        query = query.filter(Attendance.marked_at >= day_start, Attendance.marked_at < day_end)
+    if after_id is not None:
+        query = query.filter(Attendance.id > after_id)
+    
+    # Fetch one extra row to know whether another page follows
+    records = query.order_by(Attendance.id).limit(limit + 1).all()
+    next_cursor = records[limit - 1].id if len(records) > limit else None
+    return AttendanceRecordPage(records=records[:limit], next_cursor=next_cursor)
+
 @app.get("/units/available", response_model=List[UnitSchema])
 def get_available_units(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if current_user.role != UserRole.STUDENT:
         raise HTTPException(status_code=403, detail="Only students can view available units")
     
-    # Get all units
-    all_units = db.query(Unit).all()
-    
-    # Get units the student is already enrolled in
-    enrolled_units = db.query(Enrollment).filter(Enrollment.user_id == current_user.id).all()
-    enrolled_unit_ids = [enrollment.unit_id for enrollment in enrolled_units]
-    
-    # Filter out units the student is already enrolled in
-    available_units = [unit for unit in all_units if unit.id not in enrolled_unit_ids]
-    
-    return available_units
+    # Units the student is not enrolled in, filtered in the database
+    enrolled = exists().where(Enrollment.unit_id == Unit.id, Enrollment.user_id == current_user.id)
+    return db.query(Unit).filter(~enrolled).order_by(Unit.id).all()
 
 @app.get("/enrollments/student", response_model=List[UnitSchema])
 def get_student_enrollments(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if current_user.role != UserRole.STUDENT:
         raise HTTPException(status_code=403, detail="Only students can view their enrollments")
     
-    # Get all enrollments for the student
-    enrollments = db.query(Enrollment).filter(Enrollment.user_id == current_user.id).all()
-    
-    # Get the corresponding
-    unit_ids = [enrollment.unit_id for enrollment in enrollments]
-    units = db.query(Unit).filter(Unit.id.in_(unit_ids)).all()
-    
-    return units
+    return enrolled_units(db, current_user.id)
 
 @app.delete("/enroll/{unit_id}")
 def unenroll_from_unit(unit_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -569,6 +1009,7 @@ def unenroll_from_unit(unit_id: int, current_user: User = Depends(get_current_us
     
     db.delete(enrollment)
     db.commit()
+    invalidate_student_index(db)
     return {"message": "Successfully unenrolled from unit"}
 
 class AttendanceCreate(BaseModel):
@@ -622,36 +1063,57 @@ def create_attendance(attendance: AttendanceCreate, current_user: User = Depends
     finally:
         db.close()
 
-# Initialize the Bluetooth scanner
-scanner = BluetoothScanner()
-
 @app.on_event("startup")
 async def startup_event():
+    # Create missing tables here rather than at import, so importing the app
+    # (tests, scripts, extra workers) never touches the database
+    await run_in_db(init_db)
+    if engine.dialect.name == "sqlite":
+        # Make sure the SQLite performance profile actually took effect
+        status = await run_in_db(verify_sqlite_profile, engine)
+        logger.info(f"SQLite profile {status['profile']!r}: {status['pragmas']}")
     # Initialize the scanner but don't start scanning
     logger.info("Bluetooth scanner initialized")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down...")
-    if scanner:
+    if scanner.scanning:
         await stop_scanner()
     logger.info("Bluetooth scanner stopped")
+    password_hasher.shutdown()
+
+def check_database():
+    # A pooled connection is enough to prove the database answers; no ORM session
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+# Probes hit the database at most once per HEALTH_CHECK_TTL seconds
+database_health = CachedHealthCheck(check_database)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint to monitor system status"""
     try:
         # Check database connection
-        db = SessionLocal()
-        db.execute(text("SELECT 1"))
-        db.close()
+        database = database_health.cached() or await run_in_db(database_health.run)
+        if not database["healthy"]:
+            raise RuntimeError(database["error"])
         
         # Check Bluetooth scanner status
         scanner_status = "running" if scanner.scanning else "stopped"
         
         # Get system metrics
+        # Anyone can call this, so pool, cache and stream internals go to /metrics
         metrics = {
             "database": "healthy",
+            "database_checked_at": datetime.utcfromtimestamp(database["checked_at"]).isoformat(),
+            "database_latency_ms": database["latency_ms"],
+            # Which profile is in force, without the pragma values
+            "database_profile": {
+                "profile": profile_status.get("profile"),
+                "verified": bool(profile_status.get("verified"))
+            },
             "bluetooth_scanner": scanner_status,
             "detected_devices": len(scanner.detected_devices),
             "uptime": datetime.utcnow() - scanner.start_time if hasattr(scanner, 'start_time') else None
@@ -671,6 +1133,69 @@ async def health_check():
             "error": str(e)
         }
 
+def runtime_metrics():
+    """Scanner, cache, hashing pool and database profile state, read at scrape time"""
+    pipeline = scanner.get_pipeline_stats()
+    hashing = password_hasher.stats()
+    cache = principal_cache.stats()
+    streams = attendance_events.stats()
+    return [
+        snapshot(Counter, "scanner_detections_total", "BLE advertisements seen by the detection callback",
+                 pipeline["detections"]),
+        snapshot(Counter, "scanner_new_devices_total", "Devices seen for the first time within their TTL",
+                 pipeline["new_devices"]),
+        snapshot(Counter, "scanner_dedup_hits_total", "New devices whose student was already marked",
+                 pipeline["dedup_hits"]),
+        snapshot(Counter, "scanner_rejected_unknown_total", "New devices registered to no student",
+                 pipeline["rejected_unknown"]),
+        snapshot(Counter, "scanner_not_enrolled_total", "New devices of students in none of the open sessions' units",
+                 pipeline["not_enrolled"]),
+        snapshot(Counter, "scanner_attendance_written_total", "Attendance rows written by the scanner",
+                 pipeline["attendance_written"]),
+        snapshot(Gauge, "scanner_dedup_hit_ratio", "Share of new devices that needed no database work",
+                 pipeline["dedup_hit_ratio"]),
+        snapshot(Gauge, "scanner_queue_depth", "Detected addresses waiting for the batch worker",
+                 pipeline["queue_depth"]),
+        snapshot(Gauge, "scanner_tracked_devices", "Devices currently tracked by the scanner",
+                 pipeline["tracked_devices"]),
+        snapshot(Gauge, "scanner_active_sessions", "Open broadcast sessions", len(scanner.sessions)),
+        snapshot(Gauge, "password_hash_in_flight", "Password hashes running", hashing["in_flight"]),
+        snapshot(Gauge, "password_hash_queued", "Password hashes waiting for a worker", hashing["queued"]),
+        snapshot(Gauge, "password_hash_workers", "Password hashes that can run at once", hashing["workers"]),
+        snapshot(Gauge, "password_hash_peak_in_flight", "Most password hashes running at once",
+                 hashing["peak_in_flight"]),
+        snapshot(Counter, "password_hash_completed_total", "Password hashes finished", hashing["completed"]),
+        snapshot(Counter, "password_hash_failed_total", "Password hashes that raised", hashing["failed"]),
+        snapshot(Counter, "password_hash_rejected_total", "Logins turned away with 503", hashing["rejected"]),
+        snapshot(Gauge, "password_hash_latency_p50_seconds", "Median recent password hash time",
+                 hashing["latency_p50_ms"] / 1000),
+        snapshot(Gauge, "password_hash_latency_p99_seconds", "99th percentile recent password hash time",
+                 hashing["latency_p99_ms"] / 1000),
+        snapshot(Gauge, "password_hash_queue_wait_p99_seconds", "99th percentile recent wait for a hashing worker",
+                 hashing["queue_wait_p99_ms"] / 1000),
+        snapshot(Gauge, "principal_cache_entries", "Authenticated users cached in this worker", cache["entries"]),
+        snapshot(Counter, "principal_cache_hits_total", "Authenticated users served from cache", cache["hits"]),
+        snapshot(Counter, "principal_cache_misses_total", "Authenticated users loaded from the database",
+                 cache["misses"]),
+        snapshot(Gauge, "attendance_stream_subscribers", "Open dashboard event streams", streams["subscribers"]),
+        snapshot(Counter, "attendance_stream_published_total", "Attendance events published", streams["published"]),
+        snapshot(Counter, "attendance_stream_overflows_total", "Events dropped for slow dashboard streams",
+                 streams["overflows"]),
+        snapshot(Gauge, "database_profile_verified", "1 when the SQLite pragmas matched the profile at startup",
+                 1 if profile_status.get("verified") else 0),
+    ]
+
+registry.add_collector(runtime_metrics)
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint; requires `Bearer $METRICS_TOKEN` when that is set"""
+    if METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/debug/bluetooth")
 async def debug_bluetooth():
     """Debug endpoint for Bluetooth functionality"""
@@ -684,6 +1209,8 @@ async def debug_bluetooth():
                 }
                 for address, last_seen in scanner.detected_devices.items()
             ],
+            "sessions": [session.to_dict() for session in scanner.sessions.values()],
+            "pipeline": scanner.get_pipeline_stats(),
             "last_error": str(scanner.last_error) if hasattr(scanner, 'last_error') else None
         }
     except Exception as e:
@@ -729,12 +1256,14 @@ def mark_manual_attendance(
     if not enrollment:
         raise HTTPException(status_code=400, detail="Student is not enrolled in this unit")
     
-    # Check if attendance already marked for today
-    today = datetime.utcnow().date()
-    existing_attendance = db.query(Attendance).filter(
-        Attendance.user_id == student.id,
-        Attendance.unit_id == attendance.unit_id,
-        Attendance.marked_at >= today
+    # Today's class session, and whether the student is already marked in it.
+    # A new session is committed on its own, so losing the insert race below
+    # can't roll it back
+    session_id = day_sessions(db, [attendance.unit_id])[attendance.unit_id]
+    db.commit()
+    existing_attendance = db.query(Attendance.id).filter(
+        Attendance.session_id == session_id,
+        Attendance.user_id == student.id
     ).first()
     if existing_attendance:
         raise HTTPException(status_code=400, detail="Attendance already marked for this student today")
@@ -743,13 +1272,252 @@ def mark_manual_attendance(
     db_attendance = Attendance(
         user_id=student.id,
         unit_id=attendance.unit_id,
+        session_id=session_id,
         attendance_type=attendance.attendance_type,
         marked_by=current_user.id
     )
     db.add(db_attendance)
-    db.commit()
+    try:
+        db.flush()
+        increment_attendance_counters(db, [(student.id, attendance.unit_id)])
+        db.commit()
+    except IntegrityError:
+        # The scanner marked this student in the meantime; return its record
+        db.rollback()
+        existing = db.query(Attendance).filter(
+            Attendance.session_id == session_id,
+            Attendance.user_id == student.id
+        ).first()
+        if existing is None:
+            raise HTTPException(status_code=409, detail="Attendance changed while marking, please retry")
+        return existing
     db.refresh(db_attendance)
-    return db_attendance 
+    attendance_events.publish([attendance_event(
+        db_attendance.id, session_id, attendance.unit_id, student.id, db_attendance.attendance_type,
+        student.username, student.full_name, student.admission_number, db_attendance.marked_at
+    )])
+    return db_attendance
+
+def lecturer_unit_ids(db: Session, lecturer: User, unit_id: Optional[int]) -> List[int]:
+    query = db.query(Unit.id).filter(Unit.lecturer_id == lecturer.id)
+    if unit_id is not None:
+        query = query.filter(Unit.id == unit_id)
+    unit_ids = [unit_id for (unit_id,) in query]
+    if unit_id is not None and not unit_ids:
+        raise HTTPException(status_code=404, detail="Unit not found or not taught by you")
+    return unit_ids
+
+@app.get("/attendance/export")
+async def export_attendance(
+    request: Request,
+    unit_id: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    gzip: Optional[bool] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stream every attendance record for one or all of the lecturer's units.
+
+    Exports across every unit, for registrars, go through
+    scripts/export_attendance.py.
+
+    start and end (inclusive) are YYYY-MM-DD days, so a semester is one
+    request. Responses are gzip-encoded when asked for with ?gzip=true or
+    by an Accept-Encoding header that includes gzip.
+    """
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can export attendance")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export needs the pyarrow package on the server")
+    start_at = day_range(start)[0] if start else None
+    end_at = day_range(end)[1] if end else None
+    unit_ids = await run_in_db(lecturer_unit_ids, db, current_user, unit_id)
+
+    if gzip is None:
+        gzip = "gzip" in request.headers.get("accept-encoding", "")
+    filename = f"attendance-{unit_id or 'all'}-{start or 'start'}-{end or 'now'}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    # A sync generator: Starlette pulls it on a worker thread, so fetching
+    # rows never blocks the event loop. It reads on its own connection, as
+    # the request's session may be closed before the body is sent.
+    return StreamingResponse(
+        iter_export_on(engine, format, unit_ids, start_at, end_at, gzip=gzip),
+        media_type=MEDIA_TYPES[format],
+        headers=headers
+    )
+
+# Upper bound on rows per bulk request; a large lecture is a few hundred students
+MAX_BULK_ATTENDANCE_ROWS = 2000
+ADMISSION_NUMBER_PATTERN = re.compile(r'^\d{4}/\d{2}/\d{4}/\d{2}/\d{2}$')
+
+class BulkManualAttendanceCreate(BaseModel):
+    unit_id: int
+    admission_numbers: List[str]
+    attendance_type: AttendanceType = AttendanceType.MANUAL
+    date: Optional[str] = None  # YYYY-MM-DD of the class, default today
+
+def record_bulk_manual_attendance(
+    db: Session,
+    lecturer: User,
+    unit_id: int,
+    admission_numbers: List[str],
+    attendance_type: AttendanceType,
+    date: Optional[str]
+) -> BulkAttendanceResult:
+    """Mark a whole register with set-based lookups and a single insert transaction"""
+    if len(admission_numbers) > MAX_BULK_ATTENDANCE_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ATTENDANCE_ROWS} rows per request")
+    day_start, _ = day_range(date or datetime.utcnow().strftime("%Y-%m-%d"))
+
+    unit = db.query(Unit.id, Unit.lecturer_id).filter(Unit.id == unit_id).first()
+    if not unit:
+        raise HTTPException(status_code=404, detail="Unit not found")
+    if unit.lecturer_id != lecturer.id:
+        raise HTTPException(status_code=403, detail="Not authorized to mark attendance for this unit")
+
+    outcomes = [
+        BulkAttendanceOutcome(row=row, admission_number=(number or "").strip(), status="invalid")
+        for row, number in enumerate(admission_numbers, start=1)
+    ]
+    seen = set()
+    for outcome in outcomes:
+        if not ADMISSION_NUMBER_PATTERN.match(outcome.admission_number):
+            continue
+        if outcome.admission_number in seen:
+            outcome.status = "duplicate"
+        else:
+            seen.add(outcome.admission_number)
+            outcome.status = "pending"
+
+    students = dict(
+        db.query(User.admission_number, User.id).filter(
+            User.admission_number.in_(seen),
+            User.role == UserRole.STUDENT
+        ).all()
+    ) if seen else {}
+    enrolled = {
+        user_id for (user_id,) in db.query(Enrollment.user_id).filter(
+            Enrollment.unit_id == unit_id,
+            Enrollment.user_id.in_(list(students.values()))
+        )
+    } if students else set()
+
+    pending = [outcome for outcome in outcomes if outcome.status == "pending"]
+    for outcome in pending:
+        outcome.student_id = students.get(outcome.admission_number)
+        if outcome.student_id is None:
+            outcome.status = "not_found"
+        elif outcome.student_id not in enrolled:
+            outcome.status = "not_enrolled"
+    pending = [outcome for outcome in pending if outcome.status == "pending"]
+
+    marked_at = datetime.combine(day_start.date(), datetime.utcnow().time())
+    # A scanner batch can mark one of these students between our duplicate
+    # check and the insert; the (session, student) unique index catches that,
+    # so re-read and go again once.
+    for attempt in range(2):
+        session_id = day_sessions(db, [unit_id], marked_at)[unit_id] if pending else None
+        already = {
+            user_id: attendance_id for user_id, attendance_id in db.query(Attendance.user_id, Attendance.id).filter(
+                Attendance.session_id == session_id,
+                Attendance.user_id.in_([outcome.student_id for outcome in pending])
+            )
+        } if pending else {}
+        to_insert = [outcome for outcome in pending if outcome.student_id not in already]
+        rows = [
+            {
+                "user_id": outcome.student_id,
+                "unit_id": unit_id,
+                "session_id": session_id,
+                "attendance_type": attendance_type,
+                "marked_at": marked_at,
+                "marked_by": lecturer.id
+            }
+            for outcome in to_insert
+        ]
+        try:
+            # One multi-row INSERT ... RETURNING instead of a statement per student
+            inserted = dict(
+                db.execute(insert(Attendance).returning(Attendance.user_id, Attendance.id), rows).all()
+            ) if rows else {}
+            increment_attendance_counters(db, [(user_id, unit_id) for user_id in inserted])
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            if attempt:
+                raise HTTPException(status_code=409, detail="Attendance changed while marking, please retry")
+
+    for outcome in pending:
+        if outcome.student_id in already:
+            outcome.status = "already_marked"
+            outcome.attendance_id = already[outcome.student_id]
+        else:
+            outcome.status = "marked"
+            outcome.attendance_id = inserted[outcome.student_id]
+    attendance_events.publish(
+        attendance_event(
+            outcome.attendance_id, session_id, unit_id, outcome.student_id, attendance_type,
+            admission_number=outcome.admission_number, marked_at=marked_at
+        )
+        for outcome in pending if outcome.status == "marked"
+    )
+
+    logger.info(f"Bulk attendance for unit {unit_id}: {len(inserted)} of {len(outcomes)} rows marked")
+    return BulkAttendanceResult(
+        unit_id=unit_id,
+        date=day_start.strftime("%Y-%m-%d"),
+        marked=len(inserted),
+        outcomes=outcomes
+    )
+
+def parse_admission_numbers_csv(content: bytes) -> List[str]:
+    """Admission numbers from a register CSV: an admission_number column, or the first column"""
+    try:
+        rows = list(csv.reader(io.StringIO(content.decode("utf-8-sig"))))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8 encoded")
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    column = 0
+    if rows:
+        header = [cell.strip().lower().replace(" ", "_") for cell in rows[0]]
+        if "admission_number" in header:
+            column = header.index("admission_number")
+            rows = rows[1:]
+    return [row[column] if column < len(row) else "" for row in rows]
+
+@app.post("/attendance/manual/bulk", response_model=BulkAttendanceResult)
+async def mark_bulk_manual_attendance(
+    attendance: BulkManualAttendanceCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can mark manual attendance")
+    return await run_in_db(
+        record_bulk_manual_attendance, db, current_user, attendance.unit_id,
+        attendance.admission_numbers, attendance.attendance_type, attendance.date
+    )
+
+@app.post("/attendance/manual/bulk/csv", response_model=BulkAttendanceResult)
+async def mark_bulk_manual_attendance_csv(
+    unit_id: int = Form(...),
+    file: UploadFile = File(...),
+    date: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if current_user.role != UserRole.LECTURER:
+        raise HTTPException(status_code=403, detail="Only lecturers can mark manual attendance")
+    admission_numbers = parse_admission_numbers_csv(await file.read())
+    return await run_in_db(
+        record_bulk_manual_attendance, db, current_user, unit_id,
+        admission_numbers, AttendanceType.MANUAL, date
+    )
 
 if __name__ == "__main__":
     import uvicorn
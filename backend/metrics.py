@@ -0,0 +1,348 @@
+"""Prometheus-style metrics: request latency, database queries and scanner load.
+
+Metrics are kept in process and rendered in the Prometheus text exposition
+format by GET /metrics. Request timing comes from MetricsMiddleware, query
+counts and times from SQLAlchemy cursor events. Everything else (scanner
+pipeline, caches, hashing pool) is read from the existing stats at scrape
+time by collectors.
+"""
+import os
+import math
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Bearer token /metrics requires when set; unset leaves it open to the scraper
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# How long a database health check result is reused by /health
+HEALTH_CHECK_TTL = float(os.getenv("HEALTH_CHECK_TTL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """Nearest-rank percentile of values, 0.0 when there are none"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class Metric:
+    """A named family of samples, one per combination of label values"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts, then +Inf, then the running sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(self._key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def sum(self, **labels) -> float:
+        counts = self._values.get(self._key(labels))
+        return counts[-1] if counts else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        bucket_labels = self.labelnames + ("le",)
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(bucket_labels, key + (_format_value(bound),))} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+def snapshot(kind: type, name: str, documentation: str, value: float) -> Metric:
+    """An unlabelled metric holding one value, for collectors that read existing stats"""
+    metric = kind(name, documentation)
+    metric._values[()] = value
+    return metric
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        """Register a function that builds metrics from live state on every scrape"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector {collector.__name__} failed: {str(e)}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request", ("method", "route")
+)
+http_request_queries = registry.histogram(
+    "http_request_db_queries", "Database statements executed per HTTP request", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS
+)
+http_request_query_time = registry.histogram(
+    "http_request_db_seconds", "Time spent in database statements per HTTP request", ("method", "route")
+)
+db_queries = registry.counter(
+    "db_queries_total", "Database statements executed", ("operation",)
+)
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Time to execute one database statement", ("operation",),
+    buckets=QUERY_LATENCY_BUCKETS
+)
+scanner_batch_duration = registry.histogram(
+    "scanner_batch_duration_seconds", "Time to resolve and write one batch of detected devices"
+)
+
+class RequestQueryStats:
+    """Statements run on behalf of the current request"""
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+# Set by MetricsMiddleware; run_in_db and Starlette's threadpool copy the
+# context, so database work on worker threads is counted for its request
+current_request_queries: ContextVar[Optional[RequestQueryStats]] = ContextVar(
+    "current_request_queries", default=None
+)
+
+def _operation(statement: str) -> str:
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return verb if verb in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    operation = _operation(statement)
+    db_queries.inc(operation=operation)
+    db_query_duration.observe(elapsed, operation=operation)
+    stats = current_request_queries.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+
+def _handle_error(context):
+    # A statement that raised never reaches after_cursor_execute; drop its
+    # start time so it doesn't sit on the pooled connection for good
+    if context.connection is None or context.execution_context is None or context.is_pre_ping:
+        return
+    starts = context.connection.info.get("metrics_query_start")
+    if starts:
+        starts.pop()
+
+_instrumented = False
+
+def instrument_sqlalchemy():
+    """Time every statement on every engine, including ones created later"""
+    global _instrumented
+    if _instrumented:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _instrumented = True
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and query counts per route.
+
+    Routes are labelled by their path template (/enroll/{unit_id}), so the
+    label set stays bounded; requests that match no route share one label.
+    Event streams are counted but not timed, since their duration is the
+    lifetime of the connection.
+    """
+
+    def __init__(self, app, exclude: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = current_request_queries.set(stats)
+        response = {"status": 500, "streaming": False}
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                content_type = dict(message.get("headers") or []).get(b"content-type", b"")
+                response["streaming"] = content_type.startswith(b"text/event-stream")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request_queries.reset(token)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": getattr(route, "path", "unmatched")}
+            http_requests.inc(status=str(response["status"]), **labels)
+            if not response["streaming"]:
+                http_request_duration.observe(elapsed, **labels)
+            http_request_queries.observe(stats.queries, **labels)
+            http_request_query_time.observe(stats.seconds, **labels)
+
+class CachedHealthCheck:
+    """Runs a blocking check at most once per ttl_seconds, however often it is polled"""
+
+    def __init__(self, check: Callable[[], None], ttl_seconds: float = HEALTH_CHECK_TTL):
+        self.check = check
+        self.ttl_seconds = ttl_seconds
+        self.checks_run = 0
+        self._lock = threading.Lock()
+        self._result: Optional[dict] = None
+        self._expires = 0.0
+
+    def cached(self) -> Optional[dict]:
+        """The last result while it is still fresh"""
+        if self._result is not None and time.monotonic() < self._expires:
+            return self._result
+        return None
+
+    def run(self) -> dict:
+        """The cached result, or a new one; blocking, so call it off the event loop"""
+        with self._lock:
+            # Probes that queued behind a check share its result
+            result = self.cached()
+            if result is not None:
+                return result
+            started = time.perf_counter()
+            try:
+                self.check()
+                result = {"healthy": True, "error": None}
+            except Exception as e:
+                logger.error(f"Health check failed: {str(e)}")
+                result = {"healthy": False, "error": str(e)}
+            self.checks_run += 1
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            result["checked_at"] = time.time()
+            self._result = result
+            self._expires = time.monotonic() + self.ttl_seconds
+            return result
+
+    def invalidate(self):
+        self._result = None
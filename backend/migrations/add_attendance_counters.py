@@ -0,0 +1,32 @@
+"""add the attendance_counters rollup table
+
+Revision ID: add_attendance_counters
+Revises: add_attendance_indexes
+Create Date: 2026-10-16
+
+"""
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from database import DATABASE_URL
+from models import AttendanceCounter
+from attendance_counters import rebuild_attendance_counters
+
+revision = 'add_attendance_counters'
+down_revision = 'add_attendance_indexes'
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+def upgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    AttendanceCounter.__table__.create(bind=engine, checkfirst=True)
+    # Backfill from the existing attendance history
+    with Session(engine) as db:
+        counters = rebuild_attendance_counters(db)
+    print(f"Built {counters} attendance counters")
+
+def downgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    AttendanceCounter.__table__.drop(bind=engine, checkfirst=True)
+
+if __name__ == "__main__":
+    upgrade()
@@ -0,0 +1,104 @@
+"""add composite indexes and uniqueness for the attendance query shapes
+
+Revision ID: add_attendance_indexes
+Revises: add_admission_number
+Create Date: 2026-10-16
+
+"""
+import argparse
+import json
+from typing import Dict, List, Optional
+from sqlalchemy import create_engine, text
+from database import DATABASE_URL
+
+revision = 'add_attendance_indexes'
+down_revision = 'add_admission_number'
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+INDEXES = [
+    ("ix_users_bluetooth_address",
+     "CREATE INDEX IF NOT EXISTS ix_users_bluetooth_address ON users (bluetooth_address)"),
+    ("uq_enrollments_user_unit",
+     "CREATE UNIQUE INDEX IF NOT EXISTS uq_enrollments_user_unit ON enrollments (user_id, unit_id)"),
+    ("ix_attendances_user_unit_marked",
+     "CREATE INDEX IF NOT EXISTS ix_attendances_user_unit_marked ON attendances (user_id, unit_id, marked_at)"),
+    ("ix_attendances_unit_marked",
+     "CREATE INDEX IF NOT EXISTS ix_attendances_unit_marked ON attendances (unit_id, marked_at)"),
+    ("uq_attendances_user_unit_day",
+     "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendances_user_unit_day ON attendances (user_id, unit_id, date(marked_at))"),
+]
+
+# Rows the unique indexes would reject: every row but the oldest of its group
+DUPLICATES = {
+    "enrollments": (
+        "SELECT * FROM enrollments WHERE id NOT IN ("
+        "SELECT MIN(id) FROM enrollments GROUP BY user_id, unit_id) ORDER BY id"
+    ),
+    "attendances": (
+        "SELECT * FROM attendances WHERE id NOT IN ("
+        "SELECT MIN(id) FROM attendances GROUP BY user_id, unit_id, date(marked_at)) ORDER BY id"
+    ),
+}
+
+class DuplicateRowsError(Exception):
+    """Existing rows conflict with the new unique indexes; nothing was changed"""
+
+def find_duplicates(connection) -> Dict[str, List[dict]]:
+    duplicates = {}
+    for table, query in DUPLICATES.items():
+        rows = [dict(row) for row in connection.execute(text(query)).mappings()]
+        if rows:
+            duplicates[table] = rows
+    return duplicates
+
+def upgrade(engine=None, remove_duplicates_to: Optional[str] = None):
+    """Build the indexes. Rows that conflict with the unique indexes abort the
+    upgrade, unless remove_duplicates_to names a file to save them to before
+    they are deleted. Two attendances of one unit on the same day may be two
+    real classes, so review that file rather than discarding it.
+    """
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as connection:
+        duplicates = find_duplicates(connection)
+        if duplicates:
+            summary = ", ".join(f"{len(rows)} {table}" for table, rows in duplicates.items())
+            if remove_duplicates_to is None:
+                ids = "; ".join(
+                    f"{table} ids {[row['id'] for row in rows[:20]]}" for table, rows in duplicates.items()
+                )
+                raise DuplicateRowsError(
+                    f"Rows conflicting with the new unique indexes: {summary} ({ids}). "
+                    "Resolve them, or re-run with --remove-duplicates FILE to save them to FILE and delete them."
+                )
+            with open(remove_duplicates_to, "w") as f:
+                json.dump(duplicates, f, indent=2, default=str)
+            for table, rows in duplicates.items():
+                connection.execute(
+                    text(f"DELETE FROM {table} WHERE id = :id"),
+                    [{"id": row["id"]} for row in rows]
+                )
+            print(f"Removed {summary} duplicate rows; saved them to {remove_duplicates_to}")
+
+        for _, statement in INDEXES:
+            connection.execute(text(statement))
+
+        connection.commit()
+
+def downgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as connection:
+        for name, _ in reversed(INDEXES):
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+        connection.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the composite and unique attendance indexes")
+    parser.add_argument("--remove-duplicates", metavar="FILE",
+                        help="Save rows that conflict with the unique indexes to FILE, then delete them")
+    args = parser.parse_args()
+    try:
+        upgrade(remove_duplicates_to=args.remove_duplicates)
+    except DuplicateRowsError as e:
+        raise SystemExit(str(e))
@@ -0,0 +1,26 @@
+"""add the cache_versions table used to invalidate per-process caches
+
+Revision ID: add_cache_versions
+Revises: add_class_sessions
+Create Date: 2026-10-16
+
+"""
+from sqlalchemy import create_engine
+from database import DATABASE_URL
+from models import CacheVersion
+
+revision = 'add_cache_versions'
+down_revision = 'add_class_sessions'
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+def upgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    CacheVersion.__table__.create(bind=engine, checkfirst=True)
+
+def downgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    CacheVersion.__table__.drop(bind=engine, checkfirst=True)
+
+if __name__ == "__main__":
+    upgrade()
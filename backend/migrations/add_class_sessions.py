@@ -0,0 +1,71 @@
+"""add the sessions table and attach attendance to class sessions
+
+Revision ID: add_class_sessions
+Revises: add_attendance_counters
+Create Date: 2026-10-16
+
+"""
+from sqlalchemy import create_engine, inspect, text
+from database import DATABASE_URL
+from models import ClassSession
+
+revision = 'add_class_sessions'
+down_revision = 'add_attendance_counters'
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+def upgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    ClassSession.__table__.create(bind=engine, checkfirst=True)
+    columns = {column["name"] for column in inspect(engine).get_columns("attendances")}
+    with engine.connect() as connection:
+        if "session_id" not in columns:
+            connection.execute(text("ALTER TABLE attendances ADD COLUMN session_id INTEGER REFERENCES sessions (id)"))
+
+        # Existing attendance was kept one row per student, unit and day, so
+        # each unit's marked days become the sessions it held
+        created = connection.execute(text("""
+            INSERT INTO sessions (unit_id, lecturer_id, started_at)
+            SELECT attendances.unit_id, units.lecturer_id, MIN(attendances.marked_at)
+            FROM attendances JOIN units ON units.id = attendances.unit_id
+            WHERE attendances.session_id IS NULL
+            GROUP BY attendances.unit_id, units.lecturer_id, date(attendances.marked_at);
+        """)).rowcount
+        connection.execute(text("""
+            UPDATE attendances SET session_id = (
+                SELECT MIN(sessions.id) FROM sessions
+                WHERE sessions.unit_id = attendances.unit_id
+                  AND sessions.beacon_id IS NULL
+                  AND date(sessions.started_at) = date(attendances.marked_at)
+            ) WHERE session_id IS NULL;
+        """))
+        if created:
+            print(f"Created {created} class sessions from existing attendance")
+
+        # Uniqueness is now per session, so a unit can hold more than one class a day
+        connection.execute(text("DROP INDEX IF EXISTS uq_attendances_user_unit_day"))
+        connection.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendances_session_user ON attendances (session_id, user_id)"
+        ))
+        connection.commit()
+
+def downgrade(engine=None):
+    engine = engine or create_engine(SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as connection:
+        connection.execute(text("DROP INDEX IF EXISTS uq_attendances_session_user"))
+        if engine.dialect.name == "sqlite":
+            # SQLite can't drop a column with a foreign key; leave it unused
+            connection.execute(text("UPDATE attendances SET session_id = NULL"))
+        else:
+            connection.execute(text("ALTER TABLE attendances DROP COLUMN session_id"))
+        connection.commit()
+    ClassSession.__table__.drop(bind=engine, checkfirst=True)
+    with engine.connect() as connection:
+        connection.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendances_user_unit_day "
+            "ON attendances (user_id, unit_id, date(marked_at))"
+        ))
+        connection.commit()
+
+if __name__ == "__main__":
+    upgrade()
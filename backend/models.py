@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Enum, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Enum, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -24,7 +24,7 @@ class User(Base):
     full_name = Column(String, nullable=True)
     hashed_password = Column(String)
     role = Column(Enum(UserRole))
-    bluetooth_address = Column(String, nullable=True)
+    bluetooth_address = Column(String, nullable=True, index=True)
     admission_number = Column(String, unique=True, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, server_default=func.now())
@@ -48,9 +48,13 @@ class Unit(Base):
     lecturer = relationship("User", back_populates="units")
     enrollments = relationship("Enrollment", back_populates="unit")
     attendances = relationship("Attendance", back_populates="unit")
+    sessions = relationship("ClassSession", back_populates="unit")
 
 class Enrollment(Base):
     __tablename__ = "enrollments"
+    __table_args__ = (
+        Index("uq_enrollments_user_unit", "user_id", "unit_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -71,11 +75,70 @@ class Attendance(Base):
     bluetooth_address = Column(String, nullable=True)
     marked_by = Column(Integer, ForeignKey("users.id"), nullable=True)
     marked_at = Column(DateTime, server_default=func.now())
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+
+    __table_args__ = (
+        Index("ix_attendances_user_unit_marked", user_id, unit_id, marked_at),
+        Index("ix_attendances_unit_marked", unit_id, marked_at),
+        # One attendance per student and class session
+        Index("uq_attendances_session_user", session_id, user_id, unique=True),
+    )
 
     # Relationships
     user = relationship("User", back_populates="attendances", foreign_keys=[user_id])
     unit = relationship("Unit", back_populates="attendances")
     marked_by_user = relationship("User", back_populates="marked_attendances", foreign_keys=[marked_by])
+    session = relationship("ClassSession", back_populates="attendances")
+
+class ClassSession(Base):
+    """One class actually held for a unit, which attendance is recorded against.
+
+    A Bluetooth broadcast opens a session keyed by its beacon id; manual
+    marking on a day with no broadcast opens one without a beacon (see
+    class_sessions.py). Attendance percentages are over sessions held.
+    """
+    __tablename__ = "sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    unit_id = Column(Integer, ForeignKey("units.id"), nullable=False)
+    lecturer_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    beacon_id = Column(String, unique=True, nullable=True)
+    started_at = Column(DateTime, nullable=False, server_default=func.now())
+    ended_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Sessions held per unit, overall or in a date range, are counted from this index
+        Index("ix_sessions_unit_started", unit_id, started_at),
+    )
+
+    # Relationships
+    unit = relationship("Unit", back_populates="sessions")
+    attendances = relationship("Attendance", back_populates="session")
+
+class AttendanceCounter(Base):
+    """Attended-class count per student and unit, kept in step with attendances.
+
+    Every path that writes Attendance rows updates this table in the same
+    transaction (see attendance_counters.py), so summaries read one row per
+    enrollment instead of counting the whole attendance history.
+    """
+    __tablename__ = "attendance_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unit_id = Column(Integer, ForeignKey("units.id"), primary_key=True)
+    attended = Column(Integer, nullable=False, default=0)
+
+class CacheVersion(Base):
+    """Invalidation counter for a per-process cache.
+
+    Writers bump the row when cached data changes; every worker compares it
+    with the version its cache was filled at, so changes made through one
+    host reach the caches on all the others.
+    """
+    __tablename__ = "cache_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
 
 class UserCreate(BaseModel):
     email: str
@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from passlib.context import CryptContext
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt releases the GIL, so threads give real parallelism; "process" is
+# there for hosts where hashing should not share the API process at all.
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+# Hashes running at once; beyond this logins wait in the queue
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Logins allowed to wait for a worker; beyond this they are turned away with 503
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "256"))
+LATENCY_SAMPLES = 1024
+
+class PasswordHasherSaturated(Exception):
+    """Raised when the hashing queue is full"""
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop with bounded concurrency and queueing.
+
+    At most `workers` hashes run at once and up to `max_queue` more wait
+    for a worker; anything beyond that fails fast with
+    PasswordHasherSaturated instead of letting latency grow without bound.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_queue: int = PASSWORD_HASH_QUEUE,
+        executor_kind: str = PASSWORD_HASH_EXECUTOR
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor_kind = executor_kind
+        self._executor: Executor = None
+        # Counters are shared by every event loop that uses the hasher
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._waits = deque(maxlen=LATENCY_SAMPLES)
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherSaturated(
+                    f"{self.in_flight} password hashes in progress or queued"
+                )
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        submitted = time.perf_counter()
+        started = []
+
+        def timed(*call_args):
+            started.append(time.perf_counter())
+            return func(*call_args)
+
+        loop = asyncio.get_running_loop()
+        try:
+            if self.executor_kind == "process":
+                # Closures don't pickle; queue wait can't be measured across processes
+                result = await loop.run_in_executor(self.executor, func, *args)
+            else:
+                result = await loop.run_in_executor(self.executor, timed, *args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self.in_flight -= 1
+                self._latencies.append(finished - submitted)
+                if started:
+                    self._waits.append(started[0] - submitted)
+        with self._lock:
+            self.completed += 1
+        return result
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        if not hashed_password:
+            return False
+        return await self._run(check_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            waits = list(self._waits)
+            return {
+                "executor": self.executor_kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "peak_in_flight": self.peak_in_flight,
+                "saturation": round(min(self.in_flight, self.workers) / self.workers, 3),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "queue_wait_p99_ms": round(percentile(waits, 99) * 1000, 2)
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,220 @@
+"""Per-request SQL profiling with N+1 detection.
+
+Opt in with QUERY_PROFILING=1: every request then records the statements it
+ran, with timings and the application line that issued each one, and logs
+a report. Statements of the same shape repeated QUERY_PROFILING_N_PLUS_ONE
+times or more are flagged as N+1 suspects. Tests use assert_max_queries to
+pin the number of statements an endpoint may run.
+"""
+import os
+import re
+import time
+import logging
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, NamedTuple, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROFILING = os.getenv("QUERY_PROFILING", "").lower() in ("1", "true", "yes")
+# Repeats of one statement shape within a request that count as an N+1 suspect
+N_PLUS_ONE_THRESHOLD = int(os.getenv("QUERY_PROFILING_N_PLUS_ONE", "3"))
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+def statement_shape(statement: str) -> str:
+    """The statement with literals and IN lists collapsed, so repeats compare equal"""
+    shape = _LITERAL.sub("?", statement)
+    shape = _PLACEHOLDER_LIST.sub("(?)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+def _call_site() -> str:
+    """The innermost application frame outside this module"""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (filename.startswith(_APP_DIR) and filename != os.path.abspath(__file__)
+                and "site-packages" not in filename):
+            return f"{os.path.relpath(filename, _APP_DIR)}:{frame.lineno} in {frame.name}"
+    return "<unknown>"
+
+class ProfiledStatement(NamedTuple):
+    statement: str
+    shape: str
+    seconds: float
+    call_site: str
+    failed: bool = False
+
+class QueryProfile:
+    """The statements executed while the profile was active"""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.statements: List[ProfiledStatement] = []
+
+    def record(self, statement: str, seconds: float, failed: bool = False):
+        self.statements.append(
+            ProfiledStatement(statement, statement_shape(statement), seconds, _call_site(), failed)
+        )
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def seconds(self) -> float:
+        return sum(statement.seconds for statement in self.statements)
+
+    def n_plus_one_suspects(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[dict]:
+        """Statement shapes repeated at least `threshold` times, most repeated first"""
+        repeats = Counter(statement.shape for statement in self.statements)
+        suspects = []
+        for shape, count in repeats.most_common():
+            if count < threshold:
+                break
+            call_sites = Counter(s.call_site for s in self.statements if s.shape == shape)
+            suspects.append({"shape": shape, "count": count, "call_sites": dict(call_sites)})
+        return suspects
+
+    def report(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> str:
+        lines = [f"{self.label or 'profile'}: {self.count} statements in {self.seconds * 1000:.2f} ms"]
+        for number, statement in enumerate(self.statements, 1):
+            failed = " (failed)" if statement.failed else ""
+            lines.append(f"  {number}. {statement.seconds * 1000:.2f} ms{failed} {statement.call_site}: {statement.shape}")
+        for suspect in self.n_plus_one_suspects(threshold):
+            sites = ", ".join(suspect["call_sites"])
+            lines.append(f"  N+1 suspect, {suspect['count']}x from {sites}: {suspect['shape']}")
+        return "\n".join(lines)
+
+current_profile: ContextVar[Optional[QueryProfile]] = ContextVar("current_profile", default=None)
+
+def _listeners(get_profile, key: str):
+    """before/after_cursor_execute and handle_error hooks timing statements into get_profile()"""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(key, []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get(key)
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        profile = get_profile()
+        if profile is not None:
+            profile.record(statement, elapsed)
+
+    def handle_error(context):
+        # Failed statements skip after_cursor_execute: pop their start time
+        # here, so it doesn't stay on the pooled connection, and record them
+        if context.connection is None or context.execution_context is None or context.is_pre_ping:
+            return
+        starts = context.connection.info.get(key)
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        profile = get_profile()
+        if profile is not None and context.statement is not None:
+            profile.record(context.statement, elapsed, failed=True)
+
+    return before_cursor_execute, after_cursor_execute, handle_error
+
+_before_cursor_execute, _after_cursor_execute, _handle_error = _listeners(
+    current_profile.get, "query_profiler_start"
+)
+_installed = False
+
+def install_profiler():
+    """Listen on every engine; statements are recorded only while a profile is active"""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _installed = True
+
+@contextmanager
+def profile_queries(engine: Optional[Engine] = None, label: str = "") -> Iterator[QueryProfile]:
+    """Record the statements run in this context.
+
+    With an engine, everything run on that engine is recorded whichever
+    thread or event loop runs it, which is what tests going through
+    TestClient need.
+    """
+    profile = QueryProfile(label)
+    if engine is None:
+        install_profiler()
+        token = current_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            current_profile.reset(token)
+        return
+
+    before, after, error = _listeners(lambda: profile, f"query_profiler_start_{id(profile)}")
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", error)
+    try:
+        yield profile
+    finally:
+        event.remove(engine, "handle_error", error)
+        event.remove(engine, "after_cursor_execute", after)
+        event.remove(engine, "before_cursor_execute", before)
+
+@contextmanager
+def assert_max_queries(limit: int, engine: Optional[Engine] = None, label: str = "") -> Iterator[QueryProfile]:
+    """Fail if the block runs more than `limit` statements; the failure lists them"""
+    with profile_queries(engine, label) as profile:
+        yield profile
+    if profile.count > limit:
+        raise AssertionError(f"expected at most {limit} statements, got {profile.count}\n{profile.report()}")
+
+class QueryProfilerMiddleware:
+    """ASGI middleware that profiles each request's statements.
+
+    The count and time so far go out as X-Query-Count and X-Query-Time-Ms
+    headers. They only cover statements run before the response headers were
+    sent: streamed bodies and yield-dependency teardown run later. The logged
+    report has the full totals: at WARNING with N+1 suspects, DEBUG otherwise.
+    """
+
+    def __init__(self, app, threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.app = app
+        self.threshold = threshold
+        install_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        label = f"{scope['method']} {scope['path']}"
+        with profile_queries(label=label) as profile:
+            before_headers = None
+
+            async def send_wrapper(message):
+                nonlocal before_headers
+                if message["type"] == "http.response.start":
+                    before_headers = profile.count
+                    headers = list(message.get("headers") or [])
+                    headers.append((b"x-query-count", str(profile.count).encode()))
+                    headers.append((b"x-query-time-ms", f"{profile.seconds * 1000:.2f}".encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                report = profile.report(self.threshold)
+                if before_headers is not None and profile.count > before_headers:
+                    report += f"\n  {profile.count - before_headers} statements ran after the response headers"
+                if profile.n_plus_one_suspects(self.threshold):
+                    logger.warning(report)
+                else:
+                    logger.debug(report)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from models import UserRole, AttendanceType
 import re
@@ -100,7 +100,8 @@ class Attendance(AttendanceBase):
     user_id: int
     marked_at: Optional[datetime] = None
     percentage: Optional[float] = None
-    total_classes: int = 12  # Total classes per unit per semester
+    total_classes: int = 0  # Sessions the unit has held
+    session_id: Optional[int] = None
     attended_classes: Optional[int] = None
     user: Optional[User] = None  # Add user relationship
 
@@ -112,7 +113,7 @@ class AttendanceSummary(BaseModel):
     unit_id: int
     unit_code: str
     unit_name: str
-    total_classes: int = 12
+    total_classes: int = 0
     attended_classes: int
     percentage: float
     attendance_records: List[Attendance]
@@ -121,6 +122,90 @@ class AttendanceSummary(BaseModel):
     class Config:
         from_attributes = True
 
+# Lecturer report schemas
+class StudentAttendanceStats(BaseModel):
+    user_id: int
+    username: str
+    full_name: Optional[str] = None
+    admission_number: Optional[str] = None
+    attended_classes: int
+    total_classes: int = 0
+    percentage: float
+
+class UnitAttendanceReport(BaseModel):
+    unit_id: int
+    unit_code: str
+    unit_name: str
+    total_classes: int = 0
+    attended_classes: int
+    percentage: float
+    students: List[StudentAttendanceStats]
+
+class AttendanceRecord(BaseModel):
+    id: int
+    user_id: int
+    unit_id: int
+    attendance_type: AttendanceType
+    marked_at: Optional[datetime] = None
+    marked_by: Optional[int] = None
+    session_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class AttendanceRecordPage(BaseModel):
+    records: List[AttendanceRecord]
+    next_cursor: Optional[int] = None  # Pass as after_id to fetch the next page
+
+# Compact lecturer attendance: records reference students by id, and each
+# student appears once in the response-wide students map
+class StudentRef(BaseModel):
+    id: int
+    username: str
+    full_name: Optional[str] = None
+    admission_number: Optional[str] = None
+    bluetooth_address: Optional[str] = None
+
+class CompactAttendanceRecord(BaseModel):
+    id: int
+    user_id: int
+    attendance_type: AttendanceType
+    marked_at: Optional[datetime] = None
+    marked_by: Optional[int] = None
+    session_id: Optional[int] = None
+
+class CompactStudentStats(BaseModel):
+    user_id: int
+    attended_classes: int
+    percentage: float
+
+class CompactUnitAttendance(BaseModel):
+    unit_id: int
+    unit_code: str
+    unit_name: str
+    total_classes: int = 0
+    attended_classes: int
+    percentage: float
+    students: List[CompactStudentStats]  # Students with at least one record in the range
+    attendance_records: List[CompactAttendanceRecord]
+
+class CompactLecturerAttendance(BaseModel):
+    units: List[CompactUnitAttendance]
+    students: Dict[int, StudentRef]
+
+class BulkAttendanceOutcome(BaseModel):
+    row: int  # 1-based position in the submitted list or CSV
+    admission_number: str
+    status: str  # marked, already_marked, not_found, not_enrolled, duplicate, invalid
+    student_id: Optional[int] = None
+    attendance_id: Optional[int] = None
+
+class BulkAttendanceResult(BaseModel):
+    unit_id: int
+    date: str
+    marked: int
+    outcomes: List[BulkAttendanceOutcome]
+
 # Token schemas
 class Token(BaseModel):
     access_token: str
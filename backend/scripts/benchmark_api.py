@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import httpx
+from database import SessionLocal, init_db
+from models import User, Unit, Enrollment
+from metrics import percentile
+from synthetic_data import SYNTHETIC_PASSWORD, generate_institution
+
+PREFIX = "apibench"
+PASSWORD = SYNTHETIC_PASSWORD
+LECTURER_PREFIX = f"{PREFIX}_lecturer_"
+STUDENT_PREFIX = f"{PREFIX}_student_"
+UNIT_CODE_PREFIX = PREFIX.upper()
+# Scenario weights: what a busy morning of dashboards looks like
+DEFAULT_MIX = "student_dashboard=55,lecturer_dashboard=25,manual_mark=10,login=10"
+
+def seed_institution(args):
+    """Lecturers, units, enrolled students and a semester of attended sessions.
+
+    Generated by synthetic_data.generate_institution. Returns False when a
+    benchmark institution is already there (it is reused as is).
+    """
+    init_db()
+    db = SessionLocal()
+    try:
+        if db.query(User.id).filter(User.username == f"{LECTURER_PREFIX}0").first():
+            return False
+        # A semester of classes ending this week
+        semester_start = datetime.utcnow().replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(weeks=args.weeks)
+        summary = generate_institution(
+            db,
+            students=args.students,
+            lecturers=args.lecturers,
+            units=args.units,
+            units_per_student=args.units_per_student,
+            weeks=args.weeks,
+            sessions_per_week=args.sessions_per_week,
+            attendance_rate=args.attendance_rate,
+            seed=args.rng_seed,
+            prefix=PREFIX,
+            semester_start=semester_start
+        )
+        print(f"Seeded {summary['lecturers']} lecturers, {summary['units']} units, {summary['students']} students, "
+              f"{summary['enrollments']} enrollments, {summary['sessions']} sessions and "
+              f"{summary['attendances']} attendance rows in {summary['elapsed_seconds']} s")
+        return True
+    finally:
+        db.close()
+
+def load_population():
+    """Who the virtual users log in as, and which students each lecturer can mark"""
+    db = SessionLocal()
+    try:
+        students = db.query(User.username, User.admission_number).filter(
+            User.username.like(f"{STUDENT_PREFIX}%")).all()
+        lecturers = {}
+        rows = (
+            db.query(User.username, Unit.id, User.admission_number)
+            .select_from(Unit)
+            .join(Enrollment, Enrollment.unit_id == Unit.id)
+            .join(User, User.id == Enrollment.user_id)
+            .filter(Unit.code.like(f"{UNIT_CODE_PREFIX}%"))
+            .all()
+        )
+        unit_students = defaultdict(list)
+        for _, unit_id, admission in rows:
+            unit_students[unit_id].append(admission)
+        for username, unit_id in db.query(User.username, Unit.id).join(Unit, Unit.lecturer_id == User.id).filter(
+                User.username.like(f"{LECTURER_PREFIX}%")):
+            lecturers.setdefault(username, {})[unit_id] = unit_students[unit_id]
+        return [username for username, _ in students], lecturers
+    finally:
+        db.close()
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name.strip()!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+class Recorder:
+    """Latencies and status codes per endpoint, ignoring the warm-up"""
+
+    def __init__(self):
+        self.recording = False
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    async def request(self, client, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        if self.recording:
+            self.latencies[name].append(time.perf_counter() - started)
+            self.statuses[name][status] += 1
+        return response
+
+async def get_token(client, recorder, username):
+    response = await recorder.request(client, "POST /token", "POST", "/token",
+                                      data={"username": username, "password": PASSWORD})
+    if response is None or response.status_code != 200:
+        return None
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def login(client, recorder, rng, world):
+    await get_token(client, recorder, rng.choice(world["students"]))
+
+async def student_dashboard(client, recorder, rng, world):
+    headers = rng.choice(world["student_tokens"])
+    await recorder.request(client, "GET /attendance/student", "GET", "/attendance/student", headers=headers)
+    await recorder.request(client, "GET /enrolled-units", "GET", "/enrolled-units", headers=headers)
+
+async def lecturer_dashboard(client, recorder, rng, world):
+    headers = world["lecturer_tokens"][rng.choice(list(world["lecturer_tokens"]))]
+    await recorder.request(client, "GET /attendance/lecturer", "GET", "/attendance/lecturer", headers=headers)
+    await recorder.request(client, "GET /attendance/lecturer/report", "GET", "/attendance/lecturer/report",
+                           headers=headers)
+
+async def manual_mark(client, recorder, rng, world):
+    username = rng.choice(list(world["lecturer_tokens"]))
+    units = {unit_id: students for unit_id, students in world["lecturers"][username].items() if students}
+    if not units:
+        return
+    unit_id = rng.choice(list(units))
+    # Students already marked today get 400, as they would in class
+    await recorder.request(client, "POST /attendance/manual", "POST", "/attendance/manual",
+                           headers=world["lecturer_tokens"][username],
+                           json={"unit_id": unit_id, "admission_number": rng.choice(units[unit_id])})
+
+SCENARIOS = {
+    "login": login,
+    "student_dashboard": student_dashboard,
+    "lecturer_dashboard": lecturer_dashboard,
+    "manual_mark": manual_mark
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def start_server(args):
+    """uvicorn main:app on a free local port, using this process's DATABASE_URL"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient(base_url=url) as client:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise SystemExit("uvicorn exited before it was ready")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return server, url
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn did not become healthy within 30 seconds")
+
+async def run_benchmark(args):
+    server = None
+    if args.in_process:
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark",
+                                   timeout=args.timeout)
+    else:
+        url = args.url
+        if url is None:
+            server, url = await start_server(args)
+        client = httpx.AsyncClient(base_url=url, timeout=args.timeout,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+
+    rng = random.Random(args.rng_seed)
+    students, lecturers = load_population()
+    if not students or not lecturers:
+        raise SystemExit("No benchmark institution found; run with --seed")
+    weights = parse_mix(args.mix)
+    recorder = Recorder()
+    try:
+        async with client:
+            # Dashboards reuse tokens; logging in is its own scenario
+            student_tokens = await asyncio.gather(*(
+                get_token(client, recorder, username) for username in rng.sample(students, min(args.token_pool, len(students)))
+            ))
+            lecturer_tokens = dict(zip(lecturers, await asyncio.gather(*(
+                get_token(client, recorder, username) for username in lecturers
+            ))))
+            world = {
+                "students": students,
+                "lecturers": lecturers,
+                "student_tokens": [token for token in student_tokens if token],
+                "lecturer_tokens": {name: token for name, token in lecturer_tokens.items() if token}
+            }
+            if not world["student_tokens"] or not world["lecturer_tokens"]:
+                raise SystemExit("Benchmark accounts could not log in")
+
+            scenarios, scenario_weights = list(weights), list(weights.values())
+            scenario_counts = Counter()
+            deadline = time.monotonic() + args.warmup + args.duration
+
+            async def virtual_user(number):
+                user_rng = random.Random(args.rng_seed * 1000 + number)
+                while time.monotonic() < deadline:
+                    name = user_rng.choices(scenarios, scenario_weights)[0]
+                    await SCENARIOS[name](client, recorder, user_rng, world)
+                    if recorder.recording:
+                        scenario_counts[name] += 1
+                    if args.think_time:
+                        await asyncio.sleep(user_rng.expovariate(1 / args.think_time))
+
+            async def start_recording():
+                await asyncio.sleep(args.warmup)
+                recorder.recording = True
+                return time.perf_counter()
+
+            recording_task = asyncio.create_task(start_recording())
+            await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+            elapsed = time.perf_counter() - await recording_task
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    endpoints = {}
+    for name in sorted(recorder.latencies):
+        latencies_ms = [latency * 1000 for latency in recorder.latencies[name]]
+        statuses = recorder.statuses[name]
+        endpoints[name] = {
+            "requests": len(latencies_ms),
+            "requests_per_second": round(len(latencies_ms) / elapsed, 1) if elapsed else 0.0,
+            "errors": sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500),
+            "status_codes": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            "p50_ms": round(percentile(latencies_ms, 50), 2),
+            "p95_ms": round(percentile(latencies_ms, 95), 2),
+            "p99_ms": round(percentile(latencies_ms, 99), 2),
+            "max_ms": round(max(latencies_ms, default=0.0), 2)
+        }
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "meta": {
+            "finished_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": "in-process" if args.in_process else (args.url or f"uvicorn --workers {args.workers}"),
+            "database_url": os.getenv("DATABASE_URL", "default")
+        },
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "json")},
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "requests_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+        "scenarios": dict(scenario_counts),
+        "endpoints": endpoints
+    }
+
+def compare(results, baseline):
+    """Lines with this run's throughput and latency next to a saved run's"""
+    def change(new, old):
+        return f"{new:>9} ({(new - old) / old * 100:+.1f}%)" if old else f"{new:>9}"
+
+    lines = [f"{'endpoint':<32}{'req/s':>20}{'p50 ms':>20}{'p99 ms':>20}"]
+    for name, endpoint in results["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(name)
+        if old is None:
+            lines.append(f"{name:<32}{endpoint['requests_per_second']:>9} (new)")
+            continue
+        lines.append(f"{name:<32}{change(endpoint['requests_per_second'], old['requests_per_second']):>20}"
+                     f"{change(endpoint['p50_ms'], old['p50_ms']):>20}{change(endpoint['p99_ms'], old['p99_ms']):>20}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive mixed dashboard traffic at the API and report latency")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting uvicorn")
+    parser.add_argument("--in-process", action="store_true", help="Drive main.app directly instead of a server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started server")
+    parser.add_argument("--seed", action="store_true", help="Create the benchmark institution first")
+    parser.add_argument("--lecturers", type=int, default=20, help="Lecturers to seed")
+    parser.add_argument("--units", type=int, default=60, help="Units to seed")
+    parser.add_argument("--students", type=int, default=3000, help="Students to seed")
+    parser.add_argument("--units-per-student", type=int, default=5, help="Units each student is enrolled in")
+    parser.add_argument("--weeks", type=int, default=14, help="Weeks of past classes to seed")
+    parser.add_argument("--sessions-per-week", type=int, default=2, help="Classes per unit and week")
+    parser.add_argument("--attendance-rate", type=float, default=0.8, help="Chance a student attended a class")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. login=1,student_dashboard=4")
+    parser.add_argument("--concurrency", type=int, default=50, help="Virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of measured traffic")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds of traffic before measuring")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between a user's scenarios")
+    parser.add_argument("--token-pool", type=int, default=100, help="Students logged in up front for dashboards")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--rng-seed", type=int, default=42, help="Seed for the data and the traffic")
+    parser.add_argument("--output", help="Save results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against results saved by an earlier --output")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.seed and not seed_institution(args):
+        print("Benchmark institution already seeded; reusing it")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(run_benchmark(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['requests']} requests in {results['elapsed_seconds']} s "
+              f"({results['requests_per_second']} req/s)")
+        for name, endpoint in results["endpoints"].items():
+            print(f"{name:<32} {endpoint['requests']:>7} req {endpoint['requests_per_second']:>8} req/s  "
+                  f"p50 {endpoint['p50_ms']:>8} ms  p95 {endpoint['p95_ms']:>8} ms  p99 {endpoint['p99_ms']:>8} ms  "
+                  f"errors {endpoint['errors']}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print("\n".join(compare(results, baseline)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import User, Unit, Enrollment, UserRole
+from bluetooth_scanner import BluetoothScanner
+from ble_trace import ReplayScanner, generate_trace, random_address, read_trace, write_trace
+from metrics import percentile
+
+def seed_database(db, addresses, unit_count):
+    """One lecturer, unit_count units and a student behind every given address"""
+    lecturer = User(username="bench_lecturer", email="bench_lecturer@test.com", role=UserRole.LECTURER)
+    db.add(lecturer)
+    db.flush()
+    units = [Unit(code=f"BENCH{i}", name=f"Benchmark Unit {i}", lecturer_id=lecturer.id) for i in range(unit_count)]
+    db.add_all(units)
+    db.flush()
+    for i, address in enumerate(addresses):
+        student = User(
+            username=f"bench_student_{i}",
+            email=f"bench_student_{i}@test.com",
+            role=UserRole.STUDENT,
+            bluetooth_address=address
+        )
+        db.add(student)
+        db.flush()
+        db.add(Enrollment(user_id=student.id, unit_id=units[i % unit_count].id))
+    db.commit()
+    return units
+
+async def run_benchmark(args):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    rng = random.Random(args.seed)
+    if args.trace:
+        trace = list(read_trace(args.trace))
+        addresses = list(dict.fromkeys(adv.address for adv in trace))
+    else:
+        addresses = [random_address(rng) for _ in range(args.devices)]
+        trace = generate_trace(addresses, args.duration, args.interval, args.seed)
+        if args.save_trace:
+            write_trace(args.save_trace, trace)
+    student_addresses = addresses[:min(args.students, len(addresses))]
+    units = seed_database(db, student_addresses, args.units)
+
+    statements = {"total": 0, "writes": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements["total"] += 1
+        if statement.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE")):
+            statements["writes"] += 1
+
+    replay = {}
+
+    def replay_factory(detection_callback):
+        replay["scanner"] = ReplayScanner(detection_callback, trace, args.speed)
+        return replay["scanner"]
+
+    scanner = BluetoothScanner(db=db, scanner_factory=replay_factory)
+    started = time.perf_counter()
+    for unit in units:
+        await scanner.start_scanning({
+            "beacon_id": f"bench_{unit.id}",
+            "unit_id": unit.id,
+            "unit_code": unit.code,
+            "lecturer_id": unit.lecturer_id
+        })
+    await replay["scanner"].finished.wait()
+    await scanner.detection_queue.join()
+    elapsed = time.perf_counter() - started
+    stats = scanner.get_pipeline_stats()
+    await scanner.stop_scanning()
+
+    latencies_ms = [latency * 1000 for latency in replay["scanner"].latencies]
+    return {
+        "advertisements": len(trace),
+        "devices": len(addresses),
+        "students": len(student_addresses),
+        "elapsed_seconds": round(elapsed, 3),
+        "detections_per_second": round(len(trace) / elapsed, 1) if elapsed else 0.0,
+        "attendance_written": stats["attendance_written"],
+        "db_statements": statements["total"],
+        "db_write_statements": statements["writes"],
+        "batches": stats["batches"],
+        "rejected_unknown": stats["rejected_unknown"],
+        "not_enrolled": stats["not_enrolled"],
+        "callback_p50_ms": round(percentile(latencies_ms, 50), 4),
+        "callback_p99_ms": round(percentile(latencies_ms, 99), 4),
+        "max_batch_latency_ms": round(stats["max_batch_latency_ms"], 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a BLE trace through the scanner and measure throughput")
+    parser.add_argument("--trace", help="Replay this trace file instead of generating one")
+    parser.add_argument("--save-trace", help="Write the generated trace to this file")
+    parser.add_argument("--devices", type=int, default=1000, help="Advertising devices in range")
+    parser.add_argument("--students", type=int, default=300, help="How many of the devices belong to students")
+    parser.add_argument("--units", type=int, default=1, help="Concurrent broadcast sessions")
+    parser.add_argument("--duration", type=float, default=30.0, help="Generated trace length in seconds")
+    parser.add_argument("--interval", type=float, default=1.0, help="Advertising interval per device in seconds")
+    parser.add_argument("--speed", type=float, default=0, help="Replay speed factor (0 = as fast as possible)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Keep the scanner's per-device logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("bluetooth_scanner").setLevel(logging.WARNING)
+        logging.getLogger("student_index").setLevel(logging.WARNING)
+    results = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>24}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 from database import SessionLocal
 from models import User, Unit, Enrollment, Attendance, AttendanceType
+from attendance_counters import increment_attendance_counters
+from class_sessions import day_sessions
 from datetime import datetime
 
 def create_attendance():
@@ -28,15 +30,17 @@ def create_attendance():
         db.add(enrollment)
         db.commit()
 
-        # Create attendance record
+        # Create attendance record in today's class session
         attendance = Attendance(
             user_id=wesley.id,
             unit_id=inte324.id,
+            session_id=day_sessions(db, [inte324.id])[inte324.id],
             attendance_type=AttendanceType.MANUAL,
             bluetooth_address=wesley.bluetooth_address,
             marked_at=datetime.utcnow()
         )
         db.add(attendance)
+        increment_attendance_counters(db, [(wesley.id, inte324.id)])
         db.commit()
 
         print("Created attendance record for Wesley in INTE 324")
@@ -1,5 +1,6 @@
 from database import SessionLocal
 from models import User, UserRole
+from student_index import invalidate_student_index
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -17,6 +18,7 @@ def create_user():
         )
         db.add(user)
         db.commit()
+        invalidate_student_index(db)
         print("Created Wesley's account")
     except Exception as e:
         print(f"Error creating user: {e}")
@@ -0,0 +1,55 @@
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from database import SessionLocal
+from models import Unit
+from attendance_export import EXPORT_FORMATS, ExportFormatUnavailable, iter_export, parquet_available
+
+def parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export attendance records for a unit or a whole semester")
+    parser.add_argument("output", help="Output file; a .gz suffix gzips it, '-' writes to stdout")
+    parser.add_argument("--unit", action="append", dest="units", help="Unit code (repeatable; default: all units)")
+    parser.add_argument("--start", type=parse_day, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", type=parse_day, help="Last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Default: from the file name, else csv")
+    args = parser.parse_args()
+
+    export_format = args.format or ("parquet" if ".parquet" in args.output else "csv")
+    if export_format == "parquet" and not parquet_available():
+        sys.exit("Parquet export needs the pyarrow package (pip install pyarrow)")
+
+    db = SessionLocal()
+    try:
+        unit_ids = None
+        if args.units:
+            units = dict(db.query(Unit.code, Unit.id).filter(Unit.code.in_(args.units)).all())
+            missing = sorted(set(args.units) - set(units))
+            if missing:
+                sys.exit(f"Unknown unit(s): {', '.join(missing)}")
+            unit_ids = list(units.values())
+
+        end = args.end + timedelta(days=1) if args.end else None
+        chunks = iter_export(db.connection(), export_format, unit_ids, args.start, end,
+                             gzip=args.output.endswith(".gz"))
+        started = time.perf_counter()
+        written = 0
+        output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        except ExportFormatUnavailable as e:
+            sys.exit(str(e))
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        print(f"Wrote {written} bytes in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
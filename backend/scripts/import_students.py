@@ -0,0 +1,276 @@
+"""Offline bulk import of students and their enrollments from a CSV file.
+
+Columns: admission_number, email, bluetooth_address, units (unit codes
+separated by ";"), and optionally username (defaults to the email),
+full_name, phone, department and password (defaults to --default-password).
+
+Rows are validated with the same rules as registration (schemas.UserCreate).
+Passwords are hashed on all cores, and users and enrollments go in as
+batched executemany inserts, one transaction per batch. After every
+committed batch the number of rows consumed is written to a checkpoint
+file, so an interrupted import picks up where it stopped when re-run.
+Rows that fail validation are written to a rejects CSV with the reason;
+a fresh run starts a new one, a resumed run appends to it.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from database import SessionLocal, init_db
+from models import User, Unit, Enrollment, UserRole
+from schemas import UserCreate
+from password_hashing import hash_password
+from student_index import invalidate_student_index, normalize_mac
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+def read_rows(csv_path: str, skip: int = 0) -> Iterator[Dict[str, str]]:
+    """Stream CSV rows, skipping the first `skip` data rows"""
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        yield from islice(reader, skip, None)
+
+def load_checkpoint(checkpoint_path: str) -> int:
+    try:
+        with open(checkpoint_path) as f:
+            return json.load(f)["rows_done"]
+    except (OSError, ValueError, KeyError):
+        return 0
+
+def save_checkpoint(checkpoint_path: str, rows_done: int):
+    # Write then rename, so a crash never leaves a half-written checkpoint
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"rows_done": rows_done}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+class StudentImporter:
+    """Validates, de-duplicates and inserts students batch by batch"""
+
+    def __init__(
+        self,
+        db: Session,
+        default_password: Optional[str] = None,
+        executor: Optional[Executor] = None,
+        workers: int = 1
+    ):
+        self.db = db
+        self.default_password = default_password
+        self.executor = executor
+        self.workers = workers
+        self.stats = {"rows": 0, "imported": 0, "existing": 0, "rejected": 0, "enrollments": 0}
+        self.rejects: List[Dict[str, str]] = []
+
+        # Everything uniqueness is checked against lives in memory: a handful
+        # of queries up front instead of three per row
+        self.unit_ids = dict(db.query(Unit.code, Unit.id).all())
+        self.usernames, self.emails, self.admission_numbers, self.addresses = set(), set(), set(), set()
+        for username, email, admission_number, address in db.query(
+            User.username, User.email, User.admission_number, User.bluetooth_address
+        ):
+            self.usernames.add(username)
+            self.emails.add(email)
+            if admission_number:
+                self.admission_numbers.add(admission_number)
+            if address:
+                self.addresses.add(normalize_mac(address))
+
+    def _reject(self, row: Dict[str, str], reason: str):
+        self.stats["rejected"] += 1
+        self.rejects.append({**row, "error": reason})
+
+    def _validate(self, row: Dict[str, str]):
+        """UserCreate plus unit codes for a row, or None if the row was rejected or already imported"""
+        fields = {key: (value or "").strip() for key, value in row.items() if key}
+        password = fields.get("password") or self.default_password
+        if not password:
+            self._reject(row, "No password and no --default-password given")
+            return None
+        try:
+            user = UserCreate(
+                email=fields.get("email"),
+                username=fields.get("username") or fields.get("email"),
+                role=UserRole.STUDENT,
+                bluetooth_address=fields.get("bluetooth_address") or None,
+                full_name=fields.get("full_name") or None,
+                admission_number=fields.get("admission_number") or None,
+                phone=fields.get("phone") or None,
+                department=fields.get("department") or None,
+                password=password
+            )
+        except ValidationError as e:
+            self._reject(row, "; ".join(error["msg"] for error in e.errors()))
+            return None
+
+        # A re-run after a crash finds the rows of the last uncheckpointed
+        # batch already in the database; those are skipped, not rejected
+        if user.admission_number in self.admission_numbers and user.username in self.usernames:
+            self.stats["existing"] += 1
+            return None
+        for value, seen, label in (
+            (user.username, self.usernames, "username"),
+            (user.email, self.emails, "email"),
+            (user.admission_number, self.admission_numbers, "admission number"),
+            (normalize_mac(user.bluetooth_address), self.addresses, "Bluetooth address"),
+        ):
+            if value in seen:
+                self._reject(row, f"Duplicate {label} {value}")
+                return None
+
+        codes = [code.strip() for code in fields.get("units", "").split(";") if code.strip()]
+        unknown = [code for code in codes if code not in self.unit_ids]
+        if unknown:
+            self._reject(row, f"Unknown unit(s) {', '.join(unknown)}")
+            return None
+
+        self.usernames.add(user.username)
+        self.emails.add(user.email)
+        self.admission_numbers.add(user.admission_number)
+        self.addresses.add(normalize_mac(user.bluetooth_address))
+        return user, [self.unit_ids[code] for code in dict.fromkeys(codes)]
+
+    def _hash_passwords(self, passwords: List[str]) -> List[str]:
+        if self.executor is None:
+            return [hash_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (4 * self.workers))
+        return list(self.executor.map(hash_password, passwords, chunksize=chunksize))
+
+    def import_batch(self, rows: List[Dict[str, str]]):
+        """Validate, hash and insert one batch in a single transaction"""
+        self.stats["rows"] += len(rows)
+        valid = [result for result in map(self._validate, rows) if result is not None]
+        if not valid:
+            return
+
+        hashed_passwords = self._hash_passwords([user.password for user, _ in valid])
+        self.db.execute(insert(User), [
+            {
+                "username": user.username,
+                "email": user.email,
+                "full_name": user.full_name,
+                "hashed_password": hashed_password,
+                "role": UserRole.STUDENT,
+                "bluetooth_address": user.bluetooth_address,
+                "admission_number": user.admission_number,
+                "phone": user.phone,
+                "department": user.department,
+                "is_active": True
+            }
+            for (user, _), hashed_password in zip(valid, hashed_passwords)
+        ])
+        user_ids = dict(self.db.query(User.username, User.id).filter(
+            User.username.in_([user.username for user, _ in valid])
+        ).all())
+        enrollments = [
+            {"user_id": user_ids[user.username], "unit_id": unit_id}
+            for user, unit_ids in valid for unit_id in unit_ids
+        ]
+        if enrollments:
+            self.db.execute(insert(Enrollment), enrollments)
+        self.db.commit()
+        self.stats["imported"] += len(valid)
+        self.stats["enrollments"] += len(enrollments)
+
+def write_rejects(rejects_path: str, rejects: List[Dict[str, str]]):
+    fieldnames = list(dict.fromkeys(key for reject in rejects for key in reject))
+    with open(rejects_path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        if f.tell() == 0:
+            writer.writeheader()
+        writer.writerows(rejects)
+
+def import_students(
+    db: Session,
+    csv_path: str,
+    default_password: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: Optional[int] = None,
+    checkpoint_path: Optional[str] = None,
+    rejects_path: Optional[str] = None
+) -> dict:
+    """Import a student CSV; returns counts and throughput. workers=0 hashes in-process."""
+    checkpoint_path = checkpoint_path or f"{csv_path}.checkpoint"
+    rejects_path = rejects_path or f"{csv_path}.rejects.csv"
+    rows_done = load_checkpoint(checkpoint_path)
+    if rows_done:
+        # Rejects of the checkpointed rows are already in the file; keep appending
+        logger.info(f"Resuming {csv_path} after {rows_done} rows")
+    elif os.path.exists(rejects_path):
+        # A fresh run re-validates every row, so the old rejects would be listed twice
+        os.remove(rejects_path)
+
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+    importer = StudentImporter(db, default_password, executor, max(1, workers))
+    started = time.perf_counter()
+    try:
+        rows = read_rows(csv_path, skip=rows_done)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            importer.import_batch(batch)
+            rows_done += len(batch)
+            save_checkpoint(checkpoint_path, rows_done)
+            if importer.rejects:
+                write_rejects(rejects_path, importer.rejects)
+                importer.rejects = []
+            elapsed = time.perf_counter() - started
+            logger.info(f"{rows_done} rows done, {importer.stats['imported']} imported "
+                        f"({importer.stats['rows'] / elapsed:.0f} rows/s)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if importer.stats["imported"]:
+            invalidate_student_index(db)
+
+    elapsed = time.perf_counter() - started
+    return {
+        **importer.stats,
+        "resumed_from": rows_done - importer.stats["rows"],
+        "elapsed_seconds": round(elapsed, 2),
+        "rows_per_second": round(importer.stats["rows"] / elapsed, 1) if elapsed else 0.0,
+        "rejects_file": rejects_path if importer.stats["rejected"] else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Import students and enrollments from a CSV file")
+    parser.add_argument("csv_path", help="CSV with admission_number, email, bluetooth_address and units columns")
+    parser.add_argument("--default-password", help="Password for rows without a password column")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per transaction")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing processes (default: all cores, 0 = in-process)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <csv>.checkpoint)")
+    parser.add_argument("--rejects", help="Where rejected rows are written (default: <csv>.rejects.csv)")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or f"{args.csv_path}.checkpoint"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        results = import_students(
+            db, args.csv_path, args.default_password, args.batch_size,
+            args.workers, checkpoint_path, args.rejects
+        )
+    finally:
+        db.close()
+    for key, value in results.items():
+        print(f"{key:>18}: {value}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+import httpx
+from database import SessionLocal, init_db
+from models import User, UserRole
+from password_hashing import pwd_context
+from metrics import percentile
+
+PASSWORD = "loadtest123"
+
+def seed_students(count):
+    """Create loadtest_student_<n> accounts that don't exist yet (one bcrypt run for all)"""
+    init_db()
+    db = SessionLocal()
+    try:
+        existing = {
+            username for (username,) in
+            db.query(User.username).filter(User.username.like("loadtest_student_%"))
+        }
+        hashed_password = pwd_context.hash(PASSWORD)
+        new_students = [
+            User(
+                username=f"loadtest_student_{i}",
+                email=f"loadtest_student_{i}@test.com",
+                hashed_password=hashed_password,
+                role=UserRole.STUDENT
+            )
+            for i in range(count) if f"loadtest_student_{i}" not in existing
+        ]
+        db.add_all(new_students)
+        db.commit()
+        return len(new_students)
+    finally:
+        db.close()
+
+async def login(client, username, results):
+    started = time.perf_counter()
+    try:
+        response = await client.post("/token", data={"username": username, "password": PASSWORD})
+        results["statuses"][response.status_code] += 1
+    except httpx.HTTPError as e:
+        results["statuses"][type(e).__name__] += 1
+    results["login_latencies"].append(time.perf_counter() - started)
+
+async def poll_health(client, results, stop, interval):
+    """Measures how responsive the rest of the API stays during the spike"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get("/health")
+            results["health_latencies"].append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            results["health_errors"] += 1
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+async def scrape_password_hashing(client, token):
+    """The server's password_hash_* metrics from /metrics"""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    response = await client.get("/metrics", headers=headers)
+    response.raise_for_status()
+    stats = {}
+    for line in response.text.splitlines():
+        if line.startswith("password_hash_"):
+            name, value = line.rsplit(" ", 1)
+            stats[name] = float(value)
+    return stats
+
+async def run_load_test(args):
+    results = {"statuses": Counter(), "login_latencies": [], "health_latencies": [], "health_errors": 0}
+    if args.in_process:
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout)
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited_login(i):
+        # Spread arrivals over the ramp, like students opening the app around 8am
+        await asyncio.sleep(args.ramp * i / max(1, args.users))
+        async with semaphore:
+            await login(client, f"loadtest_student_{i}", results)
+
+    stop = asyncio.Event()
+    async with client:
+        health_task = asyncio.create_task(poll_health(client, results, stop, args.health_interval))
+        started = time.perf_counter()
+        await asyncio.gather(*(limited_login(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await health_task
+        server_stats = None
+        try:
+            server_stats = await scrape_password_hashing(client, args.metrics_token)
+        except (httpx.HTTPError, ValueError):
+            pass
+
+    login_ms = [latency * 1000 for latency in results["login_latencies"]]
+    health_ms = [latency * 1000 for latency in results["health_latencies"]]
+    return {
+        "logins": args.users,
+        "elapsed_seconds": round(elapsed, 2),
+        "logins_per_second": round(args.users / elapsed, 1) if elapsed else 0.0,
+        "status_codes": {str(code): count for code, count in sorted(results["statuses"].items(), key=str)},
+        "login_p50_ms": round(percentile(login_ms, 50), 1),
+        "login_p99_ms": round(percentile(login_ms, 99), 1),
+        "login_max_ms": round(max(login_ms, default=0.0), 1),
+        "health_checks": len(health_ms),
+        "health_p99_ms": round(percentile(health_ms, 99), 1),
+        "health_errors": results["health_errors"],
+        "server_password_hashing": server_stats
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce the start-of-term login spike against /token")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--in-process", action="store_true", help="Drive main.app directly instead of a server")
+    parser.add_argument("--users", type=int, default=2000, help="Students logging in")
+    parser.add_argument("--concurrency", type=int, default=200, help="Logins in flight at once")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which logins arrive")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--health-interval", type=float, default=0.25, help="Seconds between /health probes")
+    parser.add_argument("--metrics-token", default=os.getenv("METRICS_TOKEN"),
+                        help="Bearer token for /metrics (default: $METRICS_TOKEN)")
+    parser.add_argument("--seed", action="store_true", help="Create the load test students first")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.seed:
+        print(f"Seeded {seed_students(args.users)} load test students")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(run_load_test(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>24}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import argparse
+from sqlalchemy import func
+from database import SessionLocal
+from models import AttendanceCounter
+from attendance_counters import rebuild_attendance_counters
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recompute the attendance_counters rollup from the raw attendance rows"
+    )
+    parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        before = db.query(func.coalesce(func.sum(AttendanceCounter.attended), 0)).scalar()
+        counters = rebuild_attendance_counters(db)
+        after = db.query(func.coalesce(func.sum(AttendanceCounter.attended), 0)).scalar()
+        print(f"Rebuilt {counters} counters ({after} attendances, previously counted {before})")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 from database import SessionLocal
 from models import User
+from student_index import invalidate_student_index
+from user_cache import principal_cache
 
 def update_bluetooth():
     db = SessionLocal()
@@ -8,6 +10,8 @@ def update_bluetooth():
         if user:
             user.bluetooth_address = "a4:12:32:b4:7b:49"
             db.commit()
+            invalidate_student_index(db)
+            principal_cache.invalidate(user.id, db=db)
             print("Updated Wesley's Bluetooth address")
         else:
             print("User not found")
@@ -0,0 +1,119 @@
+import os
+import time
+import logging
+from typing import Dict, FrozenSet, NamedTuple, Optional
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from models import User, Enrollment, UserRole
+from cache_versions import bump_version, read_version
+
+logger = logging.getLogger(__name__)
+
+# Row in cache_versions bumped whenever a student's address or enrollments
+# change, so that scanners on other workers and hosts notice their index is stale
+CACHE_NAME = "student_index"
+VERSION_CHECK_INTERVAL = float(os.getenv("STUDENT_INDEX_CHECK", "5"))  # seconds
+
+# Bumped by invalidate_student_index() for indexes living in this process
+_generation = 0
+
+def normalize_mac(address: Optional[str]) -> Optional[str]:
+    """Return a MAC address in canonical upper-case colon form (AA:BB:CC:DD:EE:FF)"""
+    if not address:
+        return None
+    return address.strip().replace('-', ':').upper()
+
+def invalidate_student_index(db: Optional[Session] = None):
+    """Mark every loaded student index as stale.
+
+    Indexes in this process reload straight away. With db, the shared
+    version is bumped too, so indexes in other processes reload at their
+    next version check; call it after the change has been committed.
+    """
+    global _generation
+    _generation += 1
+    if db is None:
+        return
+    try:
+        bump_version(db, CACHE_NAME)
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.warning(f"Could not bump the student index version: {str(e)}")
+
+class StudentEntry(NamedTuple):
+    user_id: int
+    username: str
+    bluetooth_address: str
+    unit_ids: FrozenSet[int]
+    full_name: Optional[str] = None
+    admission_number: Optional[str] = None
+
+class StudentIndex:
+    """Maps normalised Bluetooth addresses to students and their enrolled units"""
+
+    def __init__(self, check_interval: float = VERSION_CHECK_INTERVAL):
+        self.entries: Dict[str, StudentEntry] = {}
+        self.loaded = False
+        self.check_interval = check_interval
+        self._generation = -1
+        self._version = 0
+        self._next_version_check = 0.0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def load(self, db: Session):
+        """(Re)build the index with one query for students and one for enrollments"""
+        generation, version = _generation, read_version(db, CACHE_NAME)
+
+        students = db.query(
+            User.id, User.username, User.bluetooth_address, User.full_name, User.admission_number
+        ).filter(
+            User.role == UserRole.STUDENT,
+            User.bluetooth_address.isnot(None)
+        ).all()
+        unit_ids: Dict[int, set] = {student.id: set() for student in students}
+        for user_id, unit_id in db.query(Enrollment.user_id, Enrollment.unit_id).filter(
+            Enrollment.user_id.in_(list(unit_ids))
+        ):
+            unit_ids[user_id].add(unit_id)
+
+        entries = {}
+        for user_id, username, address, full_name, admission_number in students:
+            key = normalize_mac(address)
+            if not key:
+                continue
+            entries[key] = StudentEntry(
+                user_id, username, address, frozenset(unit_ids[user_id]), full_name, admission_number
+            )
+
+        # Swap in one assignment so concurrent lookups never see a partial index
+        self.entries = entries
+        self.loaded = True
+        self._generation = generation
+        self._version = version
+        self._next_version_check = time.monotonic() + self.check_interval
+        logger.info(f"Loaded student index with {len(entries)} Bluetooth addresses")
+
+    def is_stale(self) -> bool:
+        """Whether the index must go through ensure_loaded() before it can be trusted.
+
+        Never touches the database, so the detection callback can ask; a due
+        version check counts as stale until ensure_loaded() has made it.
+        """
+        return (not self.loaded or self._generation != _generation
+                or time.monotonic() >= self._next_version_check)
+
+    def ensure_loaded(self, db: Session):
+        """Reload the index if it is stale or another process has invalidated it"""
+        if not self.loaded or self._generation != _generation:
+            self.load(db)
+        elif time.monotonic() >= self._next_version_check:
+            if read_version(db, CACHE_NAME) != self._version:
+                self.load(db)
+            else:
+                self._next_version_check = time.monotonic() + self.check_interval
+
+    def lookup(self, address: str) -> Optional[StudentEntry]:
+        """Return the student registered for address, if any"""
+        return self.entries.get(normalize_mac(address))
@@ -0,0 +1,232 @@
+"""Deterministic synthetic institutions for benchmarks and scale tests.
+
+generate_institution() fills users, units, enrollments, class sessions,
+attendance and attendance counters with Core bulk inserts. Primary keys are
+assigned up front, so nothing is read back. Every account shares one
+pre-computed bcrypt hash. The same seed and sizes always give the same rows.
+Identifiers derive from the prefix and the assigned ids, so several
+institutions can share a database.
+"""
+import random
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from operator import itemgetter
+from sqlalchemy import Boolean, Enum, func, insert, text
+from sqlalchemy.orm import Session
+from models import User, Unit, Enrollment, Attendance, AttendanceCounter, ClassSession, UserRole, AttendanceType
+
+logger = logging.getLogger(__name__)
+
+# Every synthetic account logs in with this password
+SYNTHETIC_PASSWORD = "synthetic123"
+# bcrypt of SYNTHETIC_PASSWORD, so generating accounts never runs bcrypt
+SYNTHETIC_PASSWORD_HASH = "$2b$12$C5y9A/c9YTOp.Um5h6VLu.LEaBvZ3ALIaqcTpH8bcpAdG5z8JwyiC"
+# Rows per INSERT executemany
+CHUNK_SIZE = 50000
+# First class of the default semester; fixed so the data is reproducible
+SEMESTER_START = datetime(2024, 1, 8, 8, 0)
+
+def admission_number(user_id: int) -> str:
+    """A valid xxxx/xx/xxxx/xx/xx admission number, unique per user id"""
+    return f"{user_id // 100000000:04d}/{(user_id // 1000000) % 100:02d}/{(user_id // 100) % 10000:04d}/{user_id % 100:02d}/24"
+
+def bluetooth_address(user_id: int) -> str:
+    """A locally administered MAC address, unique per user id"""
+    return ":".join(f"{byte:02X}" for byte in (0x02, *user_id.to_bytes(5, "big")))
+
+def _next_id(db: Session, model) -> int:
+    return (db.query(func.max(model.id)).scalar() or 0) + 1
+
+def _sync_sequences(db: Session, models):
+    """Move PostgreSQL id sequences past the ids assigned here"""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for model in models:
+        table = model.__tablename__
+        db.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+        ))
+
+def _memoized(processor):
+    """Enum and boolean columns repeat a handful of values; convert each once"""
+    cache = {}
+
+    def process(value):
+        try:
+            return cache[value]
+        except KeyError:
+            cache[value] = result = processor(value)
+            return result
+    return process
+
+def _insert_chunks(db: Session, model, columns: Tuple[str, ...], rows: Iterable[tuple], chunk_size: int) -> int:
+    """executemany straight on the driver; only the columns' bind processors run per value"""
+    table = model.__table__
+    dialect = db.get_bind().dialect
+    compiled = insert(table).compile(dialect=dialect, column_keys=list(columns))
+    statement = str(compiled)
+    processors = []
+    for index, name in enumerate(columns):
+        column_type = table.c[name].type
+        processor = column_type.dialect_impl(dialect).bind_processor(dialect)
+        if processor is not None:
+            if isinstance(column_type, (Enum, Boolean)):
+                processor = _memoized(processor)
+            processors.append((index, processor))
+    if dialect.positional:
+        # Positional drivers take values in the compiled statement's column order
+        reorder = itemgetter(*[columns.index(name) for name in compiled.positiontup])
+        convert = lambda row: reorder(row)
+    else:
+        convert = lambda row: dict(zip(columns, row))
+    connection = db.connection()
+
+    def flush(chunk):
+        connection.exec_driver_sql(statement, [convert(row) for row in chunk])
+
+    written = 0
+    chunk = []
+    for row in rows:
+        if processors:
+            row = list(row)
+            for index, processor in processors:
+                row[index] = processor(row[index])
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+        written += len(chunk)
+    return written
+
+def generate_institution(
+    db: Session,
+    students: int = 1000,
+    lecturers: int = 10,
+    units: int = 30,
+    units_per_student: int = 5,
+    weeks: int = 14,
+    sessions_per_week: int = 2,
+    attendance_rate: float = 0.8,
+    seed: int = 0,
+    prefix: str = "synthetic",
+    semester_start: Optional[datetime] = None,
+    password_hash: str = SYNTHETIC_PASSWORD_HASH,
+    chunk_size: int = CHUNK_SIZE
+) -> dict:
+    """Insert a whole institution and commit; returns row counts and id ranges.
+
+    Lecturers are <prefix>_lecturer_<n>, students <prefix>_student_<n> and
+    units <PREFIX><nnnn>. Each student takes units_per_student random units,
+    and each unit holds sessions_per_week classes a week for `weeks` weeks
+    from semester_start. Each student attends a class with probability
+    attendance_rate.
+    """
+    # Checked before anything is inserted, so bad sizes leave no partial data
+    sizes = {"students": students, "lecturers": lecturers, "units": units,
+             "units_per_student": units_per_student, "weeks": weeks, "sessions_per_week": sessions_per_week}
+    negative = [name for name, size in sizes.items() if size < 0]
+    if negative:
+        raise ValueError(f"{', '.join(negative)} must not be negative")
+    if units and not lecturers:
+        raise ValueError("Units need at least one lecturer to teach them")
+    if not 0 <= attendance_rate <= 1:
+        raise ValueError(f"attendance_rate must be between 0 and 1, got {attendance_rate}")
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    semester_start = semester_start or SEMESTER_START
+    first_user = _next_id(db, User)
+    first_unit = _next_id(db, Unit)
+    first_session = _next_id(db, ClassSession)
+    lecturer_ids = range(first_user, first_user + lecturers)
+    student_ids = range(first_user + lecturers, first_user + lecturers + students)
+    unit_ids = range(first_unit, first_unit + units)
+
+    user_columns = ("id", "username", "email", "full_name", "hashed_password", "role",
+                    "admission_number", "bluetooth_address", "is_active")
+    user_rows = _insert_chunks(db, User, user_columns, (
+        (user_id, f"{prefix}_lecturer_{n}", f"{prefix}_lecturer_{n}@example.com", f"Lecturer {n}",
+         password_hash, UserRole.LECTURER, None, None, True)
+        for n, user_id in enumerate(lecturer_ids)
+    ), chunk_size)
+    user_rows += _insert_chunks(db, User, user_columns, (
+        (user_id, f"{prefix}_student_{n}", f"{prefix}_student_{n}@example.com", f"Student {n}",
+         password_hash, UserRole.STUDENT, admission_number(user_id), bluetooth_address(user_id), True)
+        for n, user_id in enumerate(student_ids)
+    ), chunk_size)
+    unit_lecturers = {unit_id: lecturer_ids[n % lecturers] for n, unit_id in enumerate(unit_ids)}
+    _insert_chunks(db, Unit, ("id", "code", "name", "lecturer_id"), (
+        (unit_id, f"{prefix.upper()}{n:04d}", f"Unit {n}", unit_lecturers[unit_id])
+        for n, unit_id in enumerate(unit_ids)
+    ), chunk_size)
+
+    # Who takes what: every student draws units_per_student distinct units
+    per_student = min(units_per_student, units)
+    enrolled: Dict[int, List[int]] = {unit_id: [] for unit_id in unit_ids}
+    for student_id in student_ids:
+        for unit_id in rng.sample(unit_ids, per_student):
+            enrolled[unit_id].append(student_id)
+    enrollment_rows = _insert_chunks(db, Enrollment, ("user_id", "unit_id"), (
+        (student_id, unit_id)
+        for unit_id, unit_students in enrolled.items()
+        for student_id in unit_students
+    ), chunk_size)
+
+    # Each unit meets on fixed weekdays at a fixed hour, as a timetable would
+    sessions: List[Tuple[int, int, datetime]] = []
+    for n, unit_id in enumerate(unit_ids):
+        for week in range(weeks):
+            for slot in range(sessions_per_week):
+                started_at = semester_start + timedelta(
+                    weeks=week, days=(n + slot * 2) % 5, hours=n % 8, minutes=slot
+                )
+                sessions.append((first_session + len(sessions), unit_id, started_at))
+    _insert_chunks(db, ClassSession, ("id", "unit_id", "lecturer_id", "started_at", "ended_at"), (
+        (session_id, unit_id, unit_lecturers[unit_id], started_at, started_at + timedelta(hours=2))
+        for session_id, unit_id, started_at in sessions
+    ), chunk_size)
+
+    attended: Dict[Tuple[int, int], int] = {}
+    addresses = {student_id: bluetooth_address(student_id) for student_id in student_ids}
+    marked_offsets = [timedelta(seconds=second) for second in range(900)]
+
+    def attendance_rows() -> Iterator[tuple]:
+        draw = rng.random
+        for session_id, unit_id, started_at in sessions:
+            for student_id in enrolled[unit_id]:
+                if draw() < attendance_rate:
+                    key = (student_id, unit_id)
+                    attended[key] = attended.get(key, 0) + 1
+                    yield (student_id, unit_id, session_id, AttendanceType.BLUETOOTH, addresses[student_id],
+                           started_at + marked_offsets[int(draw() * 900)])
+
+    attendance_count = _insert_chunks(
+        db, Attendance, ("user_id", "unit_id", "session_id", "attendance_type", "bluetooth_address", "marked_at"),
+        attendance_rows(), chunk_size
+    )
+    # The counters follow from what was generated; no aggregate over the table
+    _insert_chunks(db, AttendanceCounter, ("user_id", "unit_id", "attended"), (
+        (user_id, unit_id, count) for (user_id, unit_id), count in attended.items()
+    ), chunk_size)
+    _sync_sequences(db, (User, Unit, ClassSession))
+    db.commit()
+
+    summary = {
+        "users": user_rows,
+        "lecturers": lecturers,
+        "students": students,
+        "units": units,
+        "enrollments": enrollment_rows,
+        "sessions": len(sessions),
+        "attendances": attendance_count,
+        "lecturer_ids": (lecturer_ids.start, lecturer_ids.stop),
+        "student_ids": (student_ids.start, student_ids.stop),
+        "unit_ids": (unit_ids.start, unit_ids.stop),
+        "elapsed_seconds": round(time.perf_counter() - started, 2)
+    }
+    logger.info(f"Generated {prefix}: {attendance_count} attendance rows in {summary['elapsed_seconds']} s")
+    return summary
@@ -10,17 +10,29 @@ from typing import Generator
 project_root = str(Path(__file__).parent.parent)
 sys.path.insert(0, project_root)
 
+# Test database; point TEST_DATABASE_URL at a PostgreSQL database to run the
+# suite against it instead of SQLite. The app is pointed at the same database
+# before it is imported, so startup, the scanner and every request use it too
+SQLALCHEMY_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite:///./test.db")
+os.environ["DATABASE_URL"] = SQLALCHEMY_DATABASE_URL
+
 # Import after adding to path
-from database import Base, get_db
+from database import Base, get_db, create_database_engine
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from main import app
+from user_cache import principal_cache
+from synthetic_data import generate_institution
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
 
-# Test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# A PostgreSQL database for the backend-specific tests, when one is available
+POSTGRES_TEST_URL = os.getenv("TEST_POSTGRES_URL") or (
+    SQLALCHEMY_DATABASE_URL if SQLALCHEMY_DATABASE_URL.startswith("postgresql") else None
+)
+engine = create_database_engine(SQLALCHEMY_DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 @pytest.fixture(scope="session")
@@ -42,18 +54,83 @@ def test_db():
     # Drop test database after tests
     Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture(scope="session", autouse=True)
+def app_tables():
+    """Tables in the test database, for tests that write before the app starts"""
+    Base.metadata.create_all(bind=engine)
+
+@pytest.fixture(autouse=True)
+def clear_principal_cache():
+    """Tests recreate users with recycled ids, so cached principals must not leak between them"""
+    principal_cache.clear()
+    yield
+    principal_cache.clear()
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def backend_engine(request, tmp_path):
+    """A fresh schema on each supported backend; PostgreSQL is skipped without a server"""
+    if request.param == "sqlite":
+        backend = create_database_engine(f"sqlite:///{tmp_path / 'backend.db'}")
+    else:
+        if not POSTGRES_TEST_URL:
+            pytest.skip("TEST_POSTGRES_URL is not set")
+        try:
+            backend = create_database_engine(POSTGRES_TEST_URL)
+            Base.metadata.drop_all(bind=backend)
+        except (ImportError, OperationalError) as e:
+            pytest.skip(f"PostgreSQL unavailable: {e}")
+    Base.metadata.create_all(bind=backend)
+    try:
+        yield backend
+    finally:
+        Base.metadata.drop_all(bind=backend)
+        backend.dispose()
+
+@pytest.fixture
+def memory_db():
+    """Isolated in-memory database, for tests that must not share test.db state"""
+    memory_engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=memory_engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=memory_engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+        memory_engine.dispose()
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "synthetic(**sizes): generate_institution() arguments for the synthetic_institution fixture"
+    )
+
+@pytest.fixture
+def synthetic_institution(request, memory_db):
+    """A generated institution in memory_db; sizes come from @pytest.mark.synthetic(...)"""
+    marker = request.node.get_closest_marker("synthetic")
+    sizes = {"students": 200, "lecturers": 5, "units": 10}
+    if marker is not None:
+        sizes.update(marker.kwargs)
+    return generate_institution(memory_db, **sizes)
+
 @pytest.fixture(scope="function")
 def client(test_db):
     def override_get_db():
+        # A session per request, as in the app, but on the test database
+        db = TestingSessionLocal()
         try:
-            yield test_db
+            yield db
         finally:
-            test_db.close()
-    
+            db.close()
+
     app.dependency_overrides[get_db] = override_get_db
     with TestClient(app) as test_client:
         yield test_client
-    
+    app.dependency_overrides.pop(get_db, None)
+
     # Clear database after each test
     for table in reversed(Base.metadata.sorted_tables):
         test_db.execute(table.delete())
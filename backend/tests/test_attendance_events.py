@@ -0,0 +1,92 @@
+import asyncio
+import json
+import threading
+import pytest
+from attendance_events import AttendanceEventBus, attendance_event
+from bluetooth_scanner import BluetoothScanner
+from models import User, Unit, Enrollment, UserRole, AttendanceType
+
+def parse_sse(chunks):
+    """(event, id, data) for every event in an SSE body; comments and retry lines are skipped"""
+    events = []
+    for block in "".join(chunks).split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":") and ": " in line)
+        if "event" in fields:
+            events.append((fields["event"], fields.get("id"), json.loads(fields["data"])))
+    return events
+
+async def collect(stream, count):
+    """Read from the stream until `count` events have arrived or it ends"""
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        if len(parse_sse(chunks)) >= count:
+            break
+    return parse_sse(chunks)
+
+def mark(attendance_id, session_id=1, user_id=None):
+    return attendance_event(attendance_id, session_id, 7, user_id or attendance_id, AttendanceType.BLUETOOTH,
+                            username=f"student{attendance_id}")
+
+@pytest.mark.asyncio
+async def test_stream_sends_backlog_then_live_marks_until_session_ends():
+    bus = AttendanceEventBus()
+    subscription = bus.subscribe(1)
+    stream = bus.stream(subscription, [mark(1), mark(2)], keepalive=0.01)
+
+    # Published from a database worker thread, as the write paths do; the
+    # backlog row 2 arrives again and is skipped, session 2 is someone else's
+    publisher = threading.Thread(target=bus.publish, args=([mark(2), mark(3), mark(4, session_id=2)],))
+    publisher.start()
+    publisher.join()
+    bus.close_session(1)
+
+    events = await collect(stream, 10)
+    assert [(event, event_id) for event, event_id, _ in events] == [
+        ("marked", "1"), ("marked", "2"), ("marked", "3"), ("end", None)
+    ]
+    assert events[2][2]["username"] == "student3"
+    assert bus.stats()["subscribers"] == 0
+
+@pytest.mark.asyncio
+async def test_dashboard_that_falls_behind_is_disconnected():
+    bus = AttendanceEventBus(max_queue=2)
+    subscription = bus.subscribe(1)
+    bus.publish([mark(i) for i in range(1, 6)])
+    await asyncio.sleep(0)  # let the loop run the queued deliveries
+
+    events = await collect(bus.stream(subscription, []), 10)
+    # What was queued is sent, then the stream stops without an end event so
+    # the browser reconnects and catches up from the database
+    assert [event_id for _, event_id, _ in events] == ["1", "2"]
+    assert bus.stats()["overflows"] == 1
+
+@pytest.mark.asyncio
+async def test_scanner_writes_are_published_to_the_session(memory_db, monkeypatch):
+    bus = AttendanceEventBus()
+    monkeypatch.setattr("bluetooth_scanner.attendance_events", bus)
+    lecturer = User(username="events_lecturer", email="events_lecturer@test.com", role=UserRole.LECTURER)
+    student = User(username="events_student", email="events_student@test.com", role=UserRole.STUDENT,
+                   full_name="Events Student", bluetooth_address="00:11:22:33:44:77")
+    memory_db.add_all([lecturer, student])
+    memory_db.commit()
+    unit = Unit(code="EVT101", name="Events", lecturer_id=lecturer.id)
+    memory_db.add(unit)
+    memory_db.commit()
+    memory_db.add(Enrollment(user_id=student.id, unit_id=unit.id))
+    memory_db.commit()
+
+    events_scanner = BluetoothScanner(db=memory_db)
+    session = events_scanner.add_session({"beacon_id": "evt", "unit_id": unit.id, "lecturer_id": lecturer.id})
+    await events_scanner.load_session_marks(session)
+    subscription = bus.subscribe(session.session_id)
+
+    await events_scanner.process_device("00:11:22:33:44:77")
+    await events_scanner.process_device("00:11:22:33:44:77")  # already marked: nothing new
+    await events_scanner.stop_scanning("evt")
+
+    events = await collect(bus.stream(subscription, []), 10)
+    assert [event for event, _, _ in events] == ["marked", "end"]
+    assert events[0][2]["user_id"] == student.id
+    assert events[0][2]["full_name"] == "Events Student"
+    assert events[0][2]["session_id"] == session.session_id
@@ -3,7 +3,7 @@ import asyncio
 from datetime import datetime, timedelta
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 from bluetooth_scanner import BluetoothScanner
-from models import User, Unit, Enrollment, Attendance, UserRole, AttendanceType
+from models import User, Unit, Enrollment, Attendance, ClassSession, UserRole, AttendanceType
 from passlib.context import CryptContext
 import uuid
 from database import SessionLocal
@@ -288,6 +288,9 @@ async def test_error_handling(scanner):
 @pytest.mark.asyncio
 async def test_duplicate_attendance_prevention(scanner, test_db, test_student, test_unit, test_enrollment):
     scanner.db = test_db
+    # Outside a broadcast the scanner only joins a class held today
+    test_db.add(ClassSession(unit_id=test_unit.id, lecturer_id=test_unit.lecturer_id, started_at=datetime.utcnow()))
+    test_db.commit()
     
     # Mark attendance first time
     await scanner.process_device(test_student.bluetooth_address)
@@ -302,4 +305,345 @@ async def test_duplicate_attendance_prevention(scanner, test_db, test_student, t
         Attendance.marked_at >= datetime.utcnow().date()
     ).all()
     
-    assert len(attendances) == 1 
\ No newline at end of file
+    assert len(attendances) == 1 
+
+def _add_student_with_units(db, username, address, unit_count=1, held_today=False):
+    """A student enrolled in unit_count new units; held_today opens a class for each today"""
+    student = User(
+        username=username,
+        email=f"{username}@test.com",
+        role=UserRole.STUDENT,
+        bluetooth_address=address
+    )
+    db.add(student)
+    db.commit()
+    units = []
+    for i in range(unit_count):
+        unit = Unit(code=f"{username.upper()}{i}", name=f"Unit {i}", lecturer_id=1)
+        db.add(unit)
+        db.commit()
+        db.add(Enrollment(user_id=student.id, unit_id=unit.id))
+        if held_today:
+            db.add(ClassSession(unit_id=unit.id, lecturer_id=1, started_at=datetime.utcnow()))
+        units.append(unit)
+    db.commit()
+    return student, units
+
+@pytest.mark.asyncio
+async def test_process_batch_marks_all_students_in_one_pass(memory_db):
+    batch_scanner = BluetoothScanner(db=memory_db)
+    first, first_units = _add_student_with_units(memory_db, "batch_one", "00:11:22:33:44:01", unit_count=2, held_today=True)
+    second, _ = _add_student_with_units(memory_db, "batch_two", "00:11:22:33:44:02", held_today=True)
+
+    await batch_scanner.process_batch(["00:11:22:33:44:01", "00:11:22:33:44:02", "AA:BB:CC:DD:EE:FF"])
+    await batch_scanner.process_batch(["00:11:22:33:44:01"])
+
+    assert memory_db.query(Attendance).filter(Attendance.user_id == first.id).count() == 2
+    assert memory_db.query(Attendance).filter(Attendance.user_id == second.id).count() == 1
+    stats = batch_scanner.get_pipeline_stats()
+    assert stats["batches"] == 2
+    assert stats["devices_processed"] == 4
+    assert stats["attendance_written"] == 3
+    assert stats["max_batch_latency_ms"] >= stats["last_batch_latency_ms"] > 0
+
+@pytest.mark.asyncio
+async def test_marks_outside_a_broadcast_only_join_classes_held_today(memory_db):
+    daily_scanner = BluetoothScanner(db=memory_db)
+    student, units = _add_student_with_units(memory_db, "daily", "00:11:22:33:44:0E", unit_count=2)
+    memory_db.add(ClassSession(unit_id=units[0].id, lecturer_id=1, started_at=datetime.utcnow()))
+    memory_db.commit()
+
+    await daily_scanner.process_batch(["00:11:22:33:44:0E"])
+
+    records = memory_db.query(Attendance).filter(Attendance.user_id == student.id).all()
+    assert [record.unit_id for record in records] == [units[0].id]
+    # No class is invented for the unit that held none
+    assert memory_db.query(ClassSession).filter(ClassSession.unit_id == units[1].id).count() == 0
+
+@pytest.mark.asyncio
+async def test_detection_callback_enqueues_while_worker_runs(memory_db):
+    queued_scanner = BluetoothScanner(db=memory_db, batch_window=0.01)
+    student, _ = _add_student_with_units(memory_db, "queued", "00:11:22:33:44:03", held_today=True)
+    queued_scanner.detection_queue = asyncio.Queue()
+    queued_scanner.worker_task = asyncio.create_task(queued_scanner.detection_worker())
+
+    device = MagicMock()
+    device.address = "00:11:22:33:44:03"
+    await queued_scanner.device_detection_callback(device, MagicMock())
+    assert queued_scanner.pipeline_stats["enqueued"] == 1
+
+    await queued_scanner.detection_queue.join()
+    queued_scanner.worker_task.cancel()
+
+    assert queued_scanner.queue_depth == 0
+    assert memory_db.query(Attendance).filter(Attendance.user_id == student.id).count() == 1
+
+def test_student_index_normalises_and_invalidates(memory_db):
+    from student_index import StudentIndex, invalidate_student_index, normalize_mac
+    student, units = _add_student_with_units(memory_db, "indexed", "aa-bb-cc-dd-ee-01")
+    index = StudentIndex()
+    index.load(memory_db)
+
+    assert normalize_mac("aa-bb-cc-dd-ee-01") == "AA:BB:CC:DD:EE:01"
+    entry = index.lookup("aa:bb:cc:dd:ee:01")
+    assert entry.user_id == student.id
+    assert entry.unit_ids == {units[0].id}
+    assert index.lookup("11:22:33:44:55:66") is None
+    assert not index.is_stale()
+
+    invalidate_student_index()
+    assert index.is_stale()
+
+def test_student_index_reloads_after_another_host_invalidates(memory_db):
+    from cache_versions import bump_version
+    from student_index import CACHE_NAME, StudentIndex
+    index = StudentIndex(check_interval=0)
+    index.ensure_loaded(memory_db)
+    assert index.lookup("00:11:22:33:44:0a") is None
+
+    # Registered through another worker: only the shared version moves
+    student, _ = _add_student_with_units(memory_db, "elsewhere", "00:11:22:33:44:0a")
+    bump_version(memory_db, CACHE_NAME)
+    assert index.is_stale()
+    index.ensure_loaded(memory_db)
+    assert index.lookup("00:11:22:33:44:0a").user_id == student.id
+
+@pytest.mark.asyncio
+async def test_unknown_devices_rejected_without_queueing(memory_db):
+    indexed_scanner = BluetoothScanner(db=memory_db)
+    _add_student_with_units(memory_db, "known", "00:11:22:33:44:04")
+    indexed_scanner.student_index.load(memory_db)
+    indexed_scanner.detection_queue = asyncio.Queue()
+    indexed_scanner.worker_task = MagicMock()
+
+    stranger = MagicMock()
+    stranger.address = "de:ad:be:ef:00:01"
+    await indexed_scanner.device_detection_callback(stranger, MagicMock())
+    known = MagicMock()
+    known.address = "00:11:22:33:44:04"
+    await indexed_scanner.device_detection_callback(known, MagicMock())
+
+    assert "DE:AD:BE:EF:00:01" in indexed_scanner.detected_devices
+    assert indexed_scanner.pipeline_stats["rejected_unknown"] == 1
+    assert indexed_scanner.queue_depth == 1
+
+@pytest.mark.asyncio
+async def test_session_scope_marks_only_broadcast_unit(memory_db):
+    scoped_scanner = BluetoothScanner(db=memory_db)
+    student, units = _add_student_with_units(memory_db, "scoped", "00:11:22:33:44:05", unit_count=3)
+    session = scoped_scanner.add_session({"beacon_id": "1_x_0", "unit_id": units[1].id, "unit_code": units[1].code})
+    await scoped_scanner.load_session_marks(session)
+
+    await scoped_scanner.process_device("00:11:22:33:44:05")
+    records = memory_db.query(Attendance).filter(Attendance.user_id == student.id).all()
+    assert [record.unit_id for record in records] == [units[1].id]
+    assert session.marked == {student.id}
+
+    # Repeat sightings are answered from the session dedup set
+    scoped_scanner.student_index.load(memory_db)
+    scoped_scanner.worker_task = MagicMock()
+    scoped_scanner.detection_queue = asyncio.Queue()
+    device = MagicMock()
+    device.address = "00:11:22:33:44:05"
+    await scoped_scanner.device_detection_callback(device, MagicMock())
+    assert scoped_scanner.pipeline_stats["dedup_hits"] == 1
+    assert scoped_scanner.queue_depth == 0
+
+    # A student of another unit is neither queued nor counted as a dedup hit
+    outsider, _ = _add_student_with_units(memory_db, "outsider", "00:11:22:33:44:0F")
+    scoped_scanner.student_index.load(memory_db)
+    device.address = "00:11:22:33:44:0F"
+    await scoped_scanner.device_detection_callback(device, MagicMock())
+    assert scoped_scanner.pipeline_stats["not_enrolled"] == 1
+    assert scoped_scanner.pipeline_stats["dedup_hits"] == 1
+    assert scoped_scanner.queue_depth == 0
+
+@pytest.mark.asyncio
+async def test_concurrent_sessions_share_one_ble_scanner(memory_db):
+    shared_scanner = BluetoothScanner(db=memory_db)
+    first, first_units = _add_student_with_units(memory_db, "room_a", "00:11:22:33:44:06")
+    second, second_units = _add_student_with_units(memory_db, "room_b", "00:11:22:33:44:07")
+
+    with patch('bluetooth_scanner.BleakScanner') as mock_scanner:
+        mock_scanner.return_value = AsyncMock()
+        room_a = await shared_scanner.start_scanning({"beacon_id": "a", "unit_id": first_units[0].id, "unit_code": "A"})
+        room_b = await shared_scanner.start_scanning({"beacon_id": "b", "unit_id": second_units[0].id, "unit_code": "B"})
+        assert mock_scanner.call_count == 1
+        assert set(shared_scanner.sessions) == {"a", "b"}
+
+        for address in ("00:11:22:33:44:06", "00:11:22:33:44:07"):
+            device = MagicMock()
+            device.address = address
+            await shared_scanner.device_detection_callback(device, MagicMock())
+        await shared_scanner.detection_queue.join()
+
+        assert set(room_a.detected_devices) == {"00:11:22:33:44:06"}
+        assert set(room_b.detected_devices) == {"00:11:22:33:44:07"}
+        assert room_a.marked == {first.id}
+        assert room_b.marked == {second.id}
+
+        # Each broadcast is its own class session, ended when it stops
+        assert room_a.session_id != room_b.session_id
+        await shared_scanner.stop_scanning("a")
+        assert memory_db.get(ClassSession, room_a.session_id).ended_at is not None
+        assert memory_db.get(ClassSession, room_b.session_id).ended_at is None
+        assert shared_scanner.scanning is True
+        assert set(shared_scanner.sessions) == {"b"}
+        await shared_scanner.stop_scanning("b")
+        assert shared_scanner.scanning is False
+        mock_scanner.return_value.stop.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_session_opened_later_marks_already_tracked_device(memory_db):
+    later_scanner = BluetoothScanner(db=memory_db, batch_window=0.01)
+    student, units = _add_student_with_units(memory_db, "later", "00:11:22:33:44:0B", unit_count=2)
+    device = MagicMock()
+    device.address = "00:11:22:33:44:0B"
+
+    with patch('bluetooth_scanner.BleakScanner') as mock_scanner:
+        mock_scanner.return_value = AsyncMock()
+        first = await later_scanner.start_scanning({"beacon_id": "x", "unit_id": units[0].id, "unit_code": "X"})
+        await later_scanner.device_detection_callback(device, MagicMock())
+        await later_scanner.detection_queue.join()
+        assert first.marked == {student.id}
+
+        # The device keeps advertising while the second unit's broadcast starts
+        second = await later_scanner.start_scanning({"beacon_id": "y", "unit_id": units[1].id, "unit_code": "Y"})
+        await later_scanner.device_detection_callback(device, MagicMock())
+        await later_scanner.detection_queue.join()
+        assert second.marked == {student.id}
+
+        # Further sightings need nothing from either session
+        await later_scanner.device_detection_callback(device, MagicMock())
+        assert later_scanner.queue_depth == 0
+        await later_scanner.stop_scanning()
+
+    records = memory_db.query(Attendance).filter(Attendance.user_id == student.id).all()
+    assert sorted(record.unit_id for record in records) == [units[0].id, units[1].id]
+    assert later_scanner.pipeline_stats["enqueued"] == 2
+
+@pytest.mark.asyncio
+async def test_stop_drains_queued_detections_into_the_session(memory_db):
+    draining_scanner = BluetoothScanner(db=memory_db, batch_window=0.01)
+    first, units = _add_student_with_units(memory_db, "drain_one", "00:11:22:33:44:0C")
+    second, _ = _add_student_with_units(memory_db, "drain_two", "00:11:22:33:44:0D")
+    memory_db.add(Enrollment(user_id=second.id, unit_id=units[0].id))
+    memory_db.commit()
+
+    with patch('bluetooth_scanner.BleakScanner') as mock_scanner:
+        mock_scanner.return_value = AsyncMock()
+        session = await draining_scanner.start_scanning({"beacon_id": "drain", "unit_id": units[0].id, "unit_code": "D"})
+        for address in ("00:11:22:33:44:0C", "00:11:22:33:44:0D"):
+            device = MagicMock()
+            device.address = address
+            await draining_scanner.device_detection_callback(device, MagicMock())
+        # Stop with the batch queued or in flight, not yet written
+        await draining_scanner.stop_scanning("drain")
+
+    records = memory_db.query(Attendance).filter(Attendance.unit_id == units[0].id).all()
+    assert sorted(record.user_id for record in records) == [first.id, second.id]
+    assert {record.session_id for record in records} == {session.session_id}
+    assert draining_scanner.pipeline_stats["devices_processed"] == 2
+    assert draining_scanner.worker_task is None and draining_scanner.detection_queue is None
+
+@pytest.mark.asyncio
+async def test_expired_session_is_stopped_by_a_tracked_task(memory_db):
+    expiring_scanner = BluetoothScanner(db=memory_db, batch_window=0.01)
+    _, units = _add_student_with_units(memory_db, "expiring", "00:11:22:33:44:0E")
+
+    with patch('bluetooth_scanner.BleakScanner') as mock_scanner, \
+            patch('bluetooth_scanner.EXPIRY_CHECK_SECONDS', 0.01):
+        mock_scanner.return_value = AsyncMock()
+        session = await expiring_scanner.start_scanning({"beacon_id": "expiring", "unit_id": units[0].id, "unit_code": "E"})
+        session.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        await asyncio.wait_for(_until(lambda: not expiring_scanner.scanning), 5)
+        # The stop task is held until it finishes, then forgotten
+        await asyncio.wait_for(_until(lambda: not expiring_scanner.expiry_stops), 5)
+
+    assert expiring_scanner.sessions == {}
+    assert expiring_scanner.last_error is None
+    class_session = memory_db.get(ClassSession, session.session_id)
+    memory_db.refresh(class_session)
+    assert class_session.ended_at is not None
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+def test_device_tracker_expires_and_evicts_least_recently_seen():
+    from device_tracker import DeviceTracker
+    now = [1000.0]
+    tracker = DeviceTracker(ttl_seconds=300, max_devices=2, clock=lambda: now[0])
+
+    assert tracker.touch("A") is True
+    now[0] += 10
+    assert tracker.touch("B") is True
+    now[0] += 10
+    assert tracker.touch("A") is False  # A is now the most recently seen
+    assert tracker.touch("C") is True   # over the cap: B is evicted, not A
+    assert set(tracker) == {"A", "C"}
+    assert tracker.evictions == 1
+
+    now[0] += 300
+    assert tracker.seen_within("A") is False
+    assert tracker.expire() == 2
+    assert tracker == {}
+
+def test_trace_round_trip(tmp_path):
+    from ble_trace import Advertisement, read_trace, write_trace
+    advertisements = [
+        Advertisement(0.0, "00:11:22:33:44:55", "Phone", -60),
+        Advertisement(0.25, "AA:BB:CC:DD:EE:FF", None, -91),
+    ]
+    for name in ("trace.bin", "trace.bin.gz"):
+        path = str(tmp_path / name)
+        assert write_trace(path, advertisements) == 2
+        assert list(read_trace(path)) == advertisements
+
+@pytest.mark.asyncio
+async def test_replay_scanner_drives_detection_callback(memory_db):
+    from ble_trace import ReplayScanner, generate_trace
+    student, units = _add_student_with_units(memory_db, "replayed", "00:11:22:33:44:08")
+    trace = generate_trace(["00:11:22:33:44:08", "DE:AD:BE:EF:00:02"], duration=3.0, interval=1.0)
+    replays = []
+
+    def replay_factory(detection_callback):
+        replays.append(ReplayScanner(detection_callback, trace, speed=0))
+        return replays[0]
+
+    replay_scanner = BluetoothScanner(db=memory_db, scanner_factory=replay_factory, batch_window=0.01)
+    await replay_scanner.start_scanning({"beacon_id": "r", "unit_id": units[0].id, "unit_code": units[0].code})
+    await replays[0].finished.wait()
+    await replay_scanner.detection_queue.join()
+    await replay_scanner.stop_scanning()
+
+    assert replays[0].replayed == len(trace)
+    assert len(replays[0].latencies) == len(trace)
+    assert memory_db.query(Attendance).filter(Attendance.user_id == student.id).count() == 1
+
+@pytest.mark.asyncio
+async def test_batch_survives_attendance_marked_concurrently(memory_db):
+    racing_scanner = BluetoothScanner(db=memory_db)
+    first, units = _add_student_with_units(memory_db, "race_one", "00:11:22:33:44:09", held_today=True)
+    second, _ = _add_student_with_units(memory_db, "race_two", "00:11:22:33:44:0A", held_today=True)
+    racing_scanner.student_index.load(memory_db)
+
+    # A manual mark lands between the bulk check and the insert
+    original_daily_records = racing_scanner._daily_records
+    def daily_records_then_manual_mark(students):
+        records = original_daily_records(students)
+        session_id = next(record.session_id for record in records if record.user_id == first.id)
+        memory_db.add(Attendance(user_id=first.id, unit_id=units[0].id, session_id=session_id,
+                                 attendance_type=AttendanceType.MANUAL))
+        memory_db.commit()
+        return records
+    racing_scanner._daily_records = daily_records_then_manual_mark
+
+    await racing_scanner.process_batch(["00:11:22:33:44:09", "00:11:22:33:44:0A"])
+
+    assert memory_db.query(Attendance).filter(Attendance.user_id == first.id).one().attendance_type == AttendanceType.MANUAL
+    assert memory_db.query(Attendance).filter(Attendance.user_id == second.id).count() == 1
+    assert racing_scanner.pipeline_stats["attendance_written"] == 1
+    # Only the row that was actually written is counted
+    from models import AttendanceCounter
+    assert dict(memory_db.query(AttendanceCounter.user_id, AttendanceCounter.attended).all()) == {second.id: 1}
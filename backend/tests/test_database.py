@@ -0,0 +1,88 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from database import (
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    SQLITE_PROFILES,
+    apply_sqlite_pragmas,
+    create_database_engine,
+    get_database_url,
+    sqlite_pragmas,
+    verify_sqlite_profile
+)
+from models import User, Unit, Enrollment, Attendance, ClassSession, UserRole, AttendanceType
+
+def test_production_profile_applied_on_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}", connect_args={"check_same_thread": False})
+    pragmas = SQLITE_PROFILES["production"]
+    apply_sqlite_pragmas(engine, pragmas)
+
+    status = verify_sqlite_profile(engine, pragmas)
+    assert status["mismatches"] == []
+    assert status["pragmas"]["journal_mode"] == "wal"
+    assert status["pragmas"]["synchronous"] == 1
+    assert status["pragmas"]["busy_timeout"] == 5000
+    engine.dispose()
+
+def test_verify_reports_mismatched_pragmas(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bare.db'}")
+    status = verify_sqlite_profile(engine, SQLITE_PROFILES["production"])
+    assert "journal_mode" in status["mismatches"]
+    assert "synchronous" in status["mismatches"]
+    engine.dispose()
+
+def test_profile_selected_from_environment(monkeypatch):
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT", "250")
+    pragmas = sqlite_pragmas("durable")
+    assert pragmas["synchronous"] == "FULL"
+    assert pragmas["busy_timeout"] == "250"
+    with pytest.raises(ValueError):
+        sqlite_pragmas("turbo")
+
+def test_database_url_from_environment(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgres://attendance:secret@db:5432/attendance")
+    assert get_database_url() == "postgresql://attendance:secret@db:5432/attendance"
+    monkeypatch.delenv("DATABASE_URL")
+    assert get_database_url().startswith("sqlite:///")
+
+def test_server_backends_get_a_pinging_queue_pool():
+    pytest.importorskip("psycopg2")
+    engine = create_database_engine("postgresql://attendance@localhost/attendance")
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool._pre_ping
+    assert engine.pool._recycle == DB_POOL_RECYCLE
+    assert engine.pool.size() == DB_POOL_SIZE
+
+def test_attendance_round_trip_on_each_backend(backend_engine):
+    db = sessionmaker(bind=backend_engine)()
+    try:
+        lecturer = User(username="lecturer", email="lecturer@test.com", role=UserRole.LECTURER)
+        student = User(username="student", email="student@test.com", role=UserRole.STUDENT)
+        db.add_all([lecturer, student])
+        db.flush()
+        unit = Unit(code="DB101", name="Databases", lecturer_id=lecturer.id)
+        db.add(unit)
+        db.flush()
+        session = ClassSession(unit_id=unit.id, lecturer_id=lecturer.id, beacon_id="db101",
+                               started_at=datetime(2024, 3, 1, 9))
+        db.add_all([Enrollment(user_id=student.id, unit_id=unit.id), session])
+        db.flush()
+        db.add(Attendance(user_id=student.id, unit_id=unit.id, session_id=session.id,
+                          attendance_type=AttendanceType.BLUETOOTH, marked_at=datetime(2024, 3, 1, 9)))
+        db.commit()
+
+        counts = db.query(Attendance.unit_id, func.count(Attendance.id)).group_by(Attendance.unit_id).all()
+        assert counts == [(unit.id, 1)]
+
+        # The per-session unique index holds on every backend
+        db.add(Attendance(user_id=student.id, unit_id=unit.id, session_id=session.id,
+                          attendance_type=AttendanceType.MANUAL, marked_at=datetime(2024, 3, 1, 14)))
+        with pytest.raises(IntegrityError):
+            db.commit()
+        db.rollback()
+    finally:
+        db.close()
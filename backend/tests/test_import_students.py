@@ -0,0 +1,74 @@
+import csv
+from models import User, Unit, Enrollment, UserRole
+from password_hashing import pwd_context
+from scripts.import_students import import_students, save_checkpoint
+
+FIELDS = ["admission_number", "email", "bluetooth_address", "units", "full_name"]
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        writer.writerows(rows)
+
+def seed_units(db):
+    lecturer = User(username="importlecturer", email="importlecturer@test.com", role=UserRole.LECTURER)
+    db.add(lecturer)
+    db.flush()
+    db.add_all([Unit(code=code, name=code, lecturer_id=lecturer.id) for code in ("CS101", "CS102")])
+    db.commit()
+
+def test_import_validates_deduplicates_and_enrolls(memory_db, tmp_path):
+    seed_units(memory_db)
+    csv_path = str(tmp_path / "intake.csv")
+    write_csv(csv_path, [
+        ["2024/01/0001/01/01", "one@test.com", "00:11:22:33:66:01", "CS101;CS102", "Student One"],
+        ["2024/01/0002/01/01", "two@test.com", "00:11:22:33:66:02", "CS101", "Student Two"],
+        ["2024/01/0001/01/01", "again@test.com", "00:11:22:33:66:03", "CS101", "Duplicate admission"],
+        ["2024/01/0004/01/01", "four@test.com", "not-a-mac", "CS101", "Bad address"],
+        ["2024/01/0005/01/01", "five@test.com", "00:11:22:33:66:05", "CS999", "Unknown unit"],
+    ])
+
+    results = import_students(memory_db, csv_path, default_password="welcome1", batch_size=2, workers=0)
+
+    assert results["imported"] == 2
+    assert results["rejected"] == 3
+    assert results["enrollments"] == 3
+    one = memory_db.query(User).filter(User.admission_number == "2024/01/0001/01/01").one()
+    assert one.username == "one@test.com"
+    assert pwd_context.verify("welcome1", one.hashed_password)
+    assert memory_db.query(Enrollment).filter(Enrollment.user_id == one.id).count() == 2
+    with open(results["rejects_file"]) as f:
+        reasons = [row["error"] for row in csv.DictReader(f)]
+    assert len(reasons) == 3
+    assert "Duplicate admission number" in reasons[0]
+
+    # Starting over replaces the rejects file instead of appending to it
+    results = import_students(memory_db, csv_path, default_password="welcome1", workers=0,
+                              checkpoint_path=str(tmp_path / "fresh.checkpoint"))
+    with open(results["rejects_file"]) as f:
+        assert len(list(csv.DictReader(f))) == results["rejected"] == 3
+
+def test_import_resumes_from_checkpoint(memory_db, tmp_path):
+    seed_units(memory_db)
+    csv_path = str(tmp_path / "intake.csv")
+    write_csv(csv_path, [
+        [f"2024/01/000{i}/01/01", f"s{i}@test.com", f"00:11:22:33:77:0{i}", "CS101", f"Student {i}"]
+        for i in range(4)
+    ])
+    # A previous run committed the first two rows and then died
+    save_checkpoint(f"{csv_path}.checkpoint", 2)
+
+    results = import_students(memory_db, csv_path, default_password="welcome1", workers=0)
+    assert results["resumed_from"] == 2
+    assert results["imported"] == 2
+    assert {username for (username,) in memory_db.query(User.username).filter(User.role == UserRole.STUDENT)} == {
+        "s2@test.com", "s3@test.com"
+    }
+
+    # Re-running from scratch skips what is already there instead of failing
+    results = import_students(memory_db, csv_path, default_password="welcome1", workers=0,
+                              checkpoint_path=str(tmp_path / "fresh.checkpoint"))
+    assert results["existing"] == 2
+    assert results["imported"] == 2
+    assert results["rejected"] == 0
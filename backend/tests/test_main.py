@@ -1,29 +1,16 @@
+import jwt
 import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
 from datetime import datetime, timedelta
-from main import app, get_db
 from database import Base
-from models import User, Unit, Enrollment, Attendance, UserRole, AttendanceType
+from models import User, Unit, Enrollment, Attendance, ClassSession, UserRole, AttendanceType
 from passlib.context import CryptContext
+from attendance_counters import rebuild_attendance_counters
+from query_profiler import assert_max_queries
+from schemas import CompactLecturerAttendance
 
-# Test database setup
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-app.dependency_overrides[get_db] = override_get_db
-
-# Test client
-client = TestClient(app)
+# The test database the client fixture's requests run against
+from conftest import engine, TestingSessionLocal
 
 # Test data
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -125,6 +112,69 @@ def test_login(client, test_student):
     assert "access_token" in data
     assert data["token_type"] == "bearer"
 
+def test_authenticated_requests_use_principal_cache(client, test_lecturer):
+    from user_cache import principal_cache
+    token = get_test_token(client, "testlecturer")
+    payload = jwt.decode(token, options={"verify_signature": False})
+    assert payload["uid"] == test_lecturer.id
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/users/me", headers=headers).status_code == 200
+    queries = []
+    listen = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(engine, "before_cursor_execute", listen)
+    try:
+        response = client.get("/users/me", headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", listen)
+    assert response.status_code == 200
+    assert queries == []
+    assert principal_cache.hits == 1
+
+    # Updating the profile invalidates the cached principal
+    response = client.put("/users/me", headers=headers, json={"full_name": "Renamed Lecturer"})
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=headers).json()["full_name"] == "Renamed Lecturer"
+
+def test_login_returns_503_when_password_hashing_is_saturated(client, test_student, monkeypatch):
+    from main import password_hasher
+    from password_hashing import PasswordHasherSaturated
+
+    async def saturated(*args):
+        raise PasswordHasherSaturated("queue full")
+    monkeypatch.setattr(password_hasher, "verify", saturated)
+
+    response = client.post("/token", data={"username": "teststudent", "password": "testpassword"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+
+def test_register_hashes_on_the_bounded_pool(client, monkeypatch):
+    from main import password_hasher
+    from password_hashing import PasswordHasherSaturated
+    registration = {
+        "username": "pooled",
+        "email": "pooled@test.com",
+        "password": "testpassword",
+        "role": "LECTURER"
+    }
+    hashed = []
+    original_hash = password_hasher.hash
+    async def counting_hash(password):
+        hashed.append(password)
+        return await original_hash(password)
+    monkeypatch.setattr(password_hasher, "hash", counting_hash)
+    response = client.post("/register", json=registration)
+    assert response.status_code == 200
+    assert hashed == ["testpassword"]
+    assert client.post("/token", data={"username": "pooled", "password": "testpassword"}).status_code == 200
+
+    async def saturated(*args):
+        raise PasswordHasherSaturated("queue full")
+    monkeypatch.setattr(password_hasher, "hash", saturated)
+    response = client.post("/register", json=dict(registration, username="pooled2", email="pooled2@test.com"))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+
 def test_create_unit(client, test_lecturer):
     token = get_test_token(client, "testlecturer")
     response = client.post("/units", 
@@ -139,6 +189,22 @@ def test_create_unit(client, test_lecturer):
     assert data["code"] == "TEST101"
     assert data["name"] == "Test Unit"
 
+def test_unit_listings_run_a_fixed_number_of_queries(client, test_lecturer, test_student, test_db):
+    units = [Unit(code=f"LIST{i}", name=f"Listing {i}", lecturer_id=test_lecturer.id) for i in range(6)]
+    test_db.add_all(units)
+    test_db.commit()
+    test_db.add_all([Enrollment(user_id=test_student.id, unit_id=unit.id) for unit in units[:4]])
+    test_db.commit()
+    headers = {"Authorization": f"Bearer {get_test_token(client, 'teststudent')}"}
+    client.get("/units", headers=headers)  # warm the principal cache
+
+    expected = {"/units": 4, "/enrolled-units": 4, "/enrollments/student": 4, "/units/available": 2}
+    for path, count in expected.items():
+        with assert_max_queries(1, engine, label=path):
+            response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == count
+
 def test_enroll_in_unit(client, test_student, test_unit):
     token = get_test_token(client, "teststudent")
     response = client.post(f"/enroll/{test_unit.id}", 
@@ -156,6 +222,8 @@ def test_mark_attendance(client, test_student, test_unit, test_db):
     
     # Create a valid beacon ID
     beacon_id = f"1_{test_unit.id}_{datetime.utcnow().timestamp()}"
+    test_db.add(ClassSession(unit_id=test_unit.id, lecturer_id=test_unit.lecturer_id, beacon_id=beacon_id))
+    test_db.commit()
     
     response = client.post("/bluetooth/mark-attendance",
         params={"beacon_id": beacon_id},
@@ -183,6 +251,45 @@ def test_health_check(client):
     assert "metrics" in data
     assert "database" in data["metrics"]
     assert "bluetooth_scanner" in data["metrics"]
+    assert data["metrics"]["database_profile"]["verified"]
+    # Unauthenticated, so pool, cache and stream internals stay in /metrics
+    for internal in ("password_hashing", "principal_cache", "attendance_streams"):
+        assert internal not in data["metrics"]
+
+def test_health_check_is_cached(client):
+    from main import database_health
+    database_health.invalidate()
+    checks = database_health.checks_run
+    for _ in range(5):
+        assert client.get("/health").json()["status"] == "healthy"
+    assert database_health.checks_run == checks + 1
+
+def test_metrics_endpoint(client, test_lecturer, test_unit, monkeypatch):
+    from metrics import http_requests, http_request_queries
+    labels = {"method": "GET", "route": "/attendance/lecturer/report"}
+    requests_before = http_requests.value(status="200", **labels)
+    queries_before = http_request_queries.sum(**labels)
+    token = get_test_token(client, "testlecturer")
+    response = client.get("/attendance/lecturer/report", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert http_requests.value(status="200", **labels) == requests_before + 1
+    assert http_request_queries.sum(**labels) > queries_before
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/attendance/lecturer/report",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/attendance/lecturer/report",le="+Inf"}' in body
+    assert "scanner_dedup_hit_ratio" in body
+    assert "scanner_queue_depth 0" in body
+    assert "database_profile_verified 1" in body
+    assert "password_hash_latency_p99_seconds" in body
+    assert "principal_cache_entries" in body
+
+    monkeypatch.setattr("main.METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
 
 def test_debug_bluetooth(client):
     response = client.get("/debug/bluetooth")
@@ -190,4 +297,412 @@ def test_debug_bluetooth(client):
     data = response.json()
     assert "scanner_status" in data
     assert "detected_devices" in data
-    assert isinstance(data["detected_devices"], list) 
\ No newline at end of file
+    assert isinstance(data["detected_devices"], list) 
+@pytest.mark.asyncio
+async def test_run_in_db_uses_database_pool():
+    import threading
+    from database import run_in_db
+    thread_name = await run_in_db(lambda: threading.current_thread().name)
+    assert thread_name.startswith("db")
+
+def test_get_student_attendance_with_records(client, test_student, test_unit, test_db):
+    test_student.admission_number = "2023/01/1234/01/01"
+    test_db.add(Enrollment(user_id=test_student.id, unit_id=test_unit.id))
+    test_db.add(Attendance(user_id=test_student.id, unit_id=test_unit.id, attendance_type=AttendanceType.MANUAL))
+    test_db.commit()
+    rebuild_attendance_counters(test_db)
+    token = get_test_token(client, "teststudent")
+    response = client.get("/attendance/student",
+        params={"records": "true"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["unit_code"] == "TEST101"
+    assert data[0]["attended_classes"] == 1
+    assert len(data[0]["attendance_records"]) == 1
+
+def test_get_student_attendance_counts_only(client, test_student, test_unit, test_db):
+    other_unit = Unit(code="TEST102", name="Other Unit", lecturer_id=test_unit.lecturer_id)
+    test_db.add(other_unit)
+    test_db.commit()
+    test_student.admission_number = "2023/01/1234/01/01"
+    test_db.add_all([
+        Enrollment(user_id=test_student.id, unit_id=test_unit.id),
+        Enrollment(user_id=test_student.id, unit_id=other_unit.id),
+        Attendance(user_id=test_student.id, unit_id=test_unit.id, attendance_type=AttendanceType.MANUAL,
+                   marked_at=datetime(2024, 3, 1, 9, 0)),
+        Attendance(user_id=test_student.id, unit_id=test_unit.id, attendance_type=AttendanceType.BLUETOOTH,
+                   marked_at=datetime(2024, 3, 8, 9, 0)),
+    ])
+    test_db.commit()
+    rebuild_attendance_counters(test_db)
+    token = get_test_token(client, "teststudent")
+    response = client.get("/attendance/student",
+        params={"records": "false"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    data = {summary["unit_code"]: summary for summary in response.json()}
+    assert data["TEST101"]["attended_classes"] == 2
+    assert data["TEST102"]["attended_classes"] == 0
+    assert data["TEST101"]["attendance_records"] == []
+
+    response = client.get("/attendance/student",
+        params={"records": "true", "records_limit": 1},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    data = {summary["unit_code"]: summary for summary in response.json()}
+    assert data["TEST101"]["attended_classes"] == 2
+    assert len(data["TEST101"]["attendance_records"]) == 1
+
+    # Callers that don't ask still get the records, as before
+    response = client.get("/attendance/student", headers={"Authorization": f"Bearer {token}"})
+    data = {summary["unit_code"]: summary for summary in response.json()}
+    assert len(data["TEST101"]["attendance_records"]) == 2
+
+def _seed_lecturer_attendance(test_db, test_lecturer, test_unit, test_student):
+    other = create_test_user(test_db, "otherstudent", UserRole.STUDENT, "00:11:22:33:44:66")
+    test_db.add_all([
+        Enrollment(user_id=test_student.id, unit_id=test_unit.id),
+        Enrollment(user_id=other.id, unit_id=test_unit.id),
+    ])
+    # Four classes held; the student attended the first three
+    sessions = [
+        ClassSession(unit_id=test_unit.id, lecturer_id=test_lecturer.id, started_at=datetime(2024, 3, day, 9, 0))
+        for day in (1, 2, 3, 4)
+    ]
+    test_db.add_all(sessions)
+    test_db.flush()
+    for session in sessions[:3]:
+        test_db.add(Attendance(
+            user_id=test_student.id,
+            unit_id=test_unit.id,
+            session_id=session.id,
+            attendance_type=AttendanceType.MANUAL,
+            marked_at=session.started_at.replace(minute=30)
+        ))
+    test_db.commit()
+    rebuild_attendance_counters(test_db)
+    return other
+
+def test_lecturer_attendance_report(client, test_lecturer, test_unit, test_student, test_db):
+    other = _seed_lecturer_attendance(test_db, test_lecturer, test_unit, test_student)
+    token = get_test_token(client, "testlecturer")
+    response = client.get("/attendance/lecturer/report",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert len(report) == 1
+    students = {student["user_id"]: student for student in report[0]["students"]}
+    assert students[test_student.id]["attended_classes"] == 3
+    assert students[test_student.id]["total_classes"] == 4
+    assert students[test_student.id]["percentage"] == 75.0
+    assert students[other.id]["attended_classes"] == 0
+    assert report[0]["attended_classes"] == 3
+    assert report[0]["total_classes"] == 4
+    assert report[0]["percentage"] == 37.5
+
+    response = client.get("/attendance/lecturer/report",
+        params={"date": "2024-03-02"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    students = {student["user_id"]: student for student in response.json()[0]["students"]}
+    assert students[test_student.id]["attended_classes"] == 1
+    assert students[test_student.id]["percentage"] == 100.0
+
+def test_lecturer_attendance_loads_students_eagerly(client, test_lecturer, test_unit, test_student, test_db):
+    other = _seed_lecturer_attendance(test_db, test_lecturer, test_unit, test_student)
+    # The full response validates each record's user as a registered student
+    test_student.admission_number = "2023/01/1234/02/01"
+    other.admission_number = "2023/01/1234/02/02"
+    second_unit = Unit(code="TEST103", name="Second Unit", lecturer_id=test_lecturer.id)
+    test_db.add(second_unit)
+    test_db.flush()
+    session = ClassSession(unit_id=second_unit.id, lecturer_id=test_lecturer.id, started_at=datetime(2024, 3, 5, 9, 0))
+    test_db.add(session)
+    test_db.flush()
+    for student in (test_student, other):
+        test_db.add(Attendance(
+            user_id=student.id, unit_id=second_unit.id, session_id=session.id,
+            attendance_type=AttendanceType.MANUAL, marked_at=datetime(2024, 3, 5, 9, 30)
+        ))
+    test_db.commit()
+    headers = {"Authorization": f"Bearer {get_test_token(client, 'testlecturer')}"}
+    client.get("/units", headers=headers)  # warm the principal cache
+
+    # Units, sessions held and the records joined to their students
+    with assert_max_queries(3, engine, label="/attendance/lecturer"):
+        response = client.get("/attendance/lecturer", headers=headers)
+    assert response.status_code == 200
+    summaries = {summary["unit_code"]: summary for summary in response.json()}
+    assert [record["user"]["username"] for record in summaries["TEST101"]["attendance_records"]] == ["teststudent"] * 3
+    assert summaries["TEST101"]["attendance_records"][0]["percentage"] == 75.0
+    assert len(summaries["TEST103"]["attendance_records"]) == 2
+
+    # The compact variant lists each student once for the whole response
+    with assert_max_queries(4, engine, label="/attendance/lecturer/compact"):
+        response = client.get("/attendance/lecturer/compact", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    # Not validated on the way out, so check it still matches the documented schema
+    CompactLecturerAttendance.model_validate(data)
+    assert set(data["students"]) == {str(test_student.id), str(other.id)}
+    assert data["students"][str(other.id)]["username"] == "otherstudent"
+    units = {unit["unit_code"]: unit for unit in data["units"]}
+    assert units["TEST101"]["percentage"] == 75.0
+    assert units["TEST101"]["students"] == [
+        {"user_id": test_student.id, "attended_classes": 3, "percentage": 75.0}
+    ]
+    assert all("user" not in record for record in units["TEST101"]["attendance_records"])
+    assert units["TEST101"]["attendance_records"][0]["marked_at"] == "2024-03-01T09:30:00"
+    assert {record["user_id"] for record in units["TEST103"]["attendance_records"]} == {test_student.id, other.id}
+
+    response = client.get("/attendance/lecturer/compact", params={"date": "2024-03-05"}, headers=headers)
+    assert set(response.json()["students"]) == {str(test_student.id), str(other.id)}
+    assert [unit["attended_classes"] for unit in response.json()["units"]] == [0, 2]
+
+def test_lecturer_attendance_records_keyset_pagination(client, test_lecturer, test_unit, test_student, test_db):
+    _seed_lecturer_attendance(test_db, test_lecturer, test_unit, test_student)
+    token = get_test_token(client, "testlecturer")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    first = client.get("/attendance/lecturer/records", params={"limit": 2}, headers=headers).json()
+    assert len(first["records"]) == 2
+    assert first["next_cursor"] == first["records"][-1]["id"]
+
+    second = client.get("/attendance/lecturer/records",
+        params={"limit": 2, "after_id": first["next_cursor"]},
+        headers=headers
+    ).json()
+    assert len(second["records"]) == 1
+    assert second["next_cursor"] is None
+
+    response = client.get("/attendance/lecturer/records", params={"date": "03/01/2024"}, headers=headers)
+    assert response.status_code == 400
+
+def _seed_register(test_db, test_unit, count):
+    """count students with admission numbers; all but the last enrolled in test_unit"""
+    students = []
+    for i in range(count):
+        student = create_test_user(test_db, f"register{i}", UserRole.STUDENT, f"00:11:22:33:55:{i:02X}")
+        student.admission_number = f"2023/01/1234/01/{i:02d}"
+        students.append(student)
+    test_db.add_all([Enrollment(user_id=student.id, unit_id=test_unit.id) for student in students[:-1]])
+    test_db.commit()
+    return students
+
+def test_bulk_manual_attendance(client, test_lecturer, test_unit, test_db):
+    students = _seed_register(test_db, test_unit, 6)
+    broadcast = ClassSession(unit_id=test_unit.id, lecturer_id=test_unit.lecturer_id, beacon_id="bulk-beacon")
+    test_db.add(broadcast)
+    test_db.flush()
+    test_db.add(Attendance(user_id=students[0].id, unit_id=test_unit.id, session_id=broadcast.id,
+                           attendance_type=AttendanceType.BLUETOOTH, marked_at=datetime.utcnow()))
+    test_db.commit()
+    token = get_test_token(client, "testlecturer")
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/units", headers=headers)  # warm the principal cache
+
+    unit_id = test_unit.id
+    numbers = [student.admission_number for student in students] + [
+        students[1].admission_number, "2099/01/0000/01/01", "not-a-number"
+    ]
+    queries = []
+    listen = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(engine, "before_cursor_execute", listen)
+    try:
+        response = client.post("/attendance/manual/bulk", headers=headers,
+                               json={"unit_id": unit_id, "admission_numbers": numbers})
+    finally:
+        event.remove(engine, "before_cursor_execute", listen)
+    assert response.status_code == 200
+    result = response.json()
+    assert [outcome["status"] for outcome in result["outcomes"]] == [
+        "already_marked", "marked", "marked", "marked", "marked", "not_enrolled",
+        "duplicate", "not_found", "invalid"
+    ]
+    assert result["marked"] == 4
+    # Unit, students, enrollments, today's session, existing attendance, one insert,
+    # one counter upsert; not one round trip per row
+    assert len(queries) <= 7
+    assert test_db.query(Attendance).filter(Attendance.unit_id == test_unit.id).count() == 5
+    # The register joined the class the broadcast opened
+    assert test_db.query(ClassSession).count() == 1
+    assert test_db.query(Attendance).filter(Attendance.session_id == broadcast.id).count() == 5
+
+def test_bulk_manual_attendance_csv_upload(client, test_lecturer, test_unit, test_db):
+    students = _seed_register(test_db, test_unit, 3)
+    token = get_test_token(client, "testlecturer")
+    register = "name,admission_number\n" + "".join(
+        f"{student.username},{student.admission_number}\n" for student in students
+    )
+    response = client.post(
+        "/attendance/manual/bulk/csv",
+        headers={"Authorization": f"Bearer {token}"},
+        data={"unit_id": str(test_unit.id), "date": "2024-03-04"},
+        files={"file": ("register.csv", register, "text/csv")}
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["date"] == "2024-03-04"
+    assert [outcome["status"] for outcome in result["outcomes"]] == ["marked", "marked", "not_enrolled"]
+    marked_at = test_db.query(Attendance.marked_at).filter(Attendance.unit_id == test_unit.id).first()[0]
+    assert marked_at.date().isoformat() == "2024-03-04"
+
+def test_export_attendance_csv(client, test_lecturer, test_unit, test_student, test_db):
+    _seed_lecturer_attendance(test_db, test_lecturer, test_unit, test_student)
+    token = get_test_token(client, "testlecturer")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/attendance/export?start=2024-03-02&end=2024-03-03",
+                          headers={**headers, "Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "content-encoding" not in response.headers
+    lines = response.text.strip().splitlines()
+    assert lines[0].startswith("attendance_id,marked_at,unit_code")
+    assert len(lines) == 3
+    assert all(",TEST101," in line and ",teststudent," in line for line in lines[1:])
+
+    # gzip is negotiated from Accept-Encoding (the client decompresses transparently)
+    response = client.get("/attendance/export", headers={**headers, "Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.strip().splitlines()) == 4
+
+    assert client.get("/attendance/export?unit_id=9999", headers=headers).status_code == 404
+
+def test_attendance_counters_follow_every_write_path(client, test_lecturer, test_unit, test_db):
+    from models import AttendanceCounter
+    students = _seed_register(test_db, test_unit, 3)
+    token = get_test_token(client, "testlecturer")
+    headers = {"Authorization": f"Bearer {token}"}
+    unit_id = test_unit.id
+
+    client.post("/attendance/manual", headers=headers,
+                json={"unit_id": unit_id, "admission_number": students[0].admission_number})
+    client.post("/attendance/manual/bulk", headers=headers, json={
+        "unit_id": unit_id, "date": "2024-03-04",
+        "admission_numbers": [students[0].admission_number, students[1].admission_number]
+    })
+    counters = dict(test_db.query(AttendanceCounter.user_id, AttendanceCounter.attended).filter(
+        AttendanceCounter.unit_id == unit_id
+    ).all())
+    assert counters == {students[0].id: 2, students[1].id: 1}
+
+    # The rebuild recomputes the same numbers from the raw rows
+    test_db.query(AttendanceCounter).delete()
+    test_db.commit()
+    assert rebuild_attendance_counters(test_db) == 2
+    assert dict(test_db.query(AttendanceCounter.user_id, AttendanceCounter.attended).all()) == counters
+
+def test_manual_mark_losing_a_race_returns_the_existing_record(client, test_lecturer, test_unit, test_db):
+    [student] = _seed_register(test_db, test_unit, 2)[:1]
+    headers = {"Authorization": f"Bearer {get_test_token(client, 'testlecturer')}"}
+    class_session = ClassSession(unit_id=test_unit.id, lecturer_id=test_lecturer.id, started_at=datetime.utcnow())
+    test_db.add(class_session)
+    test_db.commit()
+    session_id = class_session.id
+
+    # The scanner writes the student's row between the duplicate check and the insert
+    raced = []
+    def scanner_marks_first(session, flush_context, instances):
+        if raced or not any(isinstance(obj, Attendance) for obj in session.new):
+            return
+        raced.append(True)
+        other = TestingSessionLocal()
+        other.add(Attendance(user_id=student.id, unit_id=test_unit.id, session_id=session_id,
+                             attendance_type=AttendanceType.BLUETOOTH))
+        other.commit()
+        other.close()
+    event.listen(TestingSessionLocal, "before_flush", scanner_marks_first)
+    try:
+        response = client.post("/attendance/manual", headers=headers,
+                               json={"unit_id": test_unit.id, "admission_number": student.admission_number})
+    finally:
+        event.remove(TestingSessionLocal, "before_flush", scanner_marks_first)
+    assert raced
+    assert response.status_code == 200
+    assert response.json()["attendance_type"] == "BLUETOOTH"
+    assert response.json()["session_id"] == session_id
+    assert test_db.query(Attendance).filter(Attendance.user_id == student.id).count() == 1
+
+def test_percentages_follow_sessions_held(client, test_lecturer, test_unit, test_db, monkeypatch):
+    import main
+    students = _seed_register(test_db, test_unit, 3)
+    started = []
+    async def fake_start_scanner(broadcast_info):
+        started.append(broadcast_info)
+    monkeypatch.setattr(main, "start_scanner", fake_start_scanner)
+    token = get_test_token(client, "testlecturer")
+    headers = {"Authorization": f"Bearer {token}"}
+    unit_id = test_unit.id
+
+    # Two broadcasts are two classes, even on the same day
+    for _ in range(2):
+        response = client.post("/bluetooth/start-broadcast", headers=headers, json={"unit_id": unit_id})
+        assert response.status_code == 200
+        assert response.json()["session_id"] == started[-1]["session_id"]
+    sessions = test_db.query(ClassSession).filter(ClassSession.unit_id == unit_id).order_by(ClassSession.id).all()
+    assert [session.beacon_id for session in sessions] == [info["beacon_id"] for info in started]
+
+    # A manual mark joins the latest class of the day, once per student
+    manual = {"unit_id": unit_id, "admission_number": students[0].admission_number}
+    response = client.post("/attendance/manual", headers=headers, json=manual)
+    assert response.json()["session_id"] == sessions[-1].id
+    assert client.post("/attendance/manual", headers=headers, json=manual).status_code == 400
+
+    report = client.get("/attendance/lecturer/report", headers=headers).json()[0]
+    stats = {student["user_id"]: student for student in report["students"]}
+    assert report["total_classes"] == 2
+    assert stats[students[0].id]["attended_classes"] == 1
+    assert stats[students[0].id]["percentage"] == 50.0
+    assert stats[students[1].id]["percentage"] == 0.0
+
+    # A day with no broadcast opens a session of its own
+    client.post("/attendance/manual/bulk", headers=headers, json={
+        "unit_id": unit_id, "date": "2024-03-04", "admission_numbers": [students[1].admission_number]
+    })
+    report = client.get("/attendance/lecturer/report", headers=headers).json()[0]
+    assert report["total_classes"] == 3
+    day = client.get("/attendance/lecturer/report", params={"date": "2024-03-04"}, headers=headers).json()[0]
+    stats = {student["user_id"]: student for student in day["students"]}
+    assert day["total_classes"] == 1
+    assert stats[students[1].id]["percentage"] == 100.0
+
+def test_session_event_stream(client, test_lecturer, test_unit, test_db):
+    students = _seed_register(test_db, test_unit, 3)
+    session = ClassSession(unit_id=test_unit.id, lecturer_id=test_lecturer.id, beacon_id="stream-beacon",
+                           ended_at=datetime.utcnow())
+    test_db.add(session)
+    test_db.flush()
+    test_db.add_all([
+        Attendance(user_id=student.id, unit_id=test_unit.id, session_id=session.id,
+                   attendance_type=AttendanceType.BLUETOOTH)
+        for student in students[:2]
+    ])
+    test_db.commit()
+    token = get_test_token(client, "testlecturer")
+
+    # The broadcast has ended, so the stream is the marks so far and an end event
+    response = client.get("/bluetooth/sessions/stream-beacon/events", params={"access_token": token})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block.startswith("event:")]
+    assert [block.splitlines()[0] for block in events] == ["event: marked", "event: marked", "event: end"]
+    assert f'"username": "{students[0].username}"' in events[0]
+
+    # Reconnecting with Last-Event-ID only replays what came after it
+    first_id = events[0].splitlines()[1].split(": ")[1]
+    response = client.get("/bluetooth/sessions/stream-beacon/events",
+                          headers={"Authorization": f"Bearer {token}", "Last-Event-ID": first_id})
+    assert response.text.count("event: marked") == 1
+
+    assert client.get("/bluetooth/sessions/stream-beacon/events").status_code == 401
+    assert client.get("/bluetooth/sessions/unknown/events", params={"access_token": token}).status_code == 404
+    create_test_user(test_db, "otherlecturer", UserRole.LECTURER)
+    other_token = get_test_token(client, "otherlecturer")
+    response = client.get("/bluetooth/sessions/stream-beacon/events", params={"access_token": other_token})
+    assert response.status_code == 403
@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from database import run_in_db
+from metrics import (
+    CachedHealthCheck, MetricsRegistry, RequestQueryStats, current_request_queries, instrument_sqlalchemy
+)
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("route",))
+    latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    requests.inc(route="/units")
+    requests.inc(route="/units")
+    latency.observe(0.05, route="/units")
+    latency.observe(0.5, route="/units")
+    latency.observe(5, route="/units")
+    assert registry.counter("requests_total", "Requests", ("route",)) is requests
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="/units"} 2' in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{route="/units",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/units",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/units",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{route="/units"} 5.55' in lines
+    assert 'latency_seconds_count{route="/units"} 3' in lines
+
+    with pytest.raises(ValueError):
+        requests.inc(path="/units")
+
+def test_cached_health_check_reaches_the_database_once_per_ttl():
+    calls = []
+    health = CachedHealthCheck(lambda: calls.append(1), ttl_seconds=60)
+    for _ in range(50):
+        assert health.run()["healthy"]
+    assert len(calls) == 1
+
+    def down():
+        raise RuntimeError("database is locked")
+    health = CachedHealthCheck(down, ttl_seconds=0)
+    result = health.run()
+    assert not result["healthy"]
+    assert result["error"] == "database is locked"
+    health.run()
+    assert health.checks_run == 2
+
+@pytest.mark.asyncio
+async def test_queries_on_the_db_pool_count_towards_the_request(memory_db):
+    instrument_sqlalchemy()
+    stats = RequestQueryStats()
+    token = current_request_queries.set(stats)
+    try:
+        await run_in_db(lambda: memory_db.execute(text("SELECT 1")))
+        await run_in_db(lambda: memory_db.execute(text("SELECT 2")))
+    finally:
+        current_request_queries.reset(token)
+    assert stats.queries == 2
+    assert stats.seconds > 0
+
+def test_failed_statements_leave_no_start_time_behind(memory_db):
+    instrument_sqlalchemy()
+    for _ in range(3):
+        with pytest.raises(OperationalError):
+            memory_db.execute(text("SELECT * FROM no_such_table"))
+        memory_db.rollback()
+    memory_db.execute(text("SELECT 1"))
+    assert memory_db.connection().info.get("metrics_query_start") == []
@@ -0,0 +1,126 @@
+import json
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import User, Unit, Enrollment, Attendance, UserRole, AttendanceType
+from migrations.add_attendance_indexes import DuplicateRowsError, upgrade, downgrade
+
+HOT_QUERIES = {
+    "attendance_by_student": (
+        "SELECT id FROM attendances WHERE user_id = 1 AND unit_id = 1 AND marked_at >= '2024-01-01'",
+        "ix_attendances_user_unit_marked"
+    ),
+    "attendance_by_unit": (
+        "SELECT id FROM attendances WHERE unit_id = 1 AND marked_at >= '2024-01-01' AND marked_at < '2024-01-02'",
+        "ix_attendances_unit_marked"
+    ),
+    "enrollment_pair": (
+        "SELECT id FROM enrollments WHERE user_id = 1 AND unit_id = 1",
+        "uq_enrollments_user_unit"
+    ),
+    "student_by_address": (
+        "SELECT id FROM users WHERE bluetooth_address = '00:11:22:33:44:55'",
+        "ix_users_bluetooth_address"
+    ),
+}
+
+@pytest.fixture
+def legacy_engine():
+    """A database with today's tables but none of the migration's indexes"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    downgrade(engine)
+    yield engine
+    engine.dispose()
+
+def query_plan(engine, sql):
+    with engine.connect() as connection:
+        return " ".join(row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+def test_query_plans_use_new_indexes(legacy_engine):
+    before = {name: query_plan(legacy_engine, sql) for name, (sql, _) in HOT_QUERIES.items()}
+    upgrade(legacy_engine)
+    after = {name: query_plan(legacy_engine, sql) for name, (sql, _) in HOT_QUERIES.items()}
+
+    for name, (_, index_name) in HOT_QUERIES.items():
+        assert index_name not in before[name], before[name]
+        assert index_name in after[name], after[name]
+    assert before["attendance_by_unit"].startswith("SCAN")
+
+def test_upgrade_refuses_duplicates_unless_told_to_save_and_remove_them(legacy_engine, tmp_path):
+    db = sessionmaker(bind=legacy_engine)()
+    student = User(username="dup", email="dup@test.com", role=UserRole.STUDENT)
+    unit = Unit(code="DUP101", name="Duplicates", lecturer_id=1)
+    db.add_all([student, unit])
+    db.commit()
+    db.add_all([
+        Enrollment(user_id=student.id, unit_id=unit.id),
+        Enrollment(user_id=student.id, unit_id=unit.id),
+        Attendance(user_id=student.id, unit_id=unit.id, attendance_type=AttendanceType.MANUAL,
+                   marked_at=datetime(2024, 1, 1, 9)),
+        Attendance(user_id=student.id, unit_id=unit.id, attendance_type=AttendanceType.BLUETOOTH,
+                   marked_at=datetime(2024, 1, 1, 11)),
+        Attendance(user_id=student.id, unit_id=unit.id, attendance_type=AttendanceType.MANUAL,
+                   marked_at=datetime(2024, 1, 2, 9)),
+    ])
+    db.commit()
+
+    # Nothing is deleted or indexed without an explicit request
+    with pytest.raises(DuplicateRowsError, match="1 enrollments, 1 attendances"):
+        upgrade(legacy_engine)
+    assert db.query(Enrollment).count() == 2
+    assert db.query(Attendance).count() == 3
+    assert "uq_enrollments_user_unit" not in query_plan(legacy_engine, HOT_QUERIES["enrollment_pair"][0])
+
+    removed_path = tmp_path / "removed.json"
+    upgrade(legacy_engine, remove_duplicates_to=str(removed_path))
+    assert db.query(Enrollment).count() == 1
+    assert db.query(Attendance).count() == 2
+    removed = json.loads(removed_path.read_text())
+    assert len(removed["enrollments"]) == 1
+    assert [row["attendance_type"] for row in removed["attendances"]] == ["BLUETOOTH"]
+
+    db.add(Attendance(user_id=student.id, unit_id=unit.id, attendance_type=AttendanceType.MANUAL,
+                      marked_at=datetime(2024, 1, 2, 15)))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+    db.close()
+
+def test_class_sessions_upgrade_backfills_sessions_from_attendance():
+    from migrations.add_class_sessions import upgrade as upgrade_sessions, downgrade as downgrade_sessions
+    from class_sessions import sessions_held
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    downgrade_sessions(engine)
+    db = sessionmaker(bind=engine)()
+    first = User(username="first", email="first@test.com", role=UserRole.STUDENT)
+    second = User(username="second", email="second@test.com", role=UserRole.STUDENT)
+    unit = Unit(code="SES101", name="Sessions", lecturer_id=1)
+    db.add_all([first, second, unit])
+    db.commit()
+    db.execute(Attendance.__table__.insert(), [
+        {"user_id": first.id, "unit_id": unit.id, "attendance_type": "MANUAL", "marked_at": datetime(2024, 1, 1, 9)},
+        {"user_id": second.id, "unit_id": unit.id, "attendance_type": "BLUETOOTH", "marked_at": datetime(2024, 1, 1, 10)},
+        {"user_id": first.id, "unit_id": unit.id, "attendance_type": "MANUAL", "marked_at": datetime(2024, 1, 8, 9)},
+    ])
+    db.commit()
+
+    upgrade_sessions(engine)
+    assert sessions_held(db, [unit.id]) == {unit.id: 2}
+    assert db.query(Attendance).filter(Attendance.session_id.is_(None)).count() == 0
+    assert "ix_sessions_unit_started" in query_plan(
+        engine, f"SELECT COUNT(*) FROM sessions WHERE unit_id = {unit.id}"
+    )
+    # A second class on the same day is fine now; a second mark in one session is not
+    session_id = db.query(Attendance.session_id).filter(Attendance.user_id == second.id).scalar()
+    db.add(Attendance(user_id=second.id, unit_id=unit.id, session_id=session_id, attendance_type=AttendanceType.MANUAL))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+    db.close()
+    engine.dispose()
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+import pytest
+from password_hashing import PasswordHasher, PasswordHasherSaturated, pwd_context
+
+@pytest.mark.asyncio
+async def test_verify_and_hash_run_off_the_event_loop():
+    hasher = PasswordHasher(workers=2, max_queue=4)
+    try:
+        hashed = await hasher.hash("secret")
+        assert pwd_context.verify("secret", hashed)
+        assert await hasher.verify("secret", hashed)
+        assert not await hasher.verify("wrong", hashed)
+        assert not await hasher.verify("secret", None)
+        stats = hasher.stats()
+        assert stats["completed"] == 3
+        assert stats["in_flight"] == 0
+    finally:
+        hasher.shutdown()
+
+@pytest.mark.asyncio
+async def test_saturated_pool_rejects_instead_of_queueing_forever():
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = [asyncio.create_task(hasher._run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert hasher.stats()["queued"] == 1
+        with pytest.raises(PasswordHasherSaturated):
+            await hasher._run(release.wait, 5)
+        release.set()
+        await asyncio.gather(*running)
+        stats = hasher.stats()
+        assert stats["rejected"] == 1
+        assert stats["completed"] == 2
+        assert stats["peak_in_flight"] == 2
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import text
+from models import User, UserRole
+from query_profiler import assert_max_queries, profile_queries, statement_shape
+
+def test_statement_shape_ignores_literals_and_in_list_length():
+    assert statement_shape("SELECT * FROM units WHERE id IN (?, ?, ?)") == \
+        statement_shape("SELECT * FROM units\n WHERE id IN (?)")
+    assert statement_shape("SELECT * FROM users WHERE id = 7 AND username = 'ann'") == \
+        "SELECT * FROM users WHERE id = ? AND username = ?"
+
+def test_repeated_statements_are_flagged_as_n_plus_one(memory_db):
+    for i in range(4):
+        memory_db.add(User(username=f"profiled{i}", email=f"profiled{i}@test.com", role=UserRole.STUDENT))
+    memory_db.commit()
+    ids = [user_id for (user_id,) in memory_db.execute(text("SELECT id FROM users"))]
+
+    with profile_queries() as profile:
+        memory_db.expire_all()
+        for user_id in ids:
+            memory_db.get(User, user_id)
+    suspects = profile.n_plus_one_suspects(threshold=3)
+    assert profile.count == 4
+    assert len(suspects) == 1
+    assert suspects[0]["count"] == 4
+    # The call site points at the line in this test that ran the statements
+    [call_site] = suspects[0]["call_sites"]
+    assert call_site.startswith("tests/test_query_profiler.py:")
+    assert "N+1 suspect, 4x" in profile.report(threshold=3)
+
+def test_assert_max_queries_lists_the_statements(memory_db):
+    with assert_max_queries(1):
+        memory_db.execute(text("SELECT 1"))
+
+    with pytest.raises(AssertionError, match="expected at most 1 statements, got 2"):
+        with assert_max_queries(1):
+            memory_db.execute(text("SELECT 1"))
+            memory_db.execute(text("SELECT 2"))
+
+def test_failed_statements_are_recorded_and_release_their_start_time(memory_db):
+    from sqlalchemy.exc import OperationalError
+    with profile_queries() as profile:
+        with pytest.raises(OperationalError):
+            memory_db.execute(text("SELECT * FROM no_such_table"))
+        memory_db.rollback()
+        memory_db.execute(text("SELECT 1"))
+    assert [statement.failed for statement in profile.statements] == [True, False]
+    assert "(failed)" in profile.report()
+    assert memory_db.connection().info.get("query_profiler_start") == []
+
+def test_middleware_logs_statements_streamed_after_the_headers(memory_db, caplog):
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from fastapi.testclient import TestClient
+    from query_profiler import QueryProfilerMiddleware
+
+    app = FastAPI()
+    app.add_middleware(QueryProfilerMiddleware)
+
+    @app.get("/stream")
+    def stream():
+        def rows():
+            yield str(memory_db.execute(text("SELECT 1")).scalar())
+        return StreamingResponse(rows())
+
+    with caplog.at_level("DEBUG", logger="query_profiler"):
+        response = TestClient(app).get("/stream")
+    # The headers were sent before the body ran its statement; the log has it
+    assert response.headers["x-query-count"] == "0"
+    assert "GET /stream: 1 statements" in caplog.text
+    assert "1 statements ran after the response headers" in caplog.text
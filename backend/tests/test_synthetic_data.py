@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from models import User, Unit, Enrollment, Attendance, AttendanceCounter, ClassSession, UserRole
+from password_hashing import pwd_context
+from synthetic_data import SYNTHETIC_PASSWORD, SYNTHETIC_PASSWORD_HASH, generate_institution
+from attendance_counters import rebuild_attendance_counters
+
+def snapshot(db):
+    return (
+        db.query(User.username, User.bluetooth_address, User.admission_number).order_by(User.id).all(),
+        db.query(Enrollment.user_id, Enrollment.unit_id).order_by(Enrollment.user_id, Enrollment.unit_id).all(),
+        db.query(Attendance.user_id, Attendance.session_id, Attendance.marked_at).order_by(Attendance.id).all()
+    )
+
+def test_precomputed_hash_matches_the_password():
+    assert pwd_context.verify(SYNTHETIC_PASSWORD, SYNTHETIC_PASSWORD_HASH)
+
+@pytest.mark.synthetic(students=50, lecturers=2, units=4, units_per_student=2, weeks=3)
+def test_fixture_sizes_and_consistent_rows(memory_db, synthetic_institution):
+    summary = synthetic_institution
+    assert memory_db.query(User).filter(User.role == UserRole.STUDENT).count() == 50
+    assert memory_db.query(Unit).count() == 4
+    assert memory_db.query(Enrollment).count() == summary["enrollments"] == 100
+    assert memory_db.query(ClassSession).count() == summary["sessions"] == 4 * 3 * 2
+    assert memory_db.query(Attendance).count() == summary["attendances"]
+    # Every attendance belongs to an enrollment and a session of the same unit
+    orphans = memory_db.query(Attendance).outerjoin(Enrollment, (Enrollment.user_id == Attendance.user_id) & (
+        Enrollment.unit_id == Attendance.unit_id
+    )).filter(Enrollment.id.is_(None)).count()
+    assert orphans == 0
+    mismatched = memory_db.query(Attendance).join(ClassSession, ClassSession.id == Attendance.session_id).filter(
+        ClassSession.unit_id != Attendance.unit_id
+    ).count()
+    assert mismatched == 0
+    # The generated counters agree with a rebuild from the raw rows
+    counters = dict(((row.user_id, row.unit_id), row.attended) for row in memory_db.query(AttendanceCounter))
+    rebuild_attendance_counters(memory_db)
+    assert counters == dict(((row.user_id, row.unit_id), row.attended) for row in memory_db.query(AttendanceCounter))
+
+def test_same_seed_gives_the_same_rows(tmp_path):
+    snapshots = []
+    for seed in (7, 7, 8):
+        engine = create_engine(f"sqlite:///{tmp_path / f'seed{len(snapshots)}.db'}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        generate_institution(db, students=30, lecturers=2, units=5, weeks=2, seed=seed)
+        snapshots.append(snapshot(db))
+        db.close()
+        engine.dispose()
+    assert snapshots[0] == snapshots[1]
+    assert snapshots[0] != snapshots[2]
+
+def test_institutions_can_share_a_database(memory_db):
+    first = generate_institution(memory_db, students=20, lecturers=1, units=3, weeks=1, prefix="north")
+    second = generate_institution(memory_db, students=20, lecturers=1, units=3, weeks=1, prefix="south")
+    assert second["student_ids"][0] == first["student_ids"][1] + 1
+    assert memory_db.query(func.count(func.distinct(User.bluetooth_address))).scalar() == 40
+    assert memory_db.query(Unit).filter(Unit.code.like("SOUTH%")).count() == 3
+
+def test_bad_sizes_are_rejected_before_anything_is_inserted(memory_db):
+    with pytest.raises(ValueError, match="at least one lecturer"):
+        generate_institution(memory_db, students=10, lecturers=0, units=3)
+    with pytest.raises(ValueError, match="students must not be negative"):
+        generate_institution(memory_db, students=-1)
+    assert memory_db.query(User).count() == 0
@@ -0,0 +1,34 @@
+from sqlalchemy.orm import sessionmaker
+from models import User, UserRole
+from cache_versions import read_version
+from user_cache import PrincipalCache
+
+def test_invalidation_reaches_workers_on_other_hosts(backend_engine):
+    Session = sessionmaker(bind=backend_engine)
+    with Session() as db:
+        user = User(username="cached", email="cached@example.com", full_name="Cached",
+                    hashed_password="x", role=UserRole.STUDENT)
+        db.add(user)
+        db.commit()
+        # Two workers sharing nothing but the database
+        here = PrincipalCache(check_interval=0)
+        there = PrincipalCache(check_interval=0)
+        for cache in (here, there):
+            cache.sync_version(db)
+            cache.put(user)
+
+        user.full_name = "Renamed"
+        db.commit()
+        here.invalidate(user.id, db=db)
+        assert read_version(db, "principals") == 1
+        assert here.get(user.id) is None
+        assert there.get(user.id) is not None
+
+        assert there.version_check_due()
+        there.sync_version(db)
+        assert there.get(user.id) is None
+
+        # The invalidating worker keeps the entries it already knows are current
+        here.put(user)
+        here.sync_version(db)
+        assert here.get(user.id).full_name == "Renamed"
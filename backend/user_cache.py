@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import User
+from cache_versions import bump_version, read_version
+
+logger = logging.getLogger(__name__)
+
+# Row in cache_versions bumped when a user changes
+CACHE_NAME = "principals"
+VERSION_CHECK_INTERVAL = float(os.getenv("PRINCIPAL_CACHE_CHECK", "5"))  # seconds
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+
+def detached_copy(user: User) -> User:
+    """A column-only copy of user that belongs to no session.
+
+    The copy can be shared between requests: committing or closing the
+    session the user was loaded in never expires it, and it can still be
+    merged back into a session by primary key.
+    """
+    copy = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
+class PrincipalCache:
+    """Bounded TTL/LRU cache of authenticated users keyed by user id.
+
+    Each worker process keeps its own entries. They are dropped whenever the
+    shared version in cache_versions moves, which the caller checks with
+    sync_version() once version_check_due() says so.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = PRINCIPAL_CACHE_TTL,
+        max_entries: int = PRINCIPAL_CACHE_SIZE,
+        check_interval: float = VERSION_CHECK_INTERVAL,
+        name: str = CACHE_NAME
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        # Invalidation runs on database worker threads, lookups on the event loop
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._next_version_check = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def version_check_due(self) -> bool:
+        return time.monotonic() >= self._next_version_check
+
+    def sync_version(self, db: Session):
+        """Drop every entry if another worker has invalidated since the last check"""
+        version = read_version(db, self.name)
+        with self._lock:
+            self._next_version_check = time.monotonic() + self.check_interval
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+
+    def get(self, user_id: int) -> Optional[User]:
+        """Return the cached user, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: User) -> User:
+        """Cache a detached copy of user and return it"""
+        principal = detached_copy(user)
+        with self._lock:
+            self._entries[principal.id] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id: Optional[int] = None, db: Optional[Session] = None):
+        """Drop one user, or everyone when user_id is None.
+
+        With db, the shared version is bumped as well so that every other
+        worker drops its cached principals at its next version check. Call
+        it after the change has been committed.
+        """
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+        if db is None:
+            return
+        version = bump_version(db, self.name)
+        with self._lock:
+            # Our own entries are already current unless someone else bumped too
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def clear(self):
+        """Forget every entry and counter in this process only"""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            self._next_version_check = 0.0
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+principal_cache = PrincipalCache()